@@ -1,16 +1,145 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, send_file, jsonify, g, Response
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.datastructures import ContentRange
 import json
 import os
-from main import MCQGrader
+import shutil
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from csvexport import StoreCsvExport, iter_gzip
+from fileutil import remove_expired_results
+from instrument import metrics
+from jobs import JobStore, JobCache, JobQueue, job_status, DONE, FAILED
+from store import ResultsStore, is_results_store
+from streaming import iter_submissions
+from student_index import StudentIndex, build_csv_index, index_path, lookup_csv_row, read_csv_header
 
 app = Flask(__name__)
 app.secret_key = "mcq_grader_secret_key"  # For flash messages
 
+# Number of student records kept in the in-process feedback cache
+STUDENT_CACHE_SIZE = 4096
+
 # Ensure results directory exists
 RESULTS_DIR = "results"
 if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
 
+# Largest accepted request body; set MCQ_GRADER_MAX_UPLOAD_MB to change it
+MAX_UPLOAD_MB = int(os.environ.get('MCQ_GRADER_MAX_UPLOAD_MB', 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB << 20
+
+
+class UploadRequest(Request):
+    """Request that spools uploaded files straight to disk in the results directory"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Named, so that save_upload can link the upload into a job instead of copying it
+        return tempfile.NamedTemporaryFile('wb+', prefix='upload_', suffix='.tmp', dir=RESULTS_DIR)
+
+
+app.request_class = UploadRequest
+
+# Bytes read per chunk when compressing a results CSV on the fly
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Number of grading jobs run concurrently in background worker processes
+JOB_WORKERS = 2
+
+# Size limit of the cache of grading runs shared by all jobs
+RUN_CACHE_BYTES = 1 << 30
+
+# Number of finished jobs whose metadata is kept in memory
+JOB_CACHE_SIZE = 256
+
+# Finished jobs and result files older than this are deleted
+RESULTS_RETENTION_DAYS = 7
+
+# Minimum seconds between retention sweeps
+CLEANUP_INTERVAL = 3600
+
+# Set MCQ_GRADER_METRICS=1 to time every route and serve the results at /metrics
+METRICS_ENABLED = os.environ.get('MCQ_GRADER_METRICS') == '1'
+if METRICS_ENABLED:
+    metrics.enable()
+
+# Background grading jobs, recorded in a local SQLite database
+job_store = JobStore(os.path.join(RESULTS_DIR, 'jobs.db'))
+job_cache = JobCache(job_store, JOB_CACHE_SIZE)
+job_queue = JobQueue(job_store, os.path.join(RESULTS_DIR, 'jobs'), JOB_WORKERS,
+                     os.path.join(RESULTS_DIR, 'cache'), RUN_CACHE_BYTES)
+jobs_resumed = threading.Event()
+resume_lock = threading.Lock()
+last_cleanup = 0.0
+cleanup_lock = threading.Lock()
+
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the per-route metrics"""
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    """Record the request's wall time as a stage named after its route"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.record(f"route:{request.endpoint}", time.perf_counter() - started)
+    return response
+
+
+@app.before_request
+def resume_jobs():
+    """Recover jobs left by a previous server on the first request"""
+    # Done lazily because job worker processes re-import this module
+    if not jobs_resumed.is_set():
+        with resume_lock:
+            if not jobs_resumed.is_set():
+                job_queue.resume()
+                jobs_resumed.set()
+
+
+@app.before_request
+def remove_expired():
+    """Apply the results retention policy at most once per cleanup interval"""
+    global last_cleanup
+    if time.time() - last_cleanup < CLEANUP_INTERVAL or not cleanup_lock.acquire(blocking=False):
+        return
+    try:
+        last_cleanup = time.time()
+        max_age = RESULTS_RETENTION_DAYS * 24 * 3600
+        job_queue.remove_expired(max_age, job_cache)
+        remove_expired_results(RESULTS_DIR, max_age)
+    finally:
+        cleanup_lock.release()
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Reject uploads over the size limit"""
+    message = f'Upload exceeds the {MAX_UPLOAD_MB} MB limit'
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(error=message), 413
+    flash(message, 'error')
+    return redirect(url_for('grade'))
+
+
+def save_upload(upload, path):
+    """Move an uploaded file to path, linking its spooled file rather than copying it when possible"""
+    spooled = getattr(upload.stream, 'name', None)
+    if isinstance(spooled, str):
+        upload.stream.flush()
+        try:
+            os.link(spooled, path)
+            return
+        except OSError:
+            pass
+    upload.save(path)
+
 
 @app.route('/')
 def index():
@@ -34,135 +163,306 @@ def grade():
         if answer_key_file.filename == '' or submissions_file.filename == '':
             flash('Both files must be selected', 'error')
             return redirect(request.url)
-            
+        
+        job_id, job_dir = job_queue.new_job_dir()
+        
         try:
-            # Load JSON data
-            answer_key = json.load(answer_key_file)
-            submissions = json.load(submissions_file)
+            # Save the uploads for the background job; small JSON inputs are validated now
+            answer_key_path = os.path.join(job_dir, 'answer_key.json')
+            save_upload(answer_key_file, answer_key_path)
+            with open(answer_key_path, 'r') as f:
+                json.load(f)
+            
+            # Only the first submission is parsed here; the job streams the rest in batches
+            submissions_path = os.path.join(job_dir, 'submissions.json')
+            save_upload(submissions_file, submissions_path)
+            with open(submissions_path, 'r') as f:
+                if next(iter_submissions(f), None) is None:
+                    raise ValueError('The submissions file is empty')
             
             # Optional question text file
-            question_text = {}
+            question_text_path = None
             if 'question_text' in request.files and request.files['question_text'].filename != '':
-                question_text = json.load(request.files['question_text'])
-            
-            # Initialize grader and process submissions
-            grader = MCQGrader(answer_key)
-            results = grader.grade_batch(submissions)
-            stats = grader.generate_statistics(results)
-            
-            # Export results
-            csv_path = grader.export_results_csv(results)
-            json_path = grader.export_statistics_json(stats)
-            
-            # Save file paths to session for download links
-            session_data = {
-                'csv_path': csv_path,
-                'json_path': json_path,
-                'results': results,
-                'stats': stats,
-                'question_text': question_text
-            }
+                question_text_path = os.path.join(job_dir, 'question_text.json')
+                save_upload(request.files['question_text'], question_text_path)
+                with open(question_text_path, 'r') as f:
+                    json.load(f)
             
-            # Store in a temporary file
-            session_file = os.path.join(RESULTS_DIR, 'session_data.json')
-            with open(session_file, 'w') as f:
-                # Convert non-serializable data
-                serializable_data = {
-                    'csv_path': csv_path,
-                    'json_path': json_path,
-                    'results_count': len(results),
-                    'stats_summary': {
-                        'average_score': stats['average_score'],
-                        'highest_score': stats['highest_score'],
-                        'lowest_score': stats['lowest_score'],
-                        'total_submissions': stats['total_submissions']
-                    }
-                }
-                json.dump(serializable_data, f)
-            
-            flash('Grading completed successfully!', 'success')
-            return redirect(url_for('results'))
+            job_queue.enqueue(job_id, job_dir, answer_key_path, submissions_path, question_text_path)
             
         except Exception as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
             flash(f'Error processing files: {str(e)}', 'error')
             return redirect(request.url)
+        
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(job_id=job_id, status_url=url_for('job_status_api', job_id=job_id)), 202
+        
+        flash('Grading started', 'success')
+        return redirect(url_for('job_results', job_id=job_id))
     
     # GET request - show the form
     return render_template('grade.html')
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Per-route and job metrics in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return 'Metrics are disabled', 404
+    
+    text = metrics.prometheus() + job_store.prometheus()
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+def job_session_data(job):
+    """Results metadata of a finished job, as shown on the results page"""
+    return {
+        'job_id': job['id'],
+        'results_path': job['results_path'] or job['csv_path'],
+        'json_path': job['json_path'],
+        'results_count': job['rows_graded'],
+        'stats_summary': job['summary'],
+    }
+
+
+def latest_session_data():
+    """Results metadata of the most recently started finished job, or None"""
+    job = job_store.latest(DONE)
+    return job_session_data(job_cache.get(job['id'])) if job else None
+
+
+def finished_session_data(job_id):
+    """Results metadata of a finished job, or None if it is unknown or not done"""
+    job = job_cache.get(job_id)
+    if job is None or job['status'] != DONE:
+        return None
+    return job_session_data(job)
+
+
+@app.route('/jobs/<job_id>')
+def job_status_api(job_id):
+    """Report a grading job's status, rows graded and ETA"""
+    job = job_cache.get(job_id)
+    
+    if job is None:
+        return jsonify(error='Job not found'), 404
+    
+    status = job_status(job)
+    status['results_url'] = url_for('job_results', job_id=job_id)
+    return jsonify(status)
+
+
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    """Display a job's results, or its progress while it is still grading"""
+    job = job_cache.get(job_id)
+    
+    if job is None:
+        flash('Grading job not found', 'error')
+        return redirect(url_for('grade'))
+    
+    if job['status'] == FAILED:
+        flash(f"Error processing files: {job['error']}", 'error')
+        return redirect(url_for('grade'))
+    
+    if job['status'] != DONE:
+        return render_template('job.html', job=job_status(job))
+    
+    return render_template('results.html', data=job_session_data(job))
+
+
 @app.route('/results')
 def results():
-    """Display grading results and statistics"""
-    session_file = os.path.join(RESULTS_DIR, 'session_data.json')
+    """Display the most recent grading results and statistics"""
+    session_data = latest_session_data()
     
-    if not os.path.exists(session_file):
+    if session_data is None:
         flash('No grading results available', 'error')
         return redirect(url_for('grade'))
-        
-    with open(session_file, 'r') as f:
-        session_data = json.load(f)
     
-    return render_template('results.html', data=session_data)
+    return redirect(url_for('job_results', job_id=session_data['job_id']))
+
+
+def send_result_file(session_data, file_type):
+    """Send one of a job's result files, or redirect back to its results"""
+    if file_type == 'json':
+        file_path = session_data.get('json_path')
+        if file_path and os.path.exists(file_path):
+            return send_file(file_path, as_attachment=True)
+    elif file_type in ('csv', 'csv.gz'):
+        file_path = session_data.get('results_path')
+        if file_path and os.path.exists(file_path):
+            if file_type == 'csv' and not is_results_store(file_path):
+                return send_file(file_path, as_attachment=True)
+            return stream_results_csv(file_path, compress=file_type == 'csv.gz')
+    
+    flash('Requested file not found', 'error')
+    return redirect(url_for('job_results', job_id=session_data['job_id']))
+
+
+def iter_file_chunks(path):
+    """Read a file in chunks"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_results_csv(results_path, compress):
+    """Stream a job's results CSV as the client reads it, rendered from the results store"""
+    export = StoreCsvExport(results_path) if is_results_store(results_path) else None
+    if export is not None:
+        etag = export.etag
+    else:
+        stat = os.stat(results_path)
+        etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    if compress:
+        etag += '-gz'
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif compress:
+        chunks = export.iter_bytes() if export is not None else iter_file_chunks(results_path)
+        response = Response(iter_gzip(chunks), mimetype='application/gzip')
+    else:
+        response = csv_range_response(export, etag)
+    
+    response.set_etag(etag)
+    filename = os.path.splitext(os.path.basename(results_path))[0] + ('.csv.gz' if compress else '.csv')
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
+
+def csv_range_response(export, etag):
+    """Full or single byte-range response of a CSV export, so interrupted downloads can resume"""
+    byte_range = request.range
+    # A range only applies if the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if byte_range is None or len(byte_range.ranges) != 1 or (if_range and request.if_range.etag != etag):
+        response = Response(export.iter_bytes(), mimetype='text/csv')
+        if export.length is not None:
+            response.content_length = export.length
+    else:
+        length = int(export.offsets()[-1])
+        span = byte_range.range_for_length(length)
+        if span is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{length}'
+        else:
+            start, stop = span
+            response = Response(export.iter_bytes(start, stop), status=206, mimetype='text/csv')
+            response.content_range = ContentRange('bytes', start, stop, length)
+            response.content_length = stop - start
+    
+    response.accept_ranges = 'bytes'
+    return response
+
+
+@app.route('/download/<job_id>/<file_type>')
+def job_download(job_id, file_type):
+    """Download one of a job's result files"""
+    session_data = finished_session_data(job_id)
+    
+    if session_data is None:
+        flash('No files available for download', 'error')
+        return redirect(url_for('index'))
+    
+    return send_result_file(session_data, file_type)
 
 
 @app.route('/download/<file_type>')
 def download(file_type):
-    """Download result files"""
-    session_file = os.path.join(RESULTS_DIR, 'session_data.json')
+    """Download result files of the most recent job"""
+    session_data = latest_session_data()
     
-    if not os.path.exists(session_file):
+    if session_data is None:
         flash('No files available for download', 'error')
         return redirect(url_for('index'))
-        
-    with open(session_file, 'r') as f:
-        session_data = json.load(f)
     
-    if file_type == 'csv':
-        file_path = session_data.get('csv_path')
-        if file_path and os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+    return send_result_file(session_data, file_type)
+
+
+def render_student_feedback(session_data, student_id):
+    """Render one student's feedback from a job's results"""
+    results_path = session_data.get('results_path')
+    if not results_path or not os.path.exists(results_path):
+        flash('Result data not found', 'error')
+        return redirect(url_for('job_results', job_id=session_data['job_id']))
     
-    elif file_type == 'json':
-        file_path = session_data.get('json_path')
-        if file_path and os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+    # Seek straight to the student's row through the results index
+    student_data = load_student_record(results_path, os.stat(results_path).st_mtime_ns, student_id)
     
-    flash('Requested file not found', 'error')
-    return redirect(url_for('results'))
+    if student_data is None:
+        flash(f'Student {student_id} not found', 'error')
+        return redirect(url_for('job_results', job_id=session_data['job_id']))
+    
+    return render_template('student.html', student=student_data, job_id=session_data['job_id'])
 
 
-@app.route('/student/<student_id>')
-def student_feedback(student_id):
-    """Generate feedback for a specific student"""
-    session_file = os.path.join(RESULTS_DIR, 'session_data.json')
+@app.route('/student/<job_id>/<student_id>')
+def job_student_feedback(job_id, student_id):
+    """Generate feedback for a specific student of a job"""
+    session_data = finished_session_data(job_id)
     
-    if not os.path.exists(session_file):
+    if session_data is None:
         flash('No grading data available', 'error')
         return redirect(url_for('index'))
     
-    # Since we can't store full results in session, we need to re-read the CSV
-    with open(session_file, 'r') as f:
-        session_data = json.load(f)
-    
-    csv_path = session_data.get('csv_path')
-    if not csv_path or not os.path.exists(csv_path):
-        flash('Result data not found', 'error')
-        return redirect(url_for('results'))
+    return render_student_feedback(session_data, student_id)
+
+
+@app.route('/student/<student_id>')
+def student_feedback(student_id):
+    """Generate feedback for a specific student of the most recent job"""
+    session_data = latest_session_data()
     
-    # Load the CSV and find the student
-    import pandas as pd
-    df = pd.read_csv(csv_path)
-    student_row = df[df['Student ID'] == student_id]
+    if session_data is None:
+        flash('No grading data available', 'error')
+        return redirect(url_for('index'))
     
-    if student_row.empty:
-        flash(f'Student {student_id} not found', 'error')
-        return redirect(url_for('results'))
+    return render_student_feedback(session_data, student_id)
+
+
+@lru_cache(maxsize=16)
+def open_student_index(csv_path, mtime_ns):
+    """Open (building if needed) the student index of a results CSV"""
+    idx_path = index_path(csv_path)
+    if not os.path.exists(idx_path) or os.stat(idx_path).st_mtime_ns < mtime_ns:
+        build_csv_index(csv_path)
+    return StudentIndex(idx_path), read_csv_header(csv_path)
+
+
+@lru_cache(maxsize=16)
+def open_results_store(store_path, mtime_ns):
+    """Open a binary results store, keeping recently used stores mapped"""
+    return ResultsStore(store_path)
+
+
+@lru_cache(maxsize=STUDENT_CACHE_SIZE)
+def load_student_record(results_path, mtime_ns, student_id):
+    """Load one student's results row, caching hot records per file version"""
+    if is_results_store(results_path):
+        store = open_results_store(results_path, mtime_ns)
+        row_index = store.find(student_id)
+        if row_index is None:
+            return None
+        batch = store.batch(row_index, row_index + 1)
+        header, row = batch.key.csv_header(), next(batch.iter_csv_rows())
+    else:
+        index, header = open_student_index(results_path, mtime_ns)
+        row = lookup_csv_row(results_path, student_id, index)
     
-    # Extract student data
-    student_data = student_row.iloc[0].to_dict()
+    if row is None:
+        return None
     
-    return render_template('student.html', student=student_data)
+    student_data = dict(zip(header, row))
+    student_data['Questions Attempted'] = int(student_data['Questions Attempted'])
+    student_data['Correct Answers'] = int(student_data['Correct Answers'])
+    student_data['Score (%)'] = float(student_data['Score (%)'])
+    return student_data
 
 
 if __name__ == '__main__':
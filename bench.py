@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Benchmark the grading pipeline on synthetic cohorts.
+
+Each stage (load, grade_batch, generate_statistics, export_results_csv,
+export_statistics_json, generate_feedback) is timed separately and reported as
+throughput in rows per second, together with its peak traced memory. Results
+can be saved as a JSON baseline and compared against later runs:
+
+    python bench.py --students 100000 --save baseline.json
+    python bench.py --students 100000 --compare baseline.json
+
+--startup instead times cold command-line runs on a small cohort, each in a
+fresh interpreter, against a startup time target.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from typing import List, Dict, Any, Callable, Tuple
+
+from instrument import peak_rss_bytes
+from main import MCQGrader
+
+OPTION_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+# Wall time a cold CLI run on a small cohort should stay under
+STARTUP_TARGET_MS = 100.0
+
+
+def generate_cohort(students: int, questions: int, options: int = 4, blank_rate: float = 0.05,
+                    id_skew: float = 0.0, seed: int = 0) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """
+    Generate a synthetic answer key and submissions.
+
+    Each student has an ability drawn uniformly from [0, 1] and answers each
+    question correctly with that probability, otherwise picking a random
+    option; answers are left out at the blank rate.
+
+    Args:
+        students: Number of submissions
+        questions: Number of questions in the answer key
+        options: Number of answer options per question
+        blank_rate: Probability that a question is left unanswered
+        id_skew: Zipf exponent for drawing student IDs from the roster, so that
+            some students submit more than once; 0 gives every submission a unique ID
+        seed: Random seed, so that a configuration always produces the same cohort
+
+    Returns:
+        Tuple of (answer key, list of submissions)
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(OPTION_LETTERS[:options]))
+    question_ids = [str(q) for q in range(1, questions + 1)]
+
+    key_choices = rng.integers(0, options, questions)
+    answer_key = dict(zip(question_ids, letters[key_choices].tolist()))
+
+    ability = rng.random((students, 1))
+    correct = rng.random((students, questions)) < ability
+    choices = np.where(correct, key_choices, rng.integers(0, options, (students, questions)))
+    answered = rng.random((students, questions)) >= blank_rate
+
+    if id_skew > 0:
+        ranks = np.arange(1, students + 1, dtype=np.float64)
+        weights = ranks ** -id_skew
+        roster = rng.choice(students, size=students, p=weights / weights.sum())
+    else:
+        roster = np.arange(students)
+
+    submissions = []
+    for i, (row, mask) in enumerate(zip(letters[choices].tolist(), answered.tolist())):
+        submissions.append({
+            "student_id": f"S{roster[i]:07d}",
+            "answers": {q_id: answer for q_id, answer, keep in zip(question_ids, row, mask) if keep},
+        })
+
+    return answer_key, submissions
+
+
+def measure(func: Callable[[], Any], repeat: int, trace_memory: bool) -> Tuple[Any, float, int]:
+    """
+    Time a stage and optionally record its peak traced memory.
+
+    Args:
+        func: Stage to run
+        repeat: Number of timed runs; the fastest is reported
+        trace_memory: Run once more under tracemalloc to find the peak allocation
+
+    Returns:
+        Tuple of (result of the last run, best seconds, peak bytes or None)
+    """
+    best = float("inf")
+    result = None
+
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result, best, peak
+
+
+def run_benchmark(config: Dict[str, Any], repeat: int = 3, trace_memory: bool = True) -> Dict[str, Any]:
+    """
+    Run every pipeline stage on a synthetic cohort.
+
+    Args:
+        config: Cohort parameters accepted by generate_cohort
+        repeat: Number of timed runs per stage
+        trace_memory: Also record peak traced memory per stage
+
+    Returns:
+        Report with the configuration, environment and per-stage measurements
+    """
+    answer_key, submissions = generate_cohort(**config)
+    stages = {}
+
+    with tempfile.TemporaryDirectory(prefix="mcq-bench-") as work_dir:
+        submissions_path = os.path.join(work_dir, "submissions.json")
+        with open(submissions_path, 'w') as f:
+            json.dump(submissions, f)
+        del submissions
+
+        grader = MCQGrader(answer_key)
+        grader.results_dir = work_dir
+
+        def load():
+            with open(submissions_path, 'r') as f:
+                return json.load(f)
+
+        submissions, seconds, peak = measure(load, repeat, trace_memory)
+        stages["load"] = (seconds, peak)
+
+        results, seconds, peak = measure(lambda: grader.grade_batch(submissions, compact=True), repeat, trace_memory)
+        stages["grade_batch"] = (seconds, peak)
+
+        stats, seconds, peak = measure(lambda: grader.generate_statistics(results), repeat, trace_memory)
+        stages["generate_statistics"] = (seconds, peak)
+
+        _, seconds, peak = measure(lambda: grader.export_results_csv(results, "results.csv"), repeat, trace_memory)
+        stages["export_results_csv"] = (seconds, peak)
+
+        _, seconds, peak = measure(lambda: grader.export_statistics_json(stats, "statistics.json"),
+                                   repeat, trace_memory)
+        stages["export_statistics_json"] = (seconds, peak)
+
+        _, seconds, peak = measure(lambda: [grader.generate_feedback(result) for result in results],
+                                   repeat, trace_memory)
+        stages["generate_feedback"] = (seconds, peak)
+
+    rows = len(results)
+    return {
+        "config": config,
+        "repeat": repeat,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+        "stages": {
+            name: {
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds > 0 else None,
+                "peak_bytes": peak,
+            }
+            for name, (seconds, peak) in stages.items()
+        },
+    }
+
+
+def _cold_run(command: List[str], cwd: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def _slowest_imports(command: List[str], cwd: str, count: int) -> List[Tuple[str, float]]:
+    """Top-level modules with the largest cumulative import time, from -X importtime."""
+    output = subprocess.run([command[0], "-X", "importtime"] + command[1:], cwd=cwd, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    imports = []
+    for line in output.splitlines():
+        parts = line.split("|")
+        # Top-level imports are indented by a single space
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith("  "):
+            imports.append((parts[2].strip(), int(parts[1]) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def run_startup_benchmark(config: Dict[str, Any], runs: int = 10) -> Dict[str, Any]:
+    """
+    Time cold command-line runs grading a small cohort.
+
+    Every run starts a fresh interpreter, so module imports are included. A
+    bare interpreter start is timed the same way as a floor for comparison.
+
+    Args:
+        config: Cohort parameters accepted by generate_cohort
+        runs: Number of cold runs; the median and fastest are reported
+
+    Returns:
+        Report with the configuration, environment, timings and slowest imports
+    """
+    answer_key, submissions = generate_cohort(**config)
+
+    with tempfile.TemporaryDirectory(prefix="mcq-bench-") as work_dir:
+        key_path = os.path.join(work_dir, "answer_key.json")
+        submissions_path = os.path.join(work_dir, "submissions.json")
+        with open(key_path, 'w') as f:
+            json.dump(answer_key, f)
+        with open(submissions_path, 'w') as f:
+            json.dump(submissions, f)
+
+        command = [sys.executable, CLI_PATH, "--answer-key", key_path, "--submissions", submissions_path,
+                   "--output-dir", os.path.join(work_dir, "out"), "--no-cache", "--no-daemon"]
+
+        # One warm-up run so the timings do not include writing bytecode caches
+        _cold_run(command, work_dir)
+        seconds = [_cold_run(command, work_dir) for _ in range(runs)]
+        interpreter = [_cold_run([sys.executable, "-c", "pass"], work_dir) for _ in range(runs)]
+        imports = _slowest_imports(command, work_dir, 10)
+
+    return {
+        "config": config,
+        "runs": runs,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "median_seconds": statistics.median(seconds),
+        "best_seconds": min(seconds),
+        "interpreter_seconds": statistics.median(interpreter),
+        "slowest_imports": imports,
+    }
+
+
+def print_startup_report(report: Dict[str, Any], target_ms: float) -> None:
+    """Print the timings of a startup benchmark report"""
+    config = report["config"]
+    print(f"Cold CLI run, {config['students']} students x {config['questions']} questions, "
+          f"{report['runs']} runs")
+    print(f"{'Median':<24}{report['median_seconds'] * 1000:>10.1f} ms (target {target_ms:.0f} ms)")
+    print(f"{'Fastest':<24}{report['best_seconds'] * 1000:>10.1f} ms")
+    print(f"{'Bare interpreter':<24}{report['interpreter_seconds'] * 1000:>10.1f} ms")
+    print("Slowest top-level imports:")
+    for name, seconds in report["slowest_imports"]:
+        print(f"  {name:<22}{seconds * 1000:>10.1f} ms")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Find stages that got slower than a baseline.
+
+    Args:
+        report: Report from run_benchmark
+        baseline: Earlier report to compare against
+        tolerance: Allowed slowdown as a fraction, e.g. 0.2 for 20%
+
+    Returns:
+        One message per regressed stage
+    """
+    regressions = []
+    for name, stage in report["stages"].items():
+        before = baseline["stages"].get(name)
+        if before and stage["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {before['seconds']:.4f}s -> {stage['seconds']:.4f}s "
+                               f"({stage['seconds'] / before['seconds'] - 1:+.0%})")
+    return regressions
+
+
+def format_bytes(n: int) -> str:
+    """Human-readable byte count"""
+    if n is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Print a per-stage table of a benchmark report"""
+    config = report["config"]
+    print(f"{config['students']} students x {config['questions']} questions, "
+          f"{config['options']} options, blank rate {config['blank_rate']}, ID skew {config['id_skew']}")
+    print(f"{'Stage':<24}{'Seconds':>10}{'Rows/s':>14}{'Peak memory':>14}")
+    for name, stage in report["stages"].items():
+        rate = stage["rows_per_second"]
+        print(f"{name:<24}{stage['seconds']:>10.4f}{rate or 0:>14,.0f}{format_bytes(stage['peak_bytes']):>14}")
+    print(f"Peak RSS: {format_bytes(report['peak_rss_bytes'])}")
+
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description="MCQ Grader AI - Pipeline benchmark")
+    parser.add_argument('--students', type=int, default=10000, help='Number of synthetic submissions')
+    parser.add_argument('--questions', type=int, default=50, help='Number of questions')
+    parser.add_argument('--options', type=int, default=4, help='Answer options per question')
+    parser.add_argument('--blank-rate', type=float, default=0.05, help='Probability a question is left blank')
+    parser.add_argument('--id-skew', type=float, default=0.0,
+                        help='Zipf exponent for repeated student IDs (0 for unique IDs)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage; the fastest is reported')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced peak memory run per stage')
+    parser.add_argument('--save', help='Write the report as a JSON baseline')
+    parser.add_argument('--compare', help='Compare against a JSON baseline and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline as a fraction')
+    parser.add_argument('--write-cohort', metavar='DIR',
+                        help='Only write the synthetic answer_key.json and submissions.json to DIR')
+    parser.add_argument('--startup', action='store_true',
+                        help='Time cold CLI runs on the cohort (use a small one) instead of the pipeline stages')
+    parser.add_argument('--startup-target-ms', type=float, default=STARTUP_TARGET_MS,
+                        help='With --startup, fail if the median cold run is slower than this')
+
+    args = parser.parse_args()
+
+    config = {
+        "students": args.students,
+        "questions": args.questions,
+        "options": args.options,
+        "blank_rate": args.blank_rate,
+        "id_skew": args.id_skew,
+        "seed": args.seed,
+    }
+
+    if not 1 <= args.options <= len(OPTION_LETTERS):
+        print(f"Error: --options must be between 1 and {len(OPTION_LETTERS)}")
+        sys.exit(1)
+
+    if args.write_cohort:
+        answer_key, submissions = generate_cohort(**config)
+        os.makedirs(args.write_cohort, exist_ok=True)
+        with open(os.path.join(args.write_cohort, 'answer_key.json'), 'w') as f:
+            json.dump(answer_key, f, indent=2)
+        with open(os.path.join(args.write_cohort, 'submissions.json'), 'w') as f:
+            json.dump(submissions, f)
+        print(f"Cohort written to: {args.write_cohort}")
+        return
+
+    if args.startup:
+        report = run_startup_benchmark(config, max(args.repeat, 1))
+        print_startup_report(report, args.startup_target_ms)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Report saved to: {args.save}")
+        if report["median_seconds"] * 1000 > args.startup_target_ms:
+            print(f"\nCold CLI run is slower than the {args.startup_target_ms:.0f} ms target")
+            sys.exit(1)
+        return
+
+    report = run_benchmark(config, args.repeat, not args.no_memory)
+    print_report(report)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to: {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("Warning: baseline was recorded with a different cohort configuration")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,18 @@ import argparse
 import json
 import os
 import sys
-from main import MCQGrader
+from daemon import DaemonError, DaemonUnavailable, request
+from instrument import metrics
 
 
 def load_json_file(file_path):
     """Load and validate a JSON file"""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        with metrics.stage("load_json") as record, open(file_path, 'r') as f:
+            data = json.load(f)
+            if record and isinstance(data, list):
+                record.rows = len(data)
+            return data
     except FileNotFoundError:
         print(f"Error: File not found: {file_path}")
         sys.exit(1)
@@ -19,50 +23,334 @@ def load_json_file(file_path):
         sys.exit(1)
 
 
-def main():
-    """Main CLI function"""
+def update_statistics(grader, args):
+    """Fold late or re-submitted papers into previously exported statistics"""
+    try:
+        accumulator = grader.load_accumulator(args.update_stats)
+    except FileNotFoundError:
+        print(f"Error: No saved accumulator for {args.update_stats} (grade with --save-accumulator first)")
+        sys.exit(1)
+    
+    submissions = load_json_file(args.submissions)
+    
+    for submission in submissions:
+        student_id = submission.get("student_id")
+        answers = submission.get("answers", {})
+        
+        if student_id and answers:
+            accumulator.replace_result(grader.grade_submission(student_id, answers))
+    
+    stats = accumulator.to_statistics(args.extended_stats)
+    
+    # Overwrite the statistics and accumulator in place
+    grader.results_dir = os.path.dirname(args.update_stats)
+    json_path = grader.export_statistics_json(stats, os.path.basename(args.update_stats))
+    grader.export_accumulator(accumulator, json_path)
+    print(f"Updated statistics with {len(submissions)} submissions: {json_path}")
+
+
+def regrade_results(grader, args):
+    """Re-grade a binary results store in place after answer key corrections"""
+    questions = [q_id.strip() for q_id in args.changed_questions.split(",")] if args.changed_questions else None
+    
+    try:
+        changed, students, stats = grader.regrade(args.regrade, questions, args.regrade_stats)
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    if not changed:
+        print(f"The answer key matches {args.regrade}; nothing to re-grade")
+        return
+    
+    print(f"Re-graded question(s) {', '.join(changed)}: results of {students} students changed")
+    print(f"Results updated: {args.regrade}")
+    if stats is not None:
+        print(f"Statistics updated: {args.regrade_stats}")
+        print(f"Average score: {stats['average_score']:.1f}%")
+
+
+def build_parser():
+    """Command line arguments of the CLI, shared with the grading daemon"""
     parser = argparse.ArgumentParser(description="MCQ Grader AI - Command Line Interface")
     
     # Required arguments
-    parser.add_argument('--answer-key', required=True, help='Path to answer key JSON file')
-    parser.add_argument('--submissions', required=True, help='Path to student submissions JSON file')
+    parser.add_argument('--answer-key', help='Path to answer key JSON file')
+    parser.add_argument('--submissions', help='Path to student submissions JSON file')
+    parser.add_argument('--manifest',
+                        help='Grade every exam listed in a CSV manifest with exam, answer_key and submissions '
+                             'columns, instead of --answer-key and --submissions')
     
     # Optional arguments
     parser.add_argument('--question-text', help='Path to question text JSON file')
+    parser.add_argument('--scoring',
+                        help='Path to scoring rules JSON file (question weights, negative marking, partial credit '
+                             'for multi-select answers, voided questions)')
     parser.add_argument('--output-dir', default='results', help='Directory for output files')
-    parser.add_argument('--results-csv', help='Filename for results CSV')
+    parser.add_argument('--results-csv', help='Filename for results CSV (or binary store with --format binary)')
+    parser.add_argument('--format', choices=['csv', 'binary'], default='csv',
+                        help='Results file format: wide CSV or memory-mappable columnar binary store')
     parser.add_argument('--stats-json', help='Filename for statistics JSON')
     parser.add_argument('--student-id', help='Generate feedback for specific student ID')
+    parser.add_argument('--feedback', action='store_true',
+                        help='Write a feedback report for every student, with a manifest, to a directory')
+    parser.add_argument('--feedback-archive', action='store_true',
+                        help='Write the feedback reports to a zip archive instead of a directory')
+    parser.add_argument('--extended-stats', action='store_true',
+                        help='Include standard deviation, percentiles, a score histogram and item analysis '
+                             '(distractors, discrimination, point-biserial, KR-20) in the statistics')
+    parser.add_argument('--stream', action='store_true',
+                        help='Grade the submissions file incrementally (JSON array or JSON Lines) with flat memory use')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Submissions graded per chunk in --stream and --workers modes')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to grade with (0 for one per CPU)')
+    parser.add_argument('--save-accumulator', action='store_true',
+                        help='Save incremental statistics state next to the statistics JSON '
+                             '(item analysis is left out, since it cannot be updated per student; '
+                             'a student submitted more than once counts with their last paper)')
+    parser.add_argument('--update-stats',
+                        help='Fold the submissions into a previously exported statistics JSON, '
+                             'replacing earlier papers from the same students')
+    parser.add_argument('--regrade', metavar='RESULTS',
+                        help='Re-grade a binary results store in place with the corrected --answer-key, '
+                             'without the submissions')
+    parser.add_argument('--changed-questions',
+                        help='Comma-separated IDs of the corrected questions for --regrade '
+                             '(detected from the store by default)')
+    parser.add_argument('--regrade-stats', metavar='STATS_JSON',
+                        help='Statistics JSON of the store to update along with --regrade')
+    parser.add_argument('--collusion', action='store_true',
+                        help='Scan the results for pairs of students with suspiciously similar wrong answers and '
+                             'write a ranked report next to the statistics JSON')
+    parser.add_argument('--collusion-min-shared', type=int,
+                        help='Identical wrong answers a pair needs to be reported by --collusion (default 5)')
+    parser.add_argument('--collusion-min-similarity', type=float,
+                        help='Jaccard similarity of the wrong answers a pair needs to be reported by --collusion '
+                             '(default 0.5)')
+    parser.add_argument('--cache-dir',
+                        help='Directory of the grading run cache (defaults to a cache folder in the output directory)')
+    parser.add_argument('--cache-size-mb', type=int, default=1024,
+                        help='Size limit of the grading run cache; least recently used runs are evicted')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always grade, without reusing or caching earlier runs of the same inputs')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print wall time, rows, peak allocations and peak RSS per grading stage')
+    parser.add_argument('--profile-output',
+                        help='With --profile, also dump cProfile statistics to this file (read with pstats)')
+    parser.add_argument('--daemon-socket',
+                        help='Socket of the grading daemon (defaults to $MCQ_GRADER_SOCKET or a per-user path)')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Grade in this process even if a grading daemon is running')
+    
+    return parser
+
+
+def forward_to_daemon(args):
+    """Run the command line in the grading daemon if one is running; returns False if none is"""
+    try:
+        response = request({"op": "cli", "argv": sys.argv[1:], "cwd": os.getcwd()}, args.daemon_socket)
+    except DaemonUnavailable:
+        return False
+    except DaemonError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    sys.stdout.write(response["output"])
+    if response["status"]:
+        sys.exit(response["status"])
+    return True
+
+
+def grade_manifest(args, workers, make_grader=None):
+    """Grade every exam of a manifest and write the combined statistics"""
+    from exams import grade_exams
+    
+    def report(exam, outcome):
+        if "error" in outcome:
+            print(f"  {exam}: failed: {outcome['error']}")
+        else:
+            stats = outcome["statistics"]
+            print(f"  {exam}: {stats['total_submissions']} submissions, average {stats['average_score']:.1f}%")
     
+    print(f"Grading the exams listed in {args.manifest}...")
+    try:
+        combined_path, combined = grade_exams(args.manifest, args.output_dir, workers, args.extended_stats,
+                                              args.format, args.chunk_size, make_grader, report)
+    except FileNotFoundError:
+        print(f"Error: File not found: {args.manifest}")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    print(f"Combined statistics exported to: {combined_path}")
+    
+    overall = combined["overall"]
+    print("\nSummary:")
+    print(f"Exams graded: {combined['total_exams'] - combined['failed_exams']} of {combined['total_exams']}")
+    if "error" not in overall:
+        print(f"Total submissions: {overall['total_submissions']}")
+        print(f"Average score: {overall['average_score']:.1f}%")
+    
+    if combined["failed_exams"]:
+        sys.exit(1)
+
+
+def main():
+    """Main CLI function"""
+    parser = build_parser()
     args = parser.parse_args()
+    if not args.manifest and not (args.answer_key and (args.submissions or args.regrade)):
+        parser.error("--answer-key and --submissions (or --regrade) are required unless --manifest is given")
+    if args.collusion_min_shared is not None and args.collusion_min_shared < 1:
+        parser.error("--collusion-min-shared must be at least 1")
+    if args.collusion_min_similarity is not None and not 0 < args.collusion_min_similarity <= 1:
+        parser.error("--collusion-min-similarity must be above 0 and at most 1")
+    
+    if not args.profile:
+        # Profiles describe this process, so profiled runs are never forwarded
+        if args.no_daemon or not forward_to_daemon(args):
+            run(args)
+        return
+    
+    import cProfile
+    
+    metrics.enable(trace_allocations=True)
+    profiler = cProfile.Profile() if args.profile_output else None
+    if profiler:
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_output)
+        print("\nProfile:")
+        print(metrics.format_breakdown())
+        if profiler:
+            print(f"cProfile statistics written to: {args.profile_output}")
+
+
+def run(args, make_grader=None):
+    """Grade submissions as requested on the command line, with graders from make_grader if given"""
+    from main import MCQGrader
+    from runcache import RunCache
+    
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    
+    if args.manifest:
+        grade_manifest(args, workers, make_grader)
+        return
     
     # Load files
     answer_key = load_json_file(args.answer_key)
-    submissions = load_json_file(args.submissions)
     question_text = load_json_file(args.question_text) if args.question_text else None
+    scoring = load_json_file(args.scoring) if args.scoring else None
     
     # Ensure output directory exists
     os.makedirs(args.output_dir, exist_ok=True)
     
     # Initialize grader and process submissions
-    grader = MCQGrader(answer_key)
+    try:
+        grader = (make_grader or MCQGrader)(answer_key, scoring)
+        # Compile the scoring rules now, so mistakes in them are reported before any grading
+        grader.encoded_key
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     
     # Set results directory
     grader.results_dir = args.output_dir
     
-    # Process submissions
-    print(f"Processing {len(submissions)} submissions...")
-    results = grader.grade_batch(submissions)
+    if args.update_stats:
+        update_statistics(grader, args)
+        return
     
-    # Export results
-    csv_path = grader.export_results_csv(results, args.results_csv)
-    print(f"Results exported to: {csv_path}")
+    if args.regrade:
+        regrade_results(grader, args)
+        return
     
-    # Generate and export statistics
-    stats = grader.generate_statistics(results)
-    json_path = grader.export_statistics_json(stats, args.stats_json)
+    # Cached runs have fixed output names and must not be updated in place
+    use_cache = not (args.no_cache or args.save_accumulator or args.results_csv or args.stats_json)
+    json_path = None
+    
+    if use_cache:
+        cache = RunCache(args.cache_dir or os.path.join(args.output_dir, 'cache'), args.cache_size_mb << 20)
+        
+        print(f"Grading submissions from {args.submissions}...")
+        try:
+            results_path, json_path, stats, hit = grader.grade_cached(args.submissions, cache, args.chunk_size,
+                                                                      args.extended_stats, workers, args.format)
+        except FileNotFoundError:
+            print(f"Error: File not found: {args.submissions}")
+            sys.exit(1)
+        except json.JSONDecodeError:
+            print(f"Error: Invalid JSON format in file: {args.submissions}")
+            sys.exit(1)
+        
+        if hit:
+            print("Identical inputs were graded before; reusing the cached run")
+        # Link the outputs out of the cache, so evicting the run later leaves them in place
+        results_path, json_path = cache.link_into(results_path, json_path, args.output_dir)
+        print(f"Results exported to: {results_path}")
+    elif args.stream:
+        print(f"Streaming submissions from {args.submissions}...")
+        try:
+            results_path, stats = grader.grade_stream(args.submissions, args.results_csv, args.chunk_size,
+                                                      args.extended_stats, None, workers, args.format)
+        except FileNotFoundError:
+            print(f"Error: File not found: {args.submissions}")
+            sys.exit(1)
+        except json.JSONDecodeError:
+            print(f"Error: Invalid JSON format in file: {args.submissions}")
+            sys.exit(1)
+        print(f"Results exported to: {results_path}")
+    else:
+        submissions = load_json_file(args.submissions)
+        
+        # Process submissions
+        print(f"Processing {len(submissions)} submissions...")
+        if workers > 1:
+            results_path, stats = grader.grade_parallel(submissions, workers, args.results_csv,
+                                                        args.chunk_size, args.extended_stats, args.format)
+        elif args.format == 'binary':
+            batch = grader.grade_batch(submissions, columnar=True)
+            
+            # Export results
+            results_path = grader.export_results_binary(batch, args.results_csv)
+            
+            # Generate statistics
+            accumulator = grader.accumulate(batch, track_students=args.save_accumulator,
+                                            item_analysis=args.extended_stats and not args.save_accumulator)
+            stats = accumulator.to_statistics(args.extended_stats)
+        else:
+            batch = grader.grade_batch(submissions, columnar=True)
+            results = batch.to_results()
+            
+            # Export results
+            results_path = grader.export_results_csv(results, args.results_csv)
+            
+            # Generate statistics straight from the answer matrix
+            accumulator = grader.accumulate(batch, track_students=args.save_accumulator,
+                                            item_analysis=args.extended_stats and not args.save_accumulator)
+            stats = accumulator.to_statistics(args.extended_stats)
+        print(f"Results exported to: {results_path}")
+    
+    # Export statistics
+    if json_path is None:
+        json_path = grader.export_statistics_json(stats, args.stats_json)
     print(f"Statistics exported to: {json_path}")
     
+    if args.save_accumulator:
+        if args.stream or workers > 1:
+            print("Warning: --save-accumulator is only supported for single-process, non-streaming runs")
+        else:
+            print(f"Accumulator saved to: {grader.export_accumulator(accumulator, json_path)}")
+    
     # Print summary
     print("\nSummary:")
     print(f"Total submissions: {stats['total_submissions']}")
@@ -70,18 +358,33 @@ def main():
     print(f"Highest score: {stats['highest_score']:.1f}%")
     print(f"Lowest score: {stats['lowest_score']:.1f}%")
     
-    # Generate feedback for specific student if requested
+    if args.feedback or args.feedback_archive:
+        feedback_path, count = grader.export_feedback(results_path, question_text, archive=args.feedback_archive,
+                                                      workers=workers, chunk_size=args.chunk_size)
+        print(f"\nFeedback for {count} students written to: {feedback_path}")
+    
+    if args.collusion:
+        from collusion import collusion_path
+        
+        try:
+            collusion_file, report = grader.export_collusion_report(
+                results_path, os.path.basename(collusion_path(json_path)), workers,
+                args.collusion_min_shared, args.collusion_min_similarity)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"\nCollusion scan flagged {report['flagged_pairs']} pairs of {report['students']} students: "
+              f"{collusion_file}")
+    
+    # Generate feedback for specific student if requested, found through the results file's index
     if args.student_id:
-        student_found = False
-        for result in results:
-            if result["student_id"] == args.student_id:
-                print("\nStudent Feedback:")
-                print("=" * 50)
-                print(grader.generate_feedback(result, question_text))
-                student_found = True
-                break
+        result = grader.find_result(results_path, args.student_id)
         
-        if not student_found:
+        if result is not None:
+            print("\nStudent Feedback:")
+            print("=" * 50)
+            print(grader.generate_feedback(result, question_text))
+        else:
             print(f"\nError: Student ID {args.student_id} not found in submissions.")
 
 
@@ -0,0 +1,472 @@
+import csv
+import io
+import math
+import os
+import numpy as np
+from collections import deque
+from functools import partial
+from typing import List, Dict, Any, Iterable, Iterator, Sequence, Tuple
+
+from engine import OptionCodes
+from feedback import CSV_FIXED_COLUMNS, CsvLabels, iter_csv_blocks
+from store import ResultsStore, is_results_store
+from student_index import read_csv_header
+
+# A pair is reported once it shares this many identical wrong answers...
+DEFAULT_MIN_SHARED_WRONG = 5
+
+# ...and the Jaccard similarity of the two students' wrong answers is at least this
+DEFAULT_MIN_SIMILARITY = 0.5
+
+# Wrong answers chosen by more than this share of the scanned students, and by
+# more than COMMON_MIN_STUDENTS of them, are common misconceptions. They still
+# count when candidates are scored, but are not hashed, since otherwise every
+# student holding them would collide
+DEFAULT_MAX_COMMON_SHARE = 0.2
+COMMON_MIN_STUDENTS = 1000
+
+# Flagged pairs listed in a report, best ranked first
+MAX_REPORTED_PAIRS = 10000
+
+# MinHash signatures are cut into bands of hashes. A pair at the minimum
+# similarity must share a whole band, and so become a candidate, with this
+# probability; bands are made as long as the signature budget then allows,
+# which keeps dissimilar pairs out of the candidates
+LSH_RECALL = 0.99
+MAX_SIGNATURE = 320
+MAX_BAND_ROWS = 8
+
+# Students hashed, and candidate pairs scored, per task
+SIGNATURE_BLOCK = 8192
+PAIR_BLOCK = 1 << 16
+
+# Buckets larger than this are split into groups of this size, in an order
+# that changes from band to band, so that no bucket yields quadratically
+# many pairs
+MAX_BUCKET = 128
+
+# Candidate pairs gathered from the bands before duplicates are merged away
+CANDIDATE_BLOCK = 1 << 22
+
+# Universal hash family h(t) = (a * t + b) mod p over wrong-answer token IDs, with a fixed
+# seed so that reports are reproducible
+_PRIME = (1 << 31) - 1
+_HASH_SEED = 0x4D4351
+
+# Multiplier folding the hashes of a band into one bucket key
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def collusion_path(stats_path: str) -> str:
+    """
+    Path of the collusion report written alongside a statistics JSON file.
+
+    Args:
+        stats_path: Path of the exported statistics JSON
+
+    Returns:
+        Path ending in .collusion.json alongside the statistics file
+    """
+    root, _ = os.path.splitext(stats_path)
+    return f"{root}.collusion.json"
+
+
+def load_answer_matrix(results_path: str) -> Tuple[List[str], List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read the graded answer matrix back from a results file.
+
+    Binary stores are mapped as they are. Results CSVs are parsed block by
+    block, with answer labels coded into option codes again.
+
+    Args:
+        results_path: Results CSV or binary results store
+
+    Returns:
+        Tuple of (student IDs, question IDs, answer codes, correctness matrix, scores)
+    """
+    if is_results_store(results_path):
+        store = ResultsStore(results_path)
+        correct = np.unpackbits(store.columns["correct_bits"], axis=1, bitorder="little",
+                                count=len(store.question_ids)).astype(bool)
+        return store.student_ids(), store.question_ids, np.asarray(store.answers), correct, np.asarray(store.scores)
+
+    header = read_csv_header(results_path)
+    # Question columns come in pairs named "Q<id> Answer" and "Q<id> Correct"
+    question_ids = [column[1:-len(" Answer")] for column in header[CSV_FIXED_COLUMNS::2]]
+    labels = CsvLabels(OptionCodes())
+    student_ids, scores, answers, correct = [], [], [], []
+
+    for records in iter_csv_blocks(results_path, SIGNATURE_BLOCK):
+        for row in csv.reader(io.StringIO("".join(records), newline="")):
+            student_ids.append(row[0])
+            scores.append(float(row[4]))
+            answers.extend(map(labels.__getitem__, row[CSV_FIXED_COLUMNS::2]))
+            correct.extend(cell == "Yes" for cell in row[CSV_FIXED_COLUMNS + 1::2])
+
+    q = len(question_ids)
+    return (student_ids, question_ids, np.array(answers, dtype=np.int32).reshape(-1, q),
+            np.array(correct, dtype=bool).reshape(-1, q), np.array(scores, dtype=np.float64))
+
+
+def _wrong_answer_tokens(answers: np.ndarray, wrong: np.ndarray,
+                         students: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Wrong answers of some students as sets of (question, option) tokens.
+
+    Returns:
+        Tuple of (token IDs grouped by student, offset of each student's tokens, number of distinct tokens)
+    """
+    if not wrong[students].any():
+        return np.zeros(0, dtype=np.int64), np.zeros(len(students) + 1, dtype=np.int64), 0
+    rows, columns = np.nonzero(wrong[students])
+    width = int(answers.max()) + 1
+    raw = columns.astype(np.int64) * width + answers[students][rows, columns]
+    # Tokens are renumbered densely, which keeps the bitsets as narrow as the distinct wrong answers
+    tokens, token_ids = np.unique(raw, return_inverse=True)
+
+    offsets = np.zeros(len(students) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(students)), out=offsets[1:])
+    return token_ids.astype(np.int64), offsets, len(tokens)
+
+
+def _pack_tokens(token_ids: np.ndarray, offsets: np.ndarray, width: int) -> np.ndarray:
+    """Bit-packed wrong-answer signature of each student: one bit per token, eight tokens per byte."""
+    bits = np.zeros((len(offsets) - 1, (width + 7) // 8), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    np.bitwise_or.at(bits, (rows, token_ids >> 3), (1 << (token_ids & 7)).astype(np.uint8))
+    return bits
+
+
+def _uncommon_tokens(token_ids: np.ndarray, offsets: np.ndarray, width: int,
+                     max_common_share: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Drop the tokens held by more than max_common_share of the students (and by more than
+    COMMON_MIN_STUDENTS), for hashing.
+
+    Returns:
+        Tuple of (rows of the students left with tokens, their token IDs grouped by student, offsets of each
+        student's tokens, number of tokens dropped)
+    """
+    students = len(offsets) - 1
+    # A student holds a token at most once, so token counts are student counts
+    common = np.bincount(token_ids, minlength=width) > max(max_common_share * students, COMMON_MIN_STUDENTS)
+    keep = ~common[token_ids]
+    rows = np.repeat(np.arange(students), np.diff(offsets))
+    counts = np.bincount(rows[keep], minlength=students)
+
+    hashed = np.flatnonzero(counts)
+    hashed_offsets = np.zeros(len(hashed) + 1, dtype=np.int64)
+    np.cumsum(counts[hashed], out=hashed_offsets[1:])
+    return hashed, token_ids[keep], hashed_offsets, int(common.sum())
+
+
+def lsh_shape(min_similarity: float) -> Tuple[int, int]:
+    """
+    Number of LSH bands and hashes per band for a minimum similarity.
+
+    Args:
+        min_similarity: Jaccard similarity that must reach the candidates with probability LSH_RECALL
+
+    Returns:
+        Tuple of (bands, rows per band)
+    """
+    for rows in range(MAX_BAND_ROWS, 0, -1):
+        hit = min_similarity ** rows
+        bands = 1 if hit >= 1 else math.ceil(math.log(1 - LSH_RECALL) / math.log1p(-hit))
+        if bands * rows <= MAX_SIGNATURE:
+            return bands, rows
+    return MAX_SIGNATURE, 1
+
+
+def _minhash(token_ids: np.ndarray, offsets: np.ndarray, length: int) -> np.ndarray:
+    """
+    MinHash signatures of a block of students' token sets.
+
+    Each hash is evaluated once per distinct token of the block and gathered,
+    and every student's segment of the flat token array is reduced by one
+    minimum.reduceat; each student has at least one token.
+    """
+    rng = np.random.default_rng(_HASH_SEED)
+    a = rng.integers(1, _PRIME, length, dtype=np.int64)
+    b = rng.integers(0, _PRIME, length, dtype=np.int64)
+
+    tokens, local = np.unique(token_ids, return_inverse=True)
+    starts = offsets[:-1] - offsets[0]
+    signatures = np.empty((len(starts), length), dtype=np.int32)
+    for i in range(length):
+        # Hashes are below 2 ** 31, so they fit the narrower signature type
+        signatures[:, i] = np.minimum.reduceat(((a[i] * tokens + b[i]) % _PRIME).astype(np.int32)[local], starts)
+    return signatures
+
+
+def _bucket_pairs(keys: np.ndarray, shuffle: np.ndarray) -> np.ndarray:
+    """
+    Pairs of rows sharing a bucket key, as lo * n + hi.
+
+    Rows are ordered by key and then by shuffle, and buckets larger than
+    MAX_BUCKET are cut into groups of MAX_BUCKET consecutive rows.
+    """
+    n = len(keys)
+    order = np.lexsort((shuffle, keys))
+    ordered = keys[order]
+    buckets = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+    position = np.arange(n) - np.repeat(buckets, np.diff(np.append(buckets, n)))
+    starts = np.flatnonzero(position % MAX_BUCKET == 0)
+    sizes = np.diff(np.append(starts, n))
+
+    # Each sorted position pairs with the later positions of its group
+    later = np.repeat(starts + sizes, sizes) - np.arange(n) - 1
+    first = np.repeat(np.arange(n), later)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(later) - later, later)
+    a, b = order[first], order[second]
+    return np.minimum(a, b) * n + np.maximum(a, b)
+
+
+def _distinct(values: np.ndarray) -> np.ndarray:
+    """Sorted distinct values; sorting is much faster than np.unique's hashing for these pair codes."""
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+def _band_keys(signatures: np.ndarray, bands: int, rows: int) -> Iterator[np.ndarray]:
+    """Bucket key of every row in each band, folded from the band's hashes."""
+    for band in range(bands):
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for column in signatures[:, band * rows:(band + 1) * rows].T:
+            # Colliding keys only add candidates, which are scored exactly anyway
+            keys = keys * _BAND_MIX + column.astype(np.uint64)
+        yield keys
+
+
+def _band_pairs(keys: np.ndarray, band: int) -> np.ndarray:
+    """Distinct pairs of one band, with oversized buckets split in a band-seeded order."""
+    shuffle = np.random.default_rng([_HASH_SEED, band]).permutation(len(keys))
+    return _distinct(_bucket_pairs(keys, shuffle))
+
+
+def _candidate_pairs(band_pairs: Iterable[np.ndarray]) -> np.ndarray:
+    """
+    Distinct pairs of rows whose signatures agree on at least one whole band.
+
+    Each band's deduplicated pairs are merged into the pairs found so far once
+    CANDIDATE_BLOCK of them are pending, which bounds the memory held beyond
+    the distinct candidates.
+    """
+    found = np.zeros(0, dtype=np.int64)
+    pending = []
+    for pairs in band_pairs:
+        pending.append(pairs)
+        if sum(map(len, pending)) >= CANDIDATE_BLOCK:
+            found = _distinct(np.concatenate([found] + pending))
+            pending = []
+    return _distinct(np.concatenate([found] + pending))
+
+
+def _ordered_map(pool, fn, *iterables, window: int) -> Iterator[Any]:
+    """Results of fn over the iterables from a process pool, in order, with at most window tasks in flight."""
+    pending = deque()
+    for args in zip(*iterables):
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _score_pairs(bits: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Identical wrong answers and the union of wrong answers of candidate pairs, by popcount."""
+    a, b = bits[lo], bits[hi]
+    shared = np.bitwise_count(a & b).sum(axis=1, dtype=np.int64)
+    union = np.bitwise_count(a | b).sum(axis=1, dtype=np.int64)
+    return shared, union
+
+
+# Wrong-answer bitsets shared with each worker process
+_worker_bits = None
+
+
+def _init_worker(bits: np.ndarray) -> None:
+    global _worker_bits
+    _worker_bits = bits
+
+
+def _score_task(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return _score_pairs(_worker_bits, lo, hi)
+
+
+def scan_answer_matrix(student_ids: Sequence[str], question_ids: Sequence[str], answers: np.ndarray,
+                       correct: np.ndarray, scores: np.ndarray = None, workers: int = 1,
+                       min_shared_wrong: int = DEFAULT_MIN_SHARED_WRONG,
+                       min_similarity: float = DEFAULT_MIN_SIMILARITY,
+                       max_common_share: float = DEFAULT_MAX_COMMON_SHARE) -> Dict[str, Any]:
+    """
+    Find pairs of students with suspiciously similar wrong answers.
+
+    Each student's wrong answers form a set of (question, chosen option)
+    tokens, held as a bitset. Students with fewer than min_shared_wrong wrong
+    answers cannot reach the threshold and are skipped. MinHash signatures of
+    the remaining sets, without the common misconceptions, are bucketed band
+    by band (locality-sensitive hashing). Only pairs that agree on a whole
+    band become candidates, instead of all N^2 pairs; the band shape follows
+    from min_similarity, and oversized buckets are split. Candidates are then
+    scored exactly by popcounts of their full bitsets, and the pairs over
+    both thresholds are ranked by identical wrong answers, then similarity,
+    and the first MAX_REPORTED_PAIRS are listed. An oversized bucket is split
+    into groups of MAX_BUCKET, different in each band, and only pairs within
+    a group become candidates. So when more than MAX_BUCKET students share
+    the same uncommon wrong answers, only a sample of their pairs is scored,
+    and flagged_pairs is a lower bound.
+
+    Pairs alike only in common misconceptions are never candidates, and pairs
+    whose uncommon wrong answers reach min_similarity are found with
+    probability LSH_RECALL.
+
+    With several workers, the signatures, each band's bucketing and the
+    candidate scores are computed in a process pool. The parent folds the
+    band keys and merges the bands' pairs into the distinct candidates, which
+    stays serial.
+
+    Args:
+        student_ids: Student IDs, one per matrix row
+        question_ids: Question IDs, one per matrix column
+        answers: Answer matrix of option codes, negative when unanswered
+        correct: Boolean correctness matrix
+        scores: Optional score percentages, reported with each pair
+        workers: Number of worker processes
+        min_shared_wrong: Identical wrong answers a pair needs to be reported
+        min_similarity: Jaccard similarity of the wrong answers a pair needs to be reported
+        max_common_share: Share of the scanned students above which a wrong answer is not hashed
+
+    Returns:
+        Report with the scan's counts, its parameters and the ranked pairs
+
+    Raises:
+        ValueError: If a threshold is out of range
+    """
+    if min_shared_wrong < 1:
+        raise ValueError("min_shared_wrong must be at least 1")
+    if not 0 < min_similarity <= 1:
+        raise ValueError("min_similarity must be above 0 and at most 1")
+    if not 0 < max_common_share <= 1:
+        raise ValueError("max_common_share must be above 0 and at most 1")
+    bands, rows = lsh_shape(min_similarity)
+
+    wrong = (answers >= 0) & ~correct
+    wrong_counts = wrong.sum(axis=1)
+    students = np.flatnonzero(wrong_counts >= min_shared_wrong)
+
+    report = {
+        "students": len(student_ids),
+        "students_scanned": len(students),
+        "common_wrong_answers": 0,
+        "candidate_pairs": 0,
+        "flagged_pairs": 0,
+        "parameters": {
+            "min_shared_wrong_answers": min_shared_wrong,
+            "min_similarity": min_similarity,
+            "max_common_share": max_common_share,
+            "lsh_bands": bands,
+            "lsh_rows": rows,
+            "max_bucket": MAX_BUCKET,
+            "max_reported_pairs": MAX_REPORTED_PAIRS,
+        },
+        "pairs": [],
+    }
+    if len(students) < 2:
+        return report
+
+    token_ids, offsets, width = _wrong_answer_tokens(answers, wrong, students)
+    bits = _pack_tokens(token_ids, offsets, width)
+    hashed, hashed_tokens, hashed_offsets, report["common_wrong_answers"] = _uncommon_tokens(
+        token_ids, offsets, width, max_common_share)
+
+    blocks = [(start, min(start + SIGNATURE_BLOCK, len(hashed)))
+              for start in range(0, len(hashed), SIGNATURE_BLOCK)]
+    block_tokens = [hashed_tokens[hashed_offsets[start]:hashed_offsets[stop]] for start, stop in blocks]
+    block_offsets = [hashed_offsets[start:stop + 1] for start, stop in blocks]
+    lengths = [bands * rows] * len(blocks)
+
+    def candidates_of(signature_blocks, map_bands):
+        if len(hashed) < 2:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        keys = _band_keys(np.concatenate(list(signature_blocks)), bands, rows)
+        lo, hi = np.divmod(_candidate_pairs(map_bands(_band_pairs, keys, range(bands))), len(hashed))
+        # Hashed students are in scan order, so pairs stay ordered once mapped back
+        return hashed[lo], hashed[hi]
+
+    if workers <= 1:
+        lo, hi = candidates_of(map(_minhash, block_tokens, block_offsets, lengths), map)
+        chunks = range(0, len(lo), PAIR_BLOCK)
+        scored = [_score_pairs(bits, lo[i:i + PAIR_BLOCK], hi[i:i + PAIR_BLOCK]) for i in chunks]
+        flagged = _flagged(lo, hi, chunks, scored, min_shared_wrong, min_similarity)
+    else:
+        # The process pool is only imported by runs that use one
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(bits,)) as pool:
+            # Bands are bucketed two per worker at a time, so their pairs cannot pile up unmerged
+            map_bands = partial(_ordered_map, pool, window=2 * workers)
+            lo, hi = candidates_of(pool.map(_minhash, block_tokens, block_offsets, lengths), map_bands)
+            chunks = range(0, len(lo), PAIR_BLOCK)
+            scored = pool.map(_score_task, [lo[i:i + PAIR_BLOCK] for i in chunks],
+                              [hi[i:i + PAIR_BLOCK] for i in chunks])
+            flagged = _flagged(lo, hi, chunks, scored, min_shared_wrong, min_similarity)
+
+    pair_lo, pair_hi, shared, similarity = flagged
+    # Rank by identical wrong answers, then similarity; row order breaks ties
+    ranking = np.lexsort((pair_hi, pair_lo, -similarity, -shared))
+
+    report["candidate_pairs"] = len(lo)
+    report["flagged_pairs"] = len(ranking)
+    for rank, pair in enumerate(ranking[:MAX_REPORTED_PAIRS].tolist(), start=1):
+        a, b = int(students[pair_lo[pair]]), int(students[pair_hi[pair]])
+        same = answers[a] == answers[b]
+        entry = {
+            "rank": rank,
+            "student_a": student_ids[a],
+            "student_b": student_ids[b],
+            "identical_wrong_answers": int(shared[pair]),
+            "wrong_answers_a": int(wrong_counts[a]),
+            "wrong_answers_b": int(wrong_counts[b]),
+            "wrong_answer_similarity": float(similarity[pair]),
+            "identical_answers": int((same & (answers[a] >= 0)).sum()),
+            "shared_wrong_questions": [question_ids[j] for j in np.flatnonzero(same & wrong[a] & wrong[b])],
+        }
+        if scores is not None:
+            entry["score_a"] = float(scores[a])
+            entry["score_b"] = float(scores[b])
+        report["pairs"].append(entry)
+
+    return report
+
+
+def _flagged(lo: np.ndarray, hi: np.ndarray, chunks: range, scored: Iterable[Tuple[np.ndarray, np.ndarray]],
+             min_shared_wrong: int, min_similarity: float) -> Tuple[np.ndarray, ...]:
+    """Candidate pairs over both thresholds, kept chunk by chunk as their scores arrive."""
+    kept = [(np.zeros(0, dtype=np.int64),) * 3 + (np.zeros(0),)]
+    for start, (shared, union) in zip(chunks, scored):
+        similarity = shared / np.maximum(union, 1)
+        over = np.flatnonzero((shared >= min_shared_wrong) & (similarity >= min_similarity))
+        kept.append((lo[start + over], hi[start + over], shared[over], similarity[over]))
+    return tuple(np.concatenate(column) for column in zip(*kept))
+
+
+def scan_results(results_path: str, workers: int = 1, min_shared_wrong: int = DEFAULT_MIN_SHARED_WRONG,
+                 min_similarity: float = DEFAULT_MIN_SIMILARITY,
+                 max_common_share: float = DEFAULT_MAX_COMMON_SHARE) -> Dict[str, Any]:
+    """
+    Scan a results file for suspiciously similar answer sheets.
+
+    Args:
+        results_path: Results CSV or binary results store
+        workers: Number of worker processes
+        min_shared_wrong: Identical wrong answers a pair needs to be reported
+        min_similarity: Jaccard similarity of the wrong answers a pair needs to be reported
+        max_common_share: Share of the scanned students above which a wrong answer is not hashed
+
+    Returns:
+        Report as returned by scan_answer_matrix
+    """
+    student_ids, question_ids, answers, correct, scores = load_answer_matrix(results_path)
+    return scan_answer_matrix(student_ids, question_ids, answers, correct, scores, workers, min_shared_wrong,
+                              min_similarity, max_common_share)
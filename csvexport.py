@@ -0,0 +1,202 @@
+import csv
+import io
+import os
+import zlib
+import numpy as np
+from typing import List, Iterator, Optional
+
+from fileutil import atomic_write
+from store import ResultsStore
+
+# Students rendered per block of a CSV export
+BLOCK_ROWS = 4096
+
+# gzip compression level of compressed exports
+GZIP_LEVEL = 6
+
+
+def offsets_path(store_path: str) -> str:
+    """
+    Path of the CSV block offsets saved next to a results store.
+
+    Args:
+        store_path: Path of the binary results store
+
+    Returns:
+        Path ending in .csvoff alongside the store
+    """
+    return f"{store_path}.csvoff"
+
+
+def _render_rows(header: Optional[List[str]], rows: Iterator[List]) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+def iter_gzip(chunks: Iterator[bytes], level: int = GZIP_LEVEL) -> Iterator[bytes]:
+    """
+    Compress a stream of byte chunks into a gzip stream as they are produced.
+
+    The gzip header has no timestamp, so the same input always compresses
+    to the same bytes.
+
+    Args:
+        chunks: Uncompressed byte chunks
+        level: zlib compression level
+
+    Yields:
+        Non-empty chunks of gzip data
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class StoreCsvExport:
+    """
+    The wide results CSV of a binary results store, rendered on demand.
+
+    The CSV is produced block by block from the memory-mapped store, so the
+    first bytes are available immediately whatever the cohort size, and no
+    CSV is ever written to disk. Its bytes are identical to the CSV that
+    grade_stream writes for the same results.
+
+    Serving a byte range needs the offset of every block. Offsets are
+    recorded while the CSV is streamed in full, or computed in one rendering
+    pass on the first range request, and are saved next to the store.
+    """
+
+    def __init__(self, store_path: str, block_rows: int = BLOCK_ROWS):
+        """
+        Open the store to export.
+
+        Args:
+            store_path: Path of the binary results store
+            block_rows: Students rendered per block
+        """
+        self.store_path = store_path
+        self.store = ResultsStore(store_path)
+        self.block_rows = block_rows
+        self.blocks = (len(self.store) + block_rows - 1) // block_rows
+        self._offsets = None
+
+        stat = os.stat(store_path)
+        self.etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def block(self, index: int) -> bytes:
+        """
+        Render one block of the CSV; block 0 starts with the header row.
+
+        Args:
+            index: Block number
+
+        Returns:
+            UTF-8 encoded CSV rows
+        """
+        start = index * self.block_rows
+        batch = self.store.batch(start, min(start + self.block_rows, len(self.store)))
+        header = batch.key.csv_header() if index == 0 else None
+        return _render_rows(header, batch.iter_csv_rows())
+
+    def _iter_blocks(self, first: int = 0) -> Iterator[bytes]:
+        if not self.blocks:
+            yield _render_rows(self.store.batch(0, 0).key.csv_header(), [])
+            return
+        for index in range(first, self.blocks):
+            yield self.block(index)
+
+    def offsets(self) -> np.ndarray:
+        """
+        Byte offset of every block, followed by the total length.
+
+        Loaded from the saved offsets, or computed by rendering every block once.
+
+        Returns:
+            Array of blocks + 1 offsets
+        """
+        if self._offsets is None:
+            self._offsets = self._load_offsets()
+        if self._offsets is None:
+            lengths = [len(chunk) for chunk in self._iter_blocks()]
+            self._save_offsets(lengths)
+        return self._offsets
+
+    def _load_offsets(self) -> Optional[np.ndarray]:
+        path = offsets_path(self.store_path)
+        try:
+            if os.stat(path).st_mtime_ns < os.stat(self.store_path).st_mtime_ns:
+                return None
+            with open(path, 'rb') as f:
+                saved = np.frombuffer(f.read(), dtype="<i8")
+        except FileNotFoundError:
+            return None
+        # The first entry records the block size the offsets were computed with
+        if len(saved) != max(self.blocks, 1) + 2 or saved[0] != self.block_rows:
+            return None
+        return saved[1:]
+
+    def _save_offsets(self, lengths: List[int]) -> None:
+        self._offsets = np.concatenate(([0], np.cumsum(lengths))).astype("<i8")
+        with atomic_write(offsets_path(self.store_path), 'wb') as f:
+            f.write(np.concatenate(([self.block_rows], self._offsets)).astype("<i8").tobytes())
+
+    @property
+    def length(self) -> Optional[int]:
+        """Total size of the CSV in bytes if the block offsets are known, otherwise None."""
+        if self._offsets is None:
+            self._offsets = self._load_offsets()
+        return None if self._offsets is None else int(self._offsets[-1])
+
+    def iter_bytes(self, start: int = 0, stop: int = None) -> Iterator[bytes]:
+        """
+        Stream the CSV, or a byte range of it.
+
+        Args:
+            start: First byte
+            stop: Byte after the last one, defaults to the end of the CSV
+
+        Yields:
+            Chunks of CSV bytes, one block at a time
+        """
+        if start == 0 and stop is None:
+            yield from self._iter_full()
+            return
+
+        offsets = self.offsets()
+        stop = int(offsets[-1]) if stop is None else stop
+        first = max(int(np.searchsorted(offsets, start, side="right")) - 1, 0)
+        position = int(offsets[first])
+
+        for chunk in self._iter_blocks(first):
+            if position >= stop:
+                break
+            piece = chunk[max(start - position, 0):stop - position]
+            if piece:
+                yield piece
+            position += len(chunk)
+
+    def _iter_full(self) -> Iterator[bytes]:
+        """Stream the whole CSV, saving the block offsets if they are not known yet."""
+        known = self.length is not None
+        lengths = []
+        for chunk in self._iter_blocks():
+            lengths.append(len(chunk))
+            yield chunk
+        if not known:
+            self._save_offsets(lengths)
+
+    def iter_gzip(self) -> Iterator[bytes]:
+        """
+        Stream the whole CSV gzip-compressed.
+
+        Yields:
+            Chunks of gzip data
+        """
+        return iter_gzip(self.iter_bytes())
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Local grading daemon with a warm answer key cache.
+
+The daemon keeps graders for recently used answer keys, already encoded, and
+serves requests over a Unix socket, so that many small gradings against the
+same keys skip interpreter start-up, imports and key encoding. Start it with
+
+    python daemon.py
+
+While it is running, cli.py forwards its runs to it (unless --no-daemon or
+--profile is given). Other programs can send batches directly:
+
+    from daemon import request
+    stats = request({"op": "grade", "answer_key": key, "submissions": batch})["statistics"]
+
+Requests and responses are JSON objects, one per line. Requests are served
+one at a time, in the order they arrive.
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import time
+from collections import OrderedDict
+from contextlib import redirect_stderr, redirect_stdout
+from typing import List, Dict, Any
+
+# Answer keys kept encoded in memory
+DEFAULT_MAX_KEYS = 32
+
+# Seconds a client waits for the daemon to answer
+CLIENT_TIMEOUT = 3600.0
+
+# Distinct answer values a cached grader may code before it is encoded afresh,
+# which bounds the memory kept by graders of keys answered with free text
+MAX_WARM_OPTIONS = 4096
+
+# Environment variable overriding the socket path
+SOCKET_ENV = "MCQ_GRADER_SOCKET"
+
+# Name of the socket inside the runtime directory
+SOCKET_NAME = "mcq-grader.sock"
+
+
+def socket_path() -> str:
+    """
+    Path of the daemon's Unix socket.
+
+    Returns:
+        MCQ_GRADER_SOCKET if it is set, otherwise a socket in $XDG_RUNTIME_DIR, or failing that in
+        a directory private to the user inside the temporary directory
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], SOCKET_NAME)
+    return os.path.join(os.environ.get("TMPDIR", "/tmp"), f"mcq-grader-{os.getuid()}", SOCKET_NAME)
+
+
+def _private_dir(path: str) -> None:
+    """Create a directory only the current user can enter, refusing one that another user could replace."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} must be a directory owned by and private to the current user")
+
+
+class DaemonUnavailable(ConnectionError):
+    """No grading daemon is listening on the socket."""
+
+
+class DaemonError(RuntimeError):
+    """The daemon could not carry out a request."""
+
+
+def request(message: Dict[str, Any], path: str = None, timeout: float = CLIENT_TIMEOUT) -> Dict[str, Any]:
+    """
+    Send one request to the daemon and wait for its response.
+
+    Args:
+        message: Request with an "op" of "ping", "grade" or "cli"
+        path: Socket path, defaults to socket_path()
+        timeout: Seconds to wait for the response
+
+    Returns:
+        The response
+
+    Raises:
+        DaemonUnavailable: If no daemon is listening on the socket, or the socket is not the user's own
+        DaemonError: If the daemon failed to carry out the request
+    """
+    path = path or socket_path()
+    try:
+        owner = os.stat(path).st_uid
+    except FileNotFoundError as e:
+        raise DaemonUnavailable(f"No grading daemon listening on {path}") from e
+    if owner != os.getuid():
+        # Anyone could have bound a shared path; never send command lines to another user's process
+        raise DaemonUnavailable(f"The socket {path} belongs to another user")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(f"No grading daemon listening on {path}") from e
+
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(message).encode("utf-8") + b"\n")
+            f.flush()
+            line = f.readline()
+
+    if not line:
+        raise DaemonError("The grading daemon closed the connection without answering")
+    response = json.loads(line)
+    if "error" in response:
+        raise DaemonError(response["error"])
+    return response
+
+
+class GraderDaemon:
+    """
+    Request handling of the daemon, around an LRU cache of graders.
+
+    Graders are keyed by the JSON text of their answer key and scoring rules,
+    which keeps the question order, and are encoded as soon as they are
+    created. A grader whose option codes have grown past MAX_WARM_OPTIONS is
+    replaced by a fresh one. main is only imported here, so clients importing
+    this module stay quick to start.
+    """
+
+    def __init__(self, max_keys: int = DEFAULT_MAX_KEYS):
+        """
+        Initialize an empty daemon.
+
+        Args:
+            max_keys: Maximum number of answer keys kept encoded in memory
+        """
+        self.max_keys = max_keys
+        self.graders = OrderedDict()
+        self.started = time.time()
+        self.requests = 0
+        self.key_hits = 0
+        self.key_misses = 0
+
+    def grader(self, answer_key: Dict[str, str], scoring: Dict[str, Any] = None):
+        """
+        Grader for an answer key, from the cache if the key was seen recently.
+
+        Args:
+            answer_key: Dictionary with question IDs as keys and correct answers as values
+            scoring: Optional scoring rules
+
+        Returns:
+            MCQGrader with its answer key already encoded
+        """
+        cache_key = json.dumps([answer_key, scoring])
+        grader = self.graders.get(cache_key)
+        if grader is not None and len(grader.encoded_key.codes.options) <= MAX_WARM_OPTIONS:
+            self.graders.move_to_end(cache_key)
+            self.key_hits += 1
+            return grader
+
+        from main import MCQGrader
+
+        grader = MCQGrader(answer_key, scoring)
+        # Encode the key now, so that requests only grade
+        grader.encoded_key
+        self.key_misses += 1
+        self.graders[cache_key] = grader
+        self.graders.move_to_end(cache_key)
+        while len(self.graders) > self.max_keys:
+            self.graders.popitem(last=False)
+        return grader
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Carry out one request.
+
+        Args:
+            message: Request with an "op" of "ping", "grade" or "cli"
+
+        Returns:
+            The response
+
+        Raises:
+            ValueError: If the request is malformed
+        """
+        self.requests += 1
+        op = message.get("op")
+        if op == "ping":
+            return self.status()
+        if op == "grade":
+            return self.grade(message)
+        if op == "cli":
+            return self.run_cli(message["argv"], message["cwd"])
+        raise ValueError(f"Unknown request: {op!r}")
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Report the daemon's process, uptime and answer key cache use.
+
+        Returns:
+            Status dictionary
+        """
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": time.time() - self.started,
+            "requests": self.requests,
+            "answer_keys": len(self.graders),
+            "max_answer_keys": self.max_keys,
+            "key_hits": self.key_hits,
+            "key_misses": self.key_misses,
+        }
+
+    def grade(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Grade a batch of submissions sent inline or as a file path.
+
+        The request holds "answer_key", optionally "scoring" rules, and
+        "submissions" (a list) or "submissions_path" (a JSON array or JSON
+        Lines file). "statistics" (default true) and "results" (default false)
+        select what is returned, and "extended" adds the extended statistics.
+
+        Args:
+            message: Grade request
+
+        Returns:
+            Dictionary with "statistics" and/or "results"
+        """
+        from streaming import iter_submissions
+
+        grader = self.grader(message["answer_key"], message.get("scoring"))
+        submissions = message.get("submissions")
+        if submissions is None:
+            with open(message["submissions_path"], 'r') as f:
+                submissions = list(iter_submissions(f))
+
+        extended = bool(message.get("extended"))
+        batch = grader.grade_batch(submissions, columnar=True)
+        response = {}
+        if message.get("statistics", True):
+            response["statistics"] = grader.accumulate(batch, item_analysis=extended).to_statistics(extended)
+        if message.get("results"):
+            response["results"] = [result.to_dict() for result in batch.to_results()]
+        return response
+
+    def run_cli(self, argv: List[str], cwd: str) -> Dict[str, Any]:
+        """
+        Run a cli.py command line in the daemon, as if run from the client's directory.
+
+        Args:
+            argv: Command line arguments, without the program name
+            cwd: Working directory of the client
+
+        Returns:
+            Dictionary with the command's "output" and exit "status"
+        """
+        import cli
+
+        output = io.StringIO()
+        status = 0
+        previous = os.getcwd()
+        os.chdir(cwd)
+        try:
+            # argparse reports bad arguments on stderr and exits, which must not stop the daemon
+            with redirect_stdout(output), redirect_stderr(output):
+                cli.run(cli.build_parser().parse_args(argv), self.grader)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        finally:
+            os.chdir(previous)
+        return {"output": output.getvalue(), "status": status}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def _claim_socket(path: str) -> None:
+    """Remove a socket left behind by a daemon that is no longer running."""
+    if not os.path.exists(path):
+        return
+    if os.stat(path).st_uid != os.getuid():
+        raise RuntimeError(f"{path} belongs to another user")
+    try:
+        request({"op": "ping"}, path, timeout=1.0)
+    except (DaemonUnavailable, DaemonError, OSError):
+        os.unlink(path)
+        return
+    raise RuntimeError(f"A grading daemon is already listening on {path}")
+
+
+def serve(path: str = None, max_keys: int = DEFAULT_MAX_KEYS) -> None:
+    """
+    Serve requests on a Unix socket until interrupted or terminated.
+
+    Args:
+        path: Socket path, defaults to socket_path()
+        max_keys: Maximum number of answer keys kept encoded in memory
+    """
+    if path is None:
+        path = socket_path()
+        if not os.environ.get(SOCKET_ENV) and not os.environ.get("XDG_RUNTIME_DIR"):
+            _private_dir(os.path.dirname(path))
+    _claim_socket(path)
+
+    # Load the grading modules up front so the first request is as fast as the rest
+    importlib.import_module("cli")
+    importlib.import_module("main")
+
+    # Bind with owner-only permissions, so the socket is never reachable by others
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, _RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon = GraderDaemon(max_keys)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"Grading daemon {os.getpid()} listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main():
+    """Daemon entry point"""
+    parser = argparse.ArgumentParser(description="MCQ Grader AI - Grading daemon")
+    parser.add_argument('--socket', help=f'Unix socket path (defaults to ${SOCKET_ENV} or {socket_path()})')
+    parser.add_argument('--max-keys', type=int, default=DEFAULT_MAX_KEYS,
+                        help='Answer keys kept encoded in memory; the least recently used are dropped')
+    parser.add_argument('--status', action='store_true', help='Print the status of the running daemon and exit')
+
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            print(json.dumps(request({"op": "ping"}, args.socket, timeout=5.0), indent=2))
+        except DaemonUnavailable as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
+
+    try:
+        serve(args.socket, args.max_keys)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
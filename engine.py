@@ -0,0 +1,552 @@
+import numpy as np
+from collections.abc import Mapping
+from datetime import datetime
+from itertools import chain, repeat
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from scoring import ScoringPlan, selection_label
+
+# Sentinel codes stored in the answer matrix
+UNANSWERED = -1   # Question ID missing from the submission
+NULL_ANSWER = -2  # Question ID present but answered with null
+
+# Largest option codes that still fit in int8 and int16 answer matrices
+INT8_MAX_CODE = 127
+INT16_MAX_CODE = 32767
+
+_MISSING = object()
+
+
+def answer_dtype(option_count: int) -> type:
+    """
+    Narrowest integer type of an answer matrix holding every code of a vocabulary.
+
+    Args:
+        option_count: Number of distinct answer values coded so far
+
+    Returns:
+        np.int8, np.int16 or np.int32
+    """
+    if option_count <= INT8_MAX_CODE + 1:
+        return np.int8
+    if option_count <= INT16_MAX_CODE + 1:
+        return np.int16
+    return np.int32
+
+
+class OptionCodes(dict):
+    """
+    Mapping from answer values to small integer option codes.
+
+    New answer values are assigned the next free code the first time they are
+    looked up, so encoding never needs to know the option alphabet up front.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.options = []
+        self[_MISSING] = UNANSWERED
+        self[None] = NULL_ANSWER
+
+    def __missing__(self, value):
+        code = len(self.options)
+        self.options.append(value)
+        self[value] = code
+        return code
+
+    def code(self, value: Any) -> int:
+        """
+        Option code of an answer value, accepting multi-select answers given as lists.
+
+        Args:
+            value: Answer value, or a list of selected options
+
+        Returns:
+            Option code; lists are coded by their canonical selection label
+        """
+        try:
+            return self[value]
+        except TypeError:
+            return self[selection_label(value)]
+
+    def value_code(self, value: Any) -> int:
+        """
+        Option code of an answer value kept exactly as given, for single-select questions.
+
+        Unhashable values, such as a list answered to a single-select question,
+        get a code of their own under their repr and decode to the value itself,
+        so they never match a key entry.
+
+        Args:
+            value: Answer value
+
+        Returns:
+            Option code
+        """
+        try:
+            return self[value]
+        except TypeError:
+            stand_in = (_MISSING, repr(value))
+            code = self.get(stand_in)
+            if code is None:
+                code = self[stand_in] = len(self.options)
+                self.options.append(value)
+            return code
+
+    @classmethod
+    def from_options(cls, options: List[Any]) -> "OptionCodes":
+        """
+        Rebuild option codes from a previously recorded option list.
+
+        Args:
+            options: Answer values in code order
+
+        Returns:
+            OptionCodes assigning each value its original code
+        """
+        codes = cls()
+        for option in options:
+            codes.value_code(option)
+        return codes
+
+    def decode(self, code: int) -> Any:
+        """
+        Convert an option code back into the original answer value.
+
+        Args:
+            code: Option code from an answer matrix
+
+        Returns:
+            The answer value, or None for the unanswered sentinels
+        """
+        return self.options[code] if code >= 0 else None
+
+
+class EncodedAnswerKey:
+    """
+    An answer key encoded once into integer option codes.
+
+    The encoding is shared by every batch graded against the same key, so the
+    option code vocabulary stays stable across batches. Answers that are lists
+    (multi-select questions) are coded by their canonical selection label.
+
+    With scoring rules, grading goes through a ScoringPlan compiled from the
+    key and the rules; without, a question scores one point when the answer
+    equals the key.
+    """
+
+    def __init__(self, answer_key: Dict[str, str], codes: OptionCodes = None, scoring: Dict[str, Any] = None):
+        """
+        Encode an answer key.
+
+        Args:
+            answer_key: Dictionary with question IDs as keys and correct answers as values
+            codes: Optional existing option codes to extend instead of starting afresh
+            scoring: Optional scoring rules (weights, penalties, partial credit, voided questions)
+        """
+        self.answer_key = dict(answer_key)
+        self.question_ids = list(self.answer_key.keys())
+        self.question_index = {q_id: i for i, q_id in enumerate(self.question_ids)}
+        self.codes = codes if codes is not None else OptionCodes()
+        self.multi_select = any(isinstance(a, list) for a in self.answer_key.values())
+        self.key_codes = np.array([self.codes.code(a) for a in self.answer_key.values()], dtype=np.int32)
+        self.scoring = scoring
+        self.plan = ScoringPlan(self, scoring) if scoring else None
+
+    @property
+    def questions_total(self) -> int:
+        return len(self.question_ids)
+
+    def csv_header(self) -> List[str]:
+        """
+        Column names of the results CSV, matching MCQGrader.export_results_csv.
+
+        Returns:
+            List of column names
+        """
+        header = ["Student ID", "Timestamp", "Questions Attempted", "Correct Answers", "Score (%)"]
+        for q_id in self.question_ids:
+            header.append(f"Q{q_id} Answer")
+            header.append(f"Q{q_id} Correct")
+        return header
+
+    def encode_submissions(self, submissions: Iterable[Dict[str, Any]]) -> Tuple[List[str], np.ndarray]:
+        """
+        Encode submissions into a (students x questions) matrix of option codes.
+
+        Submissions without a student ID or without answers are skipped, exactly
+        as in MCQGrader.grade_batch.
+
+        Args:
+            submissions: Iterable of dictionaries, each containing student_id and answers
+
+        Returns:
+            Tuple of (student IDs, answer matrix)
+        """
+        student_ids = []
+        sheets = []
+
+        for submission in submissions:
+            student_id = submission.get("student_id")
+            answers = submission.get("answers", {})
+
+            if student_id and answers:
+                student_ids.append(student_id)
+                sheets.append(answers)
+
+        if self.multi_select:
+            matrix = self._encode_sheets(sheets, self.codes.code)
+        else:
+            try:
+                matrix = self._encode_sheets(sheets, self.codes.__getitem__)
+            except TypeError:
+                # A list answered to a single-select question; codes already assigned stay valid
+                matrix = self._encode_sheets(sheets, self.codes.value_code)
+
+        return student_ids, matrix.astype(answer_dtype(len(self.codes.options)), copy=False)
+
+    def _encode_sheets(self, sheets: List[Dict[str, Any]], lookup) -> np.ndarray:
+        """Fill the answer matrix of some answer dicts in one C-level pass over lazy rows."""
+        q_ids = self.question_ids
+        rows = (map(lookup, map(answers.get, q_ids, repeat(_MISSING))) for answers in sheets)
+        matrix = np.fromiter(chain.from_iterable(rows), dtype=np.int32, count=len(sheets) * len(q_ids))
+        return matrix.reshape(len(sheets), len(q_ids))
+
+    def encode_answers(self, answers: Dict[str, Any]) -> np.ndarray:
+        """
+        Encode one student's answers into a row of option codes.
+
+        Args:
+            answers: Dictionary with question IDs and the student's answers
+
+        Returns:
+            Array of option codes in answer key order
+        """
+        # Lists are only read as selections when the key has multi-select questions, as in encode_submissions
+        lookup = self.codes.code if self.multi_select else self.codes.value_code
+        return np.array([lookup(answers.get(q_id, _MISSING)) for q_id in self.question_ids], dtype=np.int32)
+
+    def recode(self, answers: np.ndarray, options: List[Any]) -> np.ndarray:
+        """
+        Translate an answer matrix encoded with another option vocabulary.
+
+        Args:
+            answers: Answer matrix whose codes index into options
+            options: Option values of the other vocabulary, in code order
+
+        Returns:
+            Answer matrix using this key's option codes
+        """
+        # Negative indexes resolve the sentinels to the two trailing entries
+        lut = np.array([self.codes.value_code(o) for o in options] + [NULL_ANSWER, UNANSWERED], dtype=np.int32)
+        return lut[answers].astype(answer_dtype(len(self.codes.options)), copy=False)
+
+    def grade(self, student_ids: List[str], answers: np.ndarray, timestamp: str = None) -> "GradedBatch":
+        """
+        Grade an encoded answer matrix.
+
+        Args:
+            student_ids: Student IDs, one per matrix row
+            answers: Answer matrix produced by encode_submissions
+            timestamp: Optional grading timestamp shared by the whole batch
+
+        Returns:
+            GradedBatch with the columnar results
+        """
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        answered = answers != UNANSWERED
+        attempted = answered.sum(axis=1)
+
+        if self.plan is not None:
+            correct, scores = self.plan.score(answers)
+            correct_count = correct.sum(axis=1)
+        else:
+            correct = (answers == self.key_codes) & answered
+            correct_count = correct.sum(axis=1)
+            scores = self.percentages(correct_count)
+
+        return GradedBatch(self, student_ids, answers, correct, attempted, correct_count, scores, timestamp)
+
+    def percentages(self, correct_count: np.ndarray) -> np.ndarray:
+        """
+        Score percentages from per-student correct counts, when no scoring plan weights the questions.
+
+        Args:
+            correct_count: Number of correct answers of each student
+
+        Returns:
+            Score percentages
+        """
+        if self.questions_total > 0:
+            return (correct_count / self.questions_total) * 100
+        return np.zeros(len(correct_count), dtype=np.float64)
+
+    def correctness(self, answers: np.ndarray, columns: List[int]) -> np.ndarray:
+        """
+        Grade only some question columns of an answer matrix.
+
+        Args:
+            answers: Answer matrix of option codes
+            columns: Indices of the questions to grade
+
+        Returns:
+            Boolean matrix with one column per requested question
+        """
+        if self.plan is not None:
+            return self.plan.full_credit_columns(answers, columns)
+        # Sentinel codes are negative, so they never match a key code
+        return answers[:, columns] == self.key_codes[columns]
+
+
+class GradedBatch:
+    """
+    Columnar grading results for a batch of submissions.
+
+    Every per-student value is stored as a NumPy column instead of a dict per
+    student, with the answer key shared once for the whole batch.
+    """
+
+    def __init__(self, key: EncodedAnswerKey, student_ids: List[str], answers: np.ndarray,
+                 correct: np.ndarray, attempted: np.ndarray, correct_count: np.ndarray,
+                 scores: np.ndarray, timestamp: str):
+        self.key = key
+        self.student_ids = student_ids
+        self.answers = answers
+        self.correct = correct
+        self.attempted = attempted
+        self.correct_count = correct_count
+        self.scores = scores
+        self.timestamp = timestamp
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    @property
+    def question_ids(self) -> List[str]:
+        return self.key.question_ids
+
+    def score_distribution(self) -> Dict[float, int]:
+        """
+        Count students per distinct score, in linear time unless a scoring plan weights the questions.
+
+        Returns:
+            Dictionary mapping score percentage to number of students
+        """
+        if self.key.plan is not None:
+            # Weighted scores are not a function of the number correct, so count them directly
+            values, counts = np.unique(self.scores, return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+
+        total = self.key.questions_total
+        if total == 0:
+            return {0.0: len(self)} if len(self) else {}
+
+        counts = np.bincount(self.correct_count, minlength=total + 1)
+        return {(c / total) * 100: int(n) for c, n in enumerate(counts.tolist()) if n}
+
+    def question_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Count attempts and correct answers per question.
+
+        Returns:
+            Tuple of (attempts, correct) arrays in answer key order
+        """
+        answered = self.answers >= 0
+        return answered.sum(axis=0), (self.correct & answered).sum(axis=0)
+
+    def contribution_records(self) -> List[Tuple[float, int, int]]:
+        """
+        Per-student statistics contributions as (score, attempted bits, correct bits).
+
+        Bit i of each bitset corresponds to question i in answer key order.
+
+        Returns:
+            List of contribution records, one per student
+        """
+        answered = self.answers >= 0
+        attempted_bits = np.packbits(answered, axis=1, bitorder="little")
+        correct_bits = np.packbits(self.correct & answered, axis=1, bitorder="little")
+
+        return [
+            (score, int.from_bytes(attempted, "little"), int.from_bytes(correct, "little"))
+            for score, attempted, correct in zip(
+                self.scores.tolist(),
+                map(bytes, attempted_bits),
+                map(bytes, correct_bits),
+            )
+        ]
+
+    def iter_csv_rows(self) -> Iterator[List[Any]]:
+        """
+        Yield one results CSV row per student.
+
+        Yields:
+            List of cell values in csv_header order
+        """
+        # Negative indexes resolve the unanswered sentinels to the trailing labels
+        labels = [option if option else "Unanswered" for option in self.key.codes.options]
+        labels += ["Unanswered", "Unanswered"]
+        yes_no = ("No", "Yes")
+        width = 2 * self.key.questions_total
+
+        rows = zip(self.student_ids, self.attempted.tolist(), self.correct_count.tolist(), self.scores.tolist())
+
+        for i, (student_id, attempted, correct_count, score) in enumerate(rows):
+            cells = [None] * width
+            cells[0::2] = map(labels.__getitem__, self.answers[i].tolist())
+            cells[1::2] = map(yes_no.__getitem__, self.correct[i].tolist())
+            yield [student_id, self.timestamp, attempted, correct_count, score] + cells
+
+    def result(self, index: int) -> "CompactResult":
+        """
+        Build the grade_submission-style result for one student.
+
+        Args:
+            index: Row index of the student in the batch
+
+        Returns:
+            CompactResult that reads like the dict returned by grade_submission
+        """
+        correct_bits = np.packbits(self.correct[index], bitorder="little")
+        return CompactResult(self.key, self.student_ids[index], self.timestamp, self.answers[index],
+                             int.from_bytes(bytes(correct_bits), "little"), int(self.attempted[index]),
+                             int(self.correct_count[index]), float(self.scores[index]))
+
+    def to_results(self) -> List["CompactResult"]:
+        """
+        Convert the whole batch into a list of compact results.
+
+        Returns:
+            List of grading results, as returned by MCQGrader.grade_batch(compact=True)
+        """
+        correct_bits = np.packbits(self.correct, axis=1, bitorder="little")
+        rows = zip(self.student_ids, self.answers, map(bytes, correct_bits), self.attempted.tolist(),
+                   self.correct_count.tolist(), self.scores.tolist())
+
+        return [
+            CompactResult(self.key, student_id, self.timestamp, codes, int.from_bytes(bits, "little"),
+                          attempted, correct_count, score)
+            for student_id, codes, bits, attempted, correct_count, score in rows
+        ]
+
+
+class CompactResult(Mapping):
+    """
+    Grading result for one student, stored as answer codes and a correctness bitset.
+
+    The answer key and option vocabulary are shared by every result of a
+    batch, and the answer codes are a row view into the batch's answer
+    matrix, so a result costs a small fixed overhead plus about one byte per
+    question instead of a dict per question. It is a read-only mapping with
+    the same keys as the dict returned by MCQGrader.grade_submission;
+    question_details is rebuilt on each access.
+    """
+
+    __slots__ = ("key", "student_id", "timestamp", "codes", "correct_bits",
+                 "questions_attempted", "correct_answers", "score_percentage")
+
+    _FIELDS = ("student_id", "timestamp", "questions_total", "questions_attempted",
+               "correct_answers", "score_percentage", "question_details")
+
+    def __init__(self, key: EncodedAnswerKey, student_id: str, timestamp: str, codes: np.ndarray,
+                 correct_bits: int, questions_attempted: int, correct_answers: int, score_percentage: float):
+        self.key = key
+        self.student_id = student_id
+        self.timestamp = timestamp
+        self.codes = codes
+        self.correct_bits = correct_bits
+        self.questions_attempted = questions_attempted
+        self.correct_answers = correct_answers
+        self.score_percentage = score_percentage
+
+    def __getitem__(self, name: str) -> Any:
+        if name == "question_details":
+            return self.question_details()
+        if name == "questions_total":
+            return self.key.questions_total
+        if name in self._FIELDS:
+            return getattr(self, name)
+        raise KeyError(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._FIELDS)
+
+    def __len__(self) -> int:
+        return len(self._FIELDS)
+
+    def __repr__(self) -> str:
+        return (f"CompactResult(student_id={self.student_id!r}, correct_answers={self.correct_answers}, "
+                f"score_percentage={self.score_percentage!r})")
+
+    def is_correct(self, index: int) -> bool:
+        """
+        Whether the question at a position in the answer key was answered correctly.
+
+        Args:
+            index: Question position in answer key order
+
+        Returns:
+            True if correct
+        """
+        return bool(self.correct_bits >> index & 1)
+
+    def question_details(self) -> List[Dict[str, Any]]:
+        """
+        Decode the per-question details.
+
+        Returns:
+            List of question detail dicts, as in grade_submission results
+        """
+        decode = self.key.codes.decode
+        bits = self.correct_bits
+        return [
+            {
+                "question_id": q_id,
+                "correct_answer": correct_answer,
+                "student_answer": decode(code),
+                "is_correct": bool(bits >> i & 1),
+            }
+            for i, (q_id, correct_answer, code) in enumerate(zip(
+                self.key.question_ids,
+                self.key.answer_key.values(),
+                self.codes.tolist(),
+            ))
+        ]
+
+    def contribution(self) -> Tuple[float, int, int]:
+        """
+        Statistics contribution as (score, attempted bits, correct bits), without decoding answers.
+
+        Returns:
+            Contribution record, as in GradedBatch.contribution_records
+        """
+        attempted_bits = int.from_bytes(bytes(np.packbits(self.codes >= 0, bitorder="little")), "little")
+        return self.score_percentage, attempted_bits, self.correct_bits & attempted_bits
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Materialize the result as a plain dict.
+
+        Returns:
+            Dictionary containing grading results and feedback
+        """
+        return {name: self[name] for name in self._FIELDS}
+
+
+def grade_submissions(key: EncodedAnswerKey, submissions: Iterable[Dict[str, Any]],
+                      timestamp: Optional[str] = None) -> GradedBatch:
+    """
+    Encode and grade a batch of submissions in one call.
+
+    Args:
+        key: Encoded answer key
+        submissions: Iterable of dictionaries, each containing student_id and answers
+        timestamp: Optional grading timestamp shared by the whole batch
+
+    Returns:
+        GradedBatch with the columnar results
+    """
+    student_ids, answers = key.encode_submissions(submissions)
+    return key.grade(student_ids, answers, timestamp)
@@ -0,0 +1,295 @@
+import csv
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Tuple
+
+from fileutil import atomic_write
+from main import MCQGrader
+from scoring import load_scoring
+from stats import summarize_scores
+from store import RESULT_FORMATS
+
+# Columns every exam manifest must have
+MANIFEST_COLUMNS = ("exam", "answer_key", "submissions")
+
+# Optional manifest column with the path of an exam's scoring rules
+SCORING_COLUMN = "scoring"
+
+# Name of the cross-exam statistics file written in the output directory
+COMBINED_STATS_NAME = "combined_statistics.json"
+
+# Names of the outputs written in each exam's directory
+EXAM_RESULTS_STEM = "results"
+EXAM_STATS_NAME = "statistics.json"
+
+# Exam names become directory names, so they are limited to safe characters
+_EXAM_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# Per-exam statistics that are not copied into the combined statistics
+_DETAIL_SECTIONS = ("question_analysis", "item_analysis")
+
+
+def read_manifest(manifest_path: str) -> List[Dict[str, str]]:
+    """
+    Read an exam manifest.
+
+    The manifest is a CSV file with exam, answer_key and submissions columns,
+    one row per exam, and optionally a scoring column with the path of the
+    exam's scoring rules. Relative paths are resolved against the manifest's
+    directory.
+
+    Args:
+        manifest_path: Path of the manifest CSV
+
+    Returns:
+        One dictionary per exam, with absolute answer_key, submissions and scoring paths;
+        scoring is None for exams graded without rules
+
+    Raises:
+        ValueError: If a column is missing, or an exam name is invalid or repeated
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    exams = []
+    names = set()
+
+    with open(manifest_path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in MANIFEST_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"Manifest is missing the column(s): {', '.join(missing)}")
+
+        for line, row in enumerate(reader, start=2):
+            name = (row["exam"] or "").strip()
+            if not _EXAM_NAME.match(name):
+                raise ValueError(f"Invalid exam name on manifest line {line}: {name!r}")
+            if name in names:
+                raise ValueError(f"Exam {name} is listed more than once in the manifest")
+            names.add(name)
+            scoring = (row.get(SCORING_COLUMN) or "").strip()
+            exams.append({
+                "exam": name,
+                "answer_key": os.path.join(base_dir, row["answer_key"].strip()),
+                "submissions": os.path.join(base_dir, row["submissions"].strip()),
+                "scoring": os.path.join(base_dir, scoring) if scoring else None,
+            })
+
+    return exams
+
+
+def _load_answer_keys(exams: List[Dict[str, str]]) -> Tuple[List[Tuple[Dict[str, str], Any]], List[Any]]:
+    """
+    Load the answer keys of the exams, with their scoring rules, once per distinct pair.
+
+    Keys are deduplicated by path and by content, so exams sharing a key file
+    and scoring rules, or identical copies of them, share one key and one
+    encoding.
+
+    Returns:
+        Tuple of (distinct (answer key, scoring rules) pairs, per exam the index of its pair or the error
+        loading it)
+    """
+    keys = []
+    index_by_text = {}
+    loaded = {}
+    key_of_exam = []
+
+    for exam in exams:
+        paths = (exam["answer_key"], exam["scoring"])
+        if paths not in loaded:
+            try:
+                with open(paths[0], 'r') as f:
+                    answer_key = json.load(f)
+            except (OSError, ValueError) as e:
+                loaded[paths] = f"Cannot load answer key {paths[0]}: {e}"
+            else:
+                try:
+                    scoring = load_scoring(paths[1]) if paths[1] else None
+                except (OSError, ValueError) as e:
+                    loaded[paths] = f"Cannot load scoring rules {paths[1]}: {e}"
+                else:
+                    text = json.dumps([answer_key, scoring])
+                    if text not in index_by_text:
+                        index_by_text[text] = len(keys)
+                        keys.append((answer_key, scoring))
+                    loaded[paths] = index_by_text[text]
+        key_of_exam.append(loaded[paths])
+
+    return keys, key_of_exam
+
+
+def _grade_exam(grader: MCQGrader, exam: Dict[str, str], exam_dir: str, extended: bool, output_format: str,
+                chunk_size: int) -> Dict[str, Any]:
+    """Grade one exam into its directory, returning its outcome and score distribution."""
+    distribution = Counter()
+
+    def collect(batch):
+        distribution.update(batch.score_distribution())
+
+    try:
+        os.makedirs(exam_dir, exist_ok=True)
+        grader.results_dir = exam_dir
+        filename = EXAM_RESULTS_STEM + RESULT_FORMATS[output_format]
+        results_path, stats = grader.grade_stream(exam["submissions"], filename, chunk_size, extended, collect,
+                                                  output_format=output_format)
+        if "error" in stats:
+            raise ValueError(stats["error"])
+        stats_path = grader.export_statistics_json(stats, EXAM_STATS_NAME)
+    except Exception as e:
+        return {"error": str(e)}
+
+    summary = {name: value for name, value in stats.items() if name not in _DETAIL_SECTIONS}
+    return {
+        "questions": len(grader.answer_key),
+        "results_path": results_path,
+        "statistics_path": stats_path,
+        "statistics": summary,
+        "distribution": distribution,
+    }
+
+
+# Answer keys shared with each worker process, and the graders it has encoded so far
+_worker_keys = None
+_worker_graders = {}
+
+
+def _init_worker(keys: List[Tuple[Dict[str, str], Any]]) -> None:
+    global _worker_keys
+    _worker_keys = keys
+    _worker_graders.clear()
+
+
+def _grade_task(key_index: int, exam: Dict[str, str], exam_dir: str, extended: bool, output_format: str,
+                chunk_size: int) -> Dict[str, Any]:
+    grader = _worker_graders.get(key_index)
+    if grader is None:
+        grader = _worker_graders[key_index] = MCQGrader(*_worker_keys[key_index])
+    return _grade_exam(grader, exam, exam_dir, extended, output_format, chunk_size)
+
+
+def _submissions_size(exam: Dict[str, str]) -> int:
+    try:
+        return os.path.getsize(exam["submissions"])
+    except OSError:
+        return 0
+
+
+def combine_statistics(exams: List[Dict[str, str]], outcomes: List[Dict[str, Any]], distinct_keys: int,
+                       extended: bool = False) -> Dict[str, Any]:
+    """
+    Build the cross-exam statistics from the outcome of every exam.
+
+    Exams have different questions, so only scores are combined: the overall
+    figures are computed from the merged score distributions of all graded
+    exams, and each exam contributes its own summary.
+
+    Args:
+        exams: Exams in manifest order
+        outcomes: Outcome of each exam, in the same order
+        distinct_keys: Number of distinct answer keys among the exams
+        extended: Also report standard deviation, percentiles and a histogram overall
+
+    Returns:
+        Dictionary with overall statistics and a summary per exam
+    """
+    distribution = Counter()
+    per_exam = {}
+
+    for exam, outcome in zip(exams, outcomes):
+        entry = {"answer_key": exam["answer_key"], "submissions": exam["submissions"]}
+        if exam.get("scoring"):
+            entry["scoring"] = exam["scoring"]
+        if "error" in outcome:
+            entry["error"] = outcome["error"]
+        else:
+            distribution.update(outcome["distribution"])
+            entry.update(questions=outcome["questions"], results_path=outcome["results_path"],
+                         statistics_path=outcome["statistics_path"], **outcome["statistics"])
+        per_exam[exam["exam"]] = entry
+
+    return {
+        "total_exams": len(exams),
+        "failed_exams": sum("error" in outcome for outcome in outcomes),
+        "distinct_answer_keys": distinct_keys,
+        "overall": summarize_scores(distribution, extended) if distribution else {"error": "No results to analyze"},
+        "exams": per_exam,
+    }
+
+
+def grade_exams(manifest_path: str, output_dir: str, workers: int = 1, extended: bool = False,
+                output_format: str = "csv", chunk_size: int = 10000,
+                make_grader: Callable[[Dict[str, str], Dict[str, Any]], MCQGrader] = None,
+                on_exam: Callable[[str, Dict[str, Any]], None] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Grade every exam listed in a manifest and write combined statistics.
+
+    Each exam is graded by streaming its submissions into
+    <output_dir>/<exam>/results.csv (or results.mcqr) and statistics.json.
+    Answer keys are loaded and encoded once per distinct key: serially, one
+    grader serves every exam with that key; with several workers, the
+    distinct keys are sent to each worker once and encoded there on first
+    use. Exams are handed to the pool largest submissions file first, which
+    balances the workers. An exam that fails is reported without stopping
+    the others.
+
+    Args:
+        manifest_path: Path of the exam manifest CSV
+        output_dir: Directory to write the per-exam directories and combined statistics to
+        workers: Number of worker processes grading exams in parallel
+        extended: Also report standard deviation, percentiles, a score histogram and item analysis
+        output_format: Results format, "csv" or "binary"
+        chunk_size: Number of submissions graded per chunk
+        make_grader: Optional factory of graders, used instead of MCQGrader in serial runs
+        on_exam: Optional callback invoked with each exam's name and outcome as it finishes
+
+    Returns:
+        Tuple of (path to the combined statistics JSON, combined statistics)
+    """
+    if output_format not in RESULT_FORMATS:
+        raise ValueError(f"Unknown results format: {output_format}")
+
+    exams = read_manifest(manifest_path)
+    keys, key_of_exam = _load_answer_keys(exams)
+    outcomes = [None] * len(exams)
+
+    def finish(i, outcome):
+        outcomes[i] = outcome
+        if on_exam:
+            on_exam(exams[i]["exam"], outcome)
+
+    pending = []
+    for i, key_index in enumerate(key_of_exam):
+        if isinstance(key_index, str):
+            finish(i, {"error": key_index})
+        else:
+            pending.append(i)
+    pending.sort(key=lambda i: -_submissions_size(exams[i]))
+
+    if workers <= 1 or len(pending) <= 1:
+        graders = {}
+        for i in pending:
+            key_index = key_of_exam[i]
+            if key_index not in graders:
+                graders[key_index] = (make_grader or MCQGrader)(*keys[key_index])
+            finish(i, _grade_exam(graders[key_index], exams[i], os.path.join(output_dir, exams[i]["exam"]),
+                                  extended, output_format, chunk_size))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker,
+                                 initargs=(keys,)) as pool:
+            futures = {
+                pool.submit(_grade_task, key_of_exam[i], exams[i], os.path.join(output_dir, exams[i]["exam"]),
+                            extended, output_format, chunk_size): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+
+    combined = combine_statistics(exams, outcomes, len(keys), extended)
+    os.makedirs(output_dir, exist_ok=True)
+    combined_path = os.path.join(output_dir, COMBINED_STATS_NAME)
+    with atomic_write(combined_path) as f:
+        json.dump(combined, f, indent=2)
+
+    return combined_path, combined
@@ -0,0 +1,446 @@
+import csv
+import io
+import os
+import re
+import zipfile
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from engine import OptionCodes, UNANSWERED
+from fileutil import temp_path
+from store import ResultsStore, is_results_store
+from student_index import lookup_csv_row, read_csv_header
+
+# Manifest listing every report written by export_feedback
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_HEADER = ["Student ID", "File", "Score (%)"]
+
+# Answer cell of the results CSV for a question that was left blank
+UNANSWERED_LABEL = "Unanswered"
+
+# Leading columns of the results CSV before the per-question answer and correct pairs
+CSV_FIXED_COLUMNS = 5
+
+# Correct cell of the results CSV
+_YES_NO = {"Yes": True, "No": False}
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class CsvLabels(dict):
+    """Option codes of answer cells read back from the results CSV."""
+
+    def __init__(self, codes: OptionCodes):
+        super().__init__({UNANSWERED_LABEL: UNANSWERED})
+        self.codes = codes
+
+    def __missing__(self, label):
+        code = self[label] = self.codes[label]
+        return code
+
+
+class FeedbackRenderer:
+    """
+    Renders the reports of MCQGrader.generate_feedback for many students at once.
+
+    Every line a question can contribute to a report depends only on the
+    question, the chosen option and whether it was correct, so those
+    fragments are formatted once per option the first time it is seen. A
+    report is then its header followed by one fragment lookup per question,
+    selected for a whole block of students with array operations.
+    """
+
+    def __init__(self, answer_key: Dict[str, str], question_text: Dict[str, str] = None):
+        """
+        Prepare the per-question fragments.
+
+        Args:
+            answer_key: Dictionary with question IDs as keys and correct answers as values
+            question_text: Optional dictionary mapping question IDs to question text
+        """
+        self.question_ids = list(answer_key.keys())
+        self.correct_answers = list(answer_key.values())
+        self.titles = [
+            question_text.get(q_id, f"Question {q_id}") if question_text else f"Question {q_id}"
+            for q_id in self.question_ids
+        ]
+        self.codes = OptionCodes()
+        self.labels = CsvLabels(self.codes)
+
+        # Slot 0 of each question is "not attempted"; option code c uses slots 2c+1 (wrong) and 2c+2 (right)
+        self.fragments = [
+            [f"\n\n{title}: Not attempted\n  Correct answer: {correct_answer}"]
+            for title, correct_answer in zip(self.titles, self.correct_answers)
+        ]
+        self._fragment_options = 0
+
+    def _extend_fragments(self) -> None:
+        """Format the fragments of options added to the vocabulary since the last call."""
+        options = self.codes.options
+        for answer in options[self._fragment_options:]:
+            for fragments, title, correct_answer in zip(self.fragments, self.titles, self.correct_answers):
+                fragments.append(f"\n\n{title}: ✗ Incorrect\n  Your answer: {answer}\n  Correct answer: {correct_answer}")
+                fragments.append(f"\n\n{title}: ✓ Correct\n  Your answer: {answer}")
+        self._fragment_options = len(options)
+
+    def render_block(self, student_ids: List[str], timestamps: List[str], scores: List[float],
+                     correct_counts: List[int], answers: np.ndarray, correct: np.ndarray) -> List[str]:
+        """
+        Render the reports of a block of students.
+
+        Args:
+            student_ids: Student IDs, one per row
+            timestamps: Grading timestamp of each row
+            scores: Score percentages
+            correct_counts: Number of correct answers
+            answers: Answer matrix in this renderer's option codes, negative when unanswered
+            correct: Boolean correctness matrix
+
+        Returns:
+            One report per row, identical to MCQGrader.generate_feedback
+        """
+        self._extend_fragments()
+        total = len(self.question_ids)
+        slots = np.where(answers < 0, 0, 2 * answers.astype(np.intp) + 1 + correct)
+
+        reports = []
+        for student_id, timestamp, score, correct_count, row in zip(
+                student_ids, timestamps, scores, correct_counts, slots.tolist()):
+            header = (f"Feedback for: {student_id}\nDate: {timestamp}\n"
+                      f"Overall Score: {score:.1f}% ({correct_count}/{total})\n\nQuestion Details:")
+            reports.append(header + "".join(map(list.__getitem__, self.fragments, row)))
+        return reports
+
+    def render_csv_rows(self, rows: List[List[str]]) -> List[Tuple[str, float, str]]:
+        """
+        Render reports from rows of the results CSV.
+
+        Args:
+            rows: Parsed CSV rows in csv_header order
+
+        Returns:
+            List of (student ID, score, report) tuples
+        """
+        n = len(rows)
+        q = len(self.question_ids)
+        cells = [cell for row in rows for cell in row[CSV_FIXED_COLUMNS:]]
+        answers = np.fromiter(map(self.labels.__getitem__, cells[0::2]), dtype=np.int32, count=n * q)
+        correct = np.fromiter(map(_YES_NO.__getitem__, cells[1::2]), dtype=bool, count=n * q)
+
+        student_ids = [row[0] for row in rows]
+        scores = [float(row[4]) for row in rows]
+        reports = self.render_block(student_ids, [row[1] for row in rows], scores, [int(row[3]) for row in rows],
+                                    answers.reshape(n, q), correct.reshape(n, q))
+        return list(zip(student_ids, scores, reports))
+
+    def render_store_rows(self, store: ResultsStore, start: int, stop: int) -> List[Tuple[str, float, str]]:
+        """
+        Render reports from a range of rows of a binary results store.
+
+        Args:
+            store: Open results store
+            start: First row
+            stop: Row after the last one
+
+        Returns:
+            List of (student ID, score, report) tuples
+        """
+        # Negative indexes resolve the unanswered sentinels to the two trailing entries
+        lut = np.array([self.codes.value_code(option) for option in store.options] + [UNANSWERED, UNANSWERED],
+                       dtype=np.int32)
+        answers = lut[store.answers[start:stop]]
+        correct = np.unpackbits(store.columns["correct_bits"][start:stop], axis=1, bitorder="little",
+                                count=len(self.question_ids)).astype(bool)
+
+        student_ids = [store.student_id(i) for i in range(start, stop)]
+        scores = store.scores[start:stop].tolist()
+        reports = self.render_block(student_ids, [store.timestamp] * len(student_ids), scores,
+                                    store.columns["correct_count"][start:stop].tolist(), answers, correct)
+        return list(zip(student_ids, scores, reports))
+
+
+def iter_csv_blocks(csv_path: str, rows: int) -> Iterator[List[str]]:
+    """
+    Read a results CSV as blocks of whole records, skipping the header.
+
+    Args:
+        csv_path: Path of the results CSV
+        rows: Records per block
+
+    Yields:
+        List of up to rows raw CSV records
+    """
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        f.readline()
+        block = []
+        record = ""
+
+        for line in f:
+            record += line
+            # An odd number of quotes means a quoted field continues on the next line
+            if record.count('"') % 2:
+                continue
+            if record.strip():
+                block.append(record)
+            record = ""
+
+            if len(block) >= rows:
+                yield block
+                block = []
+
+        if block:
+            yield block
+
+
+def _first_field(record: str) -> str:
+    if record.startswith('"'):
+        return next(csv.reader([record]))[0]
+    return record[:record.find(",")]
+
+
+def _iter_blocks(results_path: str, store: Optional[ResultsStore],
+                 chunk_size: int) -> Iterator[Tuple[List[str], Any]]:
+    """Yield the student IDs of each block together with its task: a row range of the store, or CSV text."""
+    if store is not None:
+        student_ids = store.student_ids()
+        for start in range(0, len(store), chunk_size):
+            stop = min(start + chunk_size, len(store))
+            yield student_ids[start:stop], (start, stop)
+    else:
+        for records in iter_csv_blocks(results_path, chunk_size):
+            yield [_first_field(record) for record in records], "".join(records)
+
+
+class FeedbackWriter:
+    """
+    Writes rendered reports as one text file per student, with a manifest.
+
+    Reports go to a directory, or to a zip archive that replaces the target
+    on close. The manifest maps each student ID to its file and is written
+    last, so a directory with a manifest is complete. File names are
+    assigned up front with reserve, so that directory reports can be
+    written by worker processes.
+    """
+
+    def __init__(self, path: str, archive: bool = False):
+        self.path = path
+        self.archive = archive
+        self.names = set()
+        self.manifest = io.StringIO()
+        self.manifest_writer = csv.writer(self.manifest, lineterminator="\n")
+        self.manifest_writer.writerow(MANIFEST_HEADER)
+        self.count = 0
+
+        if archive:
+            self.tmp_path = temp_path(path)
+            self.zip = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    @property
+    def directory(self) -> Optional[str]:
+        """Directory that reports are written to, or None for an archive."""
+        return None if self.archive else self.path
+
+    def reserve(self, student_ids: List[str]) -> List[str]:
+        """
+        Assign unique, filesystem-safe report file names.
+
+        Args:
+            student_ids: Students of a block, in order
+
+        Returns:
+            One file name per student; repeated IDs get a numbered suffix
+        """
+        names = []
+        for student_id in student_ids:
+            stem = _UNSAFE_NAME_CHARS.sub("_", str(student_id)) or "student"
+            name = f"{stem}.txt"
+            n = 1
+            while name in self.names:
+                n += 1
+                name = f"{stem}_{n}.txt"
+            self.names.add(name)
+            names.append(name)
+        return names
+
+    def add(self, student_id: str, name: str, score: float, report: Optional[str]) -> None:
+        """
+        Record a report in the manifest, writing it unless it is already on disk.
+
+        Args:
+            student_id: Student of the report
+            name: File name from reserve
+            score: Score percentage listed in the manifest
+            report: Report text, or None if a worker already wrote the file
+        """
+        if report is not None:
+            if self.archive:
+                self.zip.writestr(name, report)
+            else:
+                _write_report(self.path, name, report)
+        self.manifest_writer.writerow([student_id, name, score])
+        self.count += 1
+
+    def close(self) -> None:
+        if self.archive:
+            self.zip.writestr(MANIFEST_NAME, self.manifest.getvalue())
+            self.zip.close()
+            os.replace(self.tmp_path, self.path)
+        else:
+            manifest_path = os.path.join(self.path, MANIFEST_NAME)
+            tmp = temp_path(manifest_path)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(self.manifest.getvalue())
+            os.replace(tmp, manifest_path)
+
+    def discard(self) -> None:
+        if self.archive:
+            self.zip.close()
+            os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _write_report(directory: str, name: str, report: str) -> None:
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        f.write(report)
+
+
+# Renderer and open store of each worker process, set up by _init_worker
+_worker_renderer = None
+_worker_store = None
+
+
+def _init_worker(answer_key: Dict[str, str], question_text: Optional[Dict[str, str]],
+                 store_path: Optional[str]) -> None:
+    global _worker_renderer, _worker_store
+    _worker_renderer = FeedbackRenderer(answer_key, question_text)
+    _worker_store = ResultsStore(store_path) if store_path else None
+
+
+def _render_block(renderer: FeedbackRenderer, store: Optional[ResultsStore], task: Any, names: List[str],
+                  directory: Optional[str]) -> List[Tuple[str, float, Optional[str]]]:
+    """Render one block, writing the reports straight into the directory if there is one."""
+    if store is not None:
+        reports = renderer.render_store_rows(store, *task)
+    else:
+        reports = renderer.render_csv_rows(list(csv.reader(io.StringIO(task, newline=""))))
+
+    if directory is None:
+        return reports
+    for (_, _, report), name in zip(reports, names):
+        _write_report(directory, name, report)
+    return [(student_id, score, None) for student_id, score, _ in reports]
+
+
+def _render_task(task: Any, names: List[str], directory: Optional[str]) -> List[Tuple[str, float, Optional[str]]]:
+    return _render_block(_worker_renderer, _worker_store, task, names, directory)
+
+
+def write_feedback(answer_key: Dict[str, str], results_path: str, output_path: str,
+                   question_text: Dict[str, str] = None, archive: bool = False, workers: int = 1,
+                   chunk_size: int = 10000) -> int:
+    """
+    Write the feedback report of every student in a results file.
+
+    The results file is read block by block, so memory stays flat for any
+    cohort size. With several workers the blocks are rendered in a process
+    pool, with at most two blocks per worker in flight; directory reports are
+    written by the workers, while archive members are added in block order.
+
+    Args:
+        answer_key: Dictionary with question IDs as keys and correct answers as values
+        results_path: Results CSV or binary results store
+        output_path: Directory, or zip archive, to create
+        question_text: Optional dictionary mapping question IDs to question text
+        archive: Write a zip archive instead of a directory
+        workers: Number of worker processes
+        chunk_size: Students rendered per block
+
+    Returns:
+        Number of reports written
+    """
+    store = ResultsStore(results_path) if is_results_store(results_path) else None
+    blocks = _iter_blocks(results_path, store, chunk_size)
+
+    with FeedbackWriter(output_path, archive) as writer:
+        def collect(names, reports):
+            for name, (student_id, score, report) in zip(names, reports):
+                writer.add(student_id, name, score, report)
+
+        if workers <= 1:
+            renderer = FeedbackRenderer(answer_key, question_text)
+            for student_ids, task in blocks:
+                names = writer.reserve(student_ids)
+                collect(names, _render_block(renderer, store, task, names, writer.directory))
+            return writer.count
+
+        store_path = results_path if store is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(answer_key, question_text, store_path)) as pool:
+            pending = deque()
+
+            for student_ids, task in blocks:
+                names = writer.reserve(student_ids)
+                pending.append((names, pool.submit(_render_task, task, names, writer.directory)))
+                if len(pending) >= 2 * workers:
+                    names, future = pending.popleft()
+                    collect(names, future.result())
+
+            while pending:
+                names, future = pending.popleft()
+                collect(names, future.result())
+
+    return writer.count
+
+
+def find_result(answer_key: Dict[str, str], results_path: str, student_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up one student's result in a results file through its student index.
+
+    Args:
+        answer_key: Dictionary with question IDs as keys and correct answers as values
+        results_path: Results CSV or binary results store
+        student_id: Student to look up
+
+    Returns:
+        grade_submission-style result dict, or None if the student is not in the file
+    """
+    if is_results_store(results_path):
+        return ResultsStore(results_path).get(student_id)
+
+    row = lookup_csv_row(results_path, student_id)
+    if row is None:
+        return None
+
+    header = read_csv_header(results_path)
+    cells = dict(zip(header, row))
+    details = []
+    for q_id, correct_answer in answer_key.items():
+        answer = cells.get(f"Q{q_id} Answer", UNANSWERED_LABEL)
+        details.append({
+            "question_id": q_id,
+            "correct_answer": correct_answer,
+            "student_answer": None if answer == UNANSWERED_LABEL else answer,
+            "is_correct": cells.get(f"Q{q_id} Correct") == "Yes",
+        })
+
+    return {
+        "student_id": row[0],
+        "timestamp": row[1],
+        "questions_total": len(answer_key),
+        "questions_attempted": int(row[2]),
+        "correct_answers": int(row[3]),
+        "score_percentage": float(row[4]),
+        "question_details": details,
+    }
@@ -0,0 +1,119 @@
+import fnmatch
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, IO, Iterator
+
+# Output files covered by the results retention policy
+RESULT_FILE_PATTERNS = ("mcq_results_*", "mcq_statistics_*", "mcq_feedback_*", "mcq_collusion_*", "*.tmp")
+
+# Result outputs that are directories rather than single files
+RESULT_DIR_PATTERNS = ("mcq_feedback_*",)
+
+
+def temp_path(path: str) -> str:
+    """
+    Unique temporary path next to path, for writes that are moved into place with os.replace.
+
+    Args:
+        path: Final destination of the file
+
+    Returns:
+        Temporary path in the same directory
+    """
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yield a temporary path that replaces path once the block succeeds.
+
+    Readers never see a partially written file, and a failed write leaves any
+    previous file untouched.
+
+    Args:
+        path: Final destination of the file
+
+    Yields:
+        Temporary path in the same directory to write to
+    """
+    tmp = temp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', **kwargs) -> Iterator[IO]:
+    """
+    Open a file for writing that atomically replaces path once the block succeeds.
+
+    Args:
+        path: Final destination of the file
+        mode: Write mode passed to open
+        **kwargs: Extra arguments passed to open
+
+    Yields:
+        The open temporary file
+    """
+    with atomic_path(path) as tmp:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+
+
+def remove_expired_results(results_dir: str, max_age: float, now: float = None) -> List[str]:
+    """
+    Delete result files in a directory that are older than the retention period.
+
+    Only grading outputs (mcq_results_*, mcq_statistics_* and their index and
+    accumulator files, and mcq_feedback_* reports) and abandoned temporary
+    files are considered.
+
+    Args:
+        results_dir: Directory holding result files
+        max_age: Retention period in seconds
+        now: Current time, defaults to time.time()
+
+    Returns:
+        Paths of the removed files
+    """
+    cutoff = (now or time.time()) - max_age
+    removed = []
+
+    if not os.path.isdir(results_dir):
+        return removed
+
+    for entry in os.scandir(results_dir):
+        is_dir = entry.is_dir(follow_symlinks=False)
+        patterns = RESULT_DIR_PATTERNS if is_dir else RESULT_FILE_PATTERNS
+        if not (is_dir or entry.is_file()) or not any(fnmatch.fnmatch(entry.name, p) for p in patterns):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                if is_dir:
+                    remove_tree(entry.path)
+                else:
+                    os.unlink(entry.path)
+                removed.append(entry.path)
+        except FileNotFoundError:
+            # Removed concurrently by another cleanup
+            pass
+
+    return removed
+
+
+def remove_tree(path: str) -> None:
+    """
+    Delete a directory tree, ignoring files that are already gone.
+
+    Args:
+        path: Directory to delete
+    """
+    shutil.rmtree(path, ignore_errors=True)
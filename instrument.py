@@ -0,0 +1,301 @@
+import functools
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process so far.
+
+    Returns:
+        Peak RSS in bytes
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class StageRecord:
+    """
+    Measurements of one running stage; callers may set rows while it runs.
+    """
+
+    __slots__ = ("name", "rows", "start", "traced_start", "traced_peak")
+
+    def __init__(self, name: str, rows: int = 0):
+        self.name = name
+        self.rows = rows
+        self.start = time.perf_counter()
+        self.traced_start = 0
+        self.traced_peak = 0
+
+
+class Metrics:
+    """
+    Opt-in registry of per-stage wall time, rows, allocations and peak RSS.
+
+    Disabled by default, in which case stages cost a single attribute check.
+    Allocation peaks come from tracemalloc, which slows Python code down
+    noticeably, so they are only recorded when requested. Stages may nest;
+    each reports its own peak above the traced memory at its start.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_allocations = False
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, trace_allocations: bool = False) -> None:
+        """
+        Start recording stages.
+
+        Args:
+            trace_allocations: Also record peak allocations per stage with tracemalloc
+        """
+        self.enabled = True
+        self.trace_allocations = trace_allocations
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        """
+        Stop recording stages, keeping what was recorded.
+        """
+        self.enabled = False
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_allocations = False
+
+    def reset(self) -> None:
+        """
+        Forget all recorded stages.
+        """
+        with self.lock:
+            self.stages = {}
+
+    def _stack(self) -> List[StageRecord]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0) -> Iterator[Optional[StageRecord]]:
+        """
+        Measure a block of code as a named stage.
+
+        Args:
+            name: Stage name; repeated stages are aggregated
+            rows: Number of rows the stage processes, if known up front
+
+        Yields:
+            StageRecord whose rows can be updated, or None when disabled
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        record = StageRecord(name, rows)
+        stack = self._stack()
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the enclosing stage's peak before resetting it for this one
+            if stack:
+                stack[-1].traced_peak = max(stack[-1].traced_peak, peak)
+            tracemalloc.reset_peak()
+            record.traced_start = current
+
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            seconds = time.perf_counter() - record.start
+            allocated = None
+
+            if tracing:
+                record.traced_peak = max(record.traced_peak, tracemalloc.get_traced_memory()[1])
+                allocated = record.traced_peak - record.traced_start
+                if stack:
+                    stack[-1].traced_peak = max(stack[-1].traced_peak, record.traced_peak)
+
+            self.record(name, seconds, record.rows, allocated)
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterable:
+        """
+        Record the time spent producing each item of an iterable as a stage.
+
+        Args:
+            name: Stage name
+            iterable: Iterable whose items are timed, e.g. lazily parsed chunks
+
+        Returns:
+            The iterable itself when disabled, otherwise a wrapping generator
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(name, iterable)
+
+    def _timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(name, time.perf_counter() - start)
+                return
+            self.record(name, time.perf_counter() - start, len(item) if hasattr(item, "__len__") else 1)
+            yield item
+
+    def record(self, name: str, seconds: float, rows: int = 0, allocated: int = None) -> None:
+        """
+        Add one measured run of a stage.
+
+        Args:
+            name: Stage name
+            seconds: Wall time of the run
+            rows: Rows processed by the run
+            allocated: Peak bytes allocated by the run, if traced
+        """
+        rss = peak_rss_bytes()
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {
+                    "calls": 0, "seconds": 0.0, "rows": 0, "peak_allocated_bytes": None, "peak_rss_bytes": 0,
+                }
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["rows"] += rows or 0
+            if allocated is not None:
+                stage["peak_allocated_bytes"] = max(stage["peak_allocated_bytes"] or 0, allocated)
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], rss)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Copy of the aggregated stage measurements.
+
+        Returns:
+            Dictionary of stage name to calls, seconds, rows, peak allocations and peak RSS
+        """
+        with self.lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def format_breakdown(self) -> str:
+        """
+        Human-readable table of the recorded stages, slowest first.
+
+        Nested stages are included in their enclosing stage's time.
+
+        Returns:
+            Multi-line breakdown
+        """
+        stages = sorted(self.snapshot().items(), key=lambda item: item[1]["seconds"], reverse=True)
+
+        lines = [f"{'Stage':<28}{'Calls':>7}{'Seconds':>10}{'Rows':>12}{'Rows/s':>14}{'Peak alloc':>13}"]
+        for name, stage in stages:
+            rate = stage["rows"] / stage["seconds"] if stage["rows"] and stage["seconds"] > 0 else 0
+            alloc = stage["peak_allocated_bytes"]
+            lines.append(
+                f"{name:<28}{stage['calls']:>7}{stage['seconds']:>10.4f}"
+                f"{stage['rows']:>12,}{rate:>14,.0f}{_format_bytes(alloc):>13}"
+            )
+        lines.append(f"Peak RSS: {_format_bytes(peak_rss_bytes())}")
+        return "\n".join(lines)
+
+    def prometheus(self, prefix: str = "mcq") -> str:
+        """
+        Recorded stages in the Prometheus text exposition format.
+
+        Args:
+            prefix: Metric name prefix
+
+        Returns:
+            Exposition text
+        """
+        stages = self.snapshot()
+        families = [
+            ("stage_calls_total", "counter", "Number of times a stage ran", "calls"),
+            ("stage_seconds_total", "counter", "Wall time spent in a stage", "seconds"),
+            ("stage_rows_total", "counter", "Rows processed by a stage", "rows"),
+            ("stage_peak_allocated_bytes", "gauge", "Largest traced allocation peak of a stage run",
+             "peak_allocated_bytes"),
+        ]
+
+        lines = []
+        for suffix, kind, help_text, field in families:
+            samples = [(name, stage[field]) for name, stage in stages.items() if stage[field] is not None]
+            if not samples:
+                continue
+            lines.append(f"# HELP {prefix}_{suffix} {help_text}")
+            lines.append(f"# TYPE {prefix}_{suffix} {kind}")
+            for name, value in samples:
+                lines.append(f'{prefix}_{suffix}{{stage="{_escape_label(name)}"}} {value}')
+
+        lines.append(f"# HELP {prefix}_process_peak_rss_bytes Peak resident set size of the process")
+        lines.append(f"# TYPE {prefix}_process_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_process_peak_rss_bytes {peak_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bytes(n: Optional[int]) -> str:
+    if n is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+# Process-wide registry used by the instrumented MCQGrader methods, cli.py and app.py
+metrics = Metrics()
+
+
+def instrumented(name: str, rows: Callable[[Any], int] = None, rows_arg: str = None) -> Callable:
+    """
+    Decorate a function so each call is recorded as a stage when metrics are enabled.
+
+    Args:
+        name: Stage name
+        rows: Optional function computing the rows processed from the return value
+        rows_arg: Optional name of an argument whose length is the rows processed
+
+    Returns:
+        Decorator
+    """
+    def decorator(func):
+        # Look the argument up by position so no signature has to be bound per call
+        position = func.__code__.co_varnames.index(rows_arg) if rows_arg else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+
+            with metrics.stage(name) as record:
+                if rows_arg:
+                    value = args[position] if position < len(args) else kwargs.get(rows_arg)
+                    record.rows = len(value) if hasattr(value, "__len__") else 0
+                result = func(*args, **kwargs)
+                if rows:
+                    record.rows = rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,281 @@
+import json
+import math
+import numpy as np
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Any, Iterable, Optional, Sequence
+
+from scoring import selection_label
+
+# Share of the cohort in each of the upper and lower groups of the discrimination index
+GROUP_FRACTION = 0.27
+
+# Distractors chosen by fewer students than this share are reported as non-functional
+NONFUNCTIONAL_RATE = 0.05
+
+
+@lru_cache(maxsize=4096)
+def _string_label(option: str) -> str:
+    try:
+        json.loads(option)
+    except ValueError:
+        return option
+    # Quote strings that read as JSON, so "1" stays apart from the number 1
+    return json.dumps(option)
+
+
+def _option_label(option: Any) -> str:
+    """Report label of an option, distinct for distinct option values."""
+    if isinstance(option, list):
+        return selection_label(option)
+    return _string_label(option) if isinstance(option, str) else json.dumps(option)
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return numerator / denominator if denominator > 0 else None
+
+
+class ItemAnalysis:
+    """
+    Classical test theory item statistics, accumulated batch by batch.
+
+    Instead of keeping every student's answers, the accumulator holds the
+    number of students at each number-correct level, how many of them got
+    each question right, and how often each option was chosen per question.
+    That is enough to derive difficulty, point-biserial correlations,
+    upper/lower group discrimination and KR-20 exactly, and accumulators for
+    different parts of a cohort can be merged.
+
+    KR-20 equals Cronbach's alpha for right/wrong scored questions.
+    """
+
+    def __init__(self, question_ids: Sequence[str]):
+        """
+        Initialize an empty item analysis.
+
+        Args:
+            question_ids: Question IDs in answer key order
+        """
+        self.question_ids = list(question_ids)
+        q = len(self.question_ids)
+        self.key_answers = None
+        self.multi_select = [False] * q
+        # Students per number of correct answers, and their correct answers per question
+        self.levels = np.zeros(q + 1, dtype=np.int64)
+        self.level_correct = np.zeros((q + 1, q), dtype=np.int64)
+        self.options = [Counter() for _ in range(q)]
+        self.unanswered = np.zeros(q, dtype=np.int64)
+
+    def add_batch(self, batch) -> None:
+        """
+        Fold a GradedBatch into the item statistics with array operations.
+
+        Args:
+            batch: Columnar grading results
+        """
+        q = len(self.question_ids)
+        if self.key_answers is None:
+            self._set_key(batch.key.answer_key.values())
+        if not len(batch) or not q:
+            self.levels[0] += len(batch)
+            return
+
+        levels = np.asarray(batch.correct_count, dtype=np.intp)
+        self.levels += np.bincount(levels, minlength=q + 1)
+
+        rows, cols = np.nonzero(batch.correct)
+        self.level_correct += np.bincount(levels[rows] * q + cols, minlength=(q + 1) * q).reshape(q + 1, q)
+
+        # Shift codes so that both unanswered sentinels (-1, -2) land in slots 0 and 1
+        options = batch.key.codes.options
+        width = len(options) + 2
+        slots = batch.answers.astype(np.intp) + 2 + np.arange(q, dtype=np.intp) * width
+        counts = np.bincount(slots.ravel(), minlength=q * width).reshape(q, width)
+
+        self.unanswered += counts[:, 0] + counts[:, 1]
+        for j, code in zip(*np.nonzero(counts[:, 2:])):
+            self.options[j][_option_label(options[code])] += int(counts[j, code + 2])
+
+    def _set_key(self, answers: Iterable[Any]) -> None:
+        answers = list(answers)
+        self.key_answers = [_option_label(answer) for answer in answers]
+        self.multi_select = [isinstance(answer, list) for answer in answers]
+
+    def add_result(self, result: Dict[str, Any]) -> None:
+        """
+        Fold a single result dict into the item statistics.
+
+        Args:
+            result: Grading result for a single submission
+        """
+        level = result["correct_answers"]
+        self.levels[level] += 1
+
+        if hasattr(result, "codes"):
+            # Compact results: read the codes and correctness bits directly
+            if self.key_answers is None:
+                self._set_key(result.key.answer_key.values())
+            options = result.key.codes.options
+            for j, code in enumerate(result.codes.tolist()):
+                if result.correct_bits >> j & 1:
+                    self.level_correct[level, j] += 1
+                if code < 0:
+                    self.unanswered[j] += 1
+                else:
+                    self.options[j][_option_label(options[code])] += 1
+            return
+
+        if self.key_answers is None:
+            self._set_key(d["correct_answer"] for d in result["question_details"])
+
+        for j, q_detail in enumerate(result["question_details"]):
+            if q_detail["is_correct"]:
+                self.level_correct[level, j] += 1
+            if q_detail["student_answer"] is None:
+                self.unanswered[j] += 1
+            else:
+                self.options[j][_option_label(q_detail["student_answer"])] += 1
+
+    def merge(self, other: "ItemAnalysis") -> "ItemAnalysis":
+        """
+        Fold another item analysis for the same answer key into this one.
+
+        Args:
+            other: Item analysis to merge in
+
+        Returns:
+            This item analysis, for chaining
+        """
+        if other.question_ids != self.question_ids:
+            raise ValueError("Cannot merge item analyses for different answer keys")
+
+        if self.key_answers is None:
+            self.key_answers, self.multi_select = other.key_answers, other.multi_select
+        self.levels += other.levels
+        self.level_correct += other.level_correct
+        self.unanswered += other.unanswered
+        for mine, theirs in zip(self.options, other.options):
+            mine.update(theirs)
+        return self
+
+    def _group_weights(self, from_top: bool) -> np.ndarray:
+        """Students taken from each level into the upper or lower group, pro-rating the boundary level."""
+        levels = self.levels[::-1] if from_top else self.levels
+        size = GROUP_FRACTION * levels.sum()
+        before = np.concatenate(([0], np.cumsum(levels)[:-1]))
+        taken = np.clip(size - before, 0, levels)
+        return taken[::-1] if from_top else taken
+
+    def _group_correct_rate(self, from_top: bool) -> np.ndarray:
+        weights = self._group_weights(from_top)
+        size = weights.sum()
+        if size == 0:
+            return np.full(len(self.question_ids), np.nan)
+        share = np.divide(weights, self.levels, out=np.zeros(len(weights)), where=self.levels > 0)
+        return share @ self.level_correct / size
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Compute the item statistics emitted in the statistics JSON.
+
+        Returns:
+            Dictionary with KR-20 reliability and per-question difficulty,
+            discrimination, point-biserial and option frequencies
+        """
+        q = len(self.question_ids)
+        n = int(self.levels.sum())
+        scores = np.arange(q + 1, dtype=np.float64)
+
+        mean = float(self.levels @ scores) / n if n else 0.0
+        variance = float(self.levels @ (scores - mean) ** 2) / n if n else 0.0
+
+        correct = self.level_correct.sum(axis=0)
+        p = correct / n if n else np.zeros(q)
+        item_variance = p * (1 - p)
+
+        # Point-biserial: covariance of item and total score over the product of their deviations
+        covariance = (scores @ self.level_correct) / n - p * mean if n else np.zeros(q)
+        denominator = np.sqrt(item_variance * variance)
+        point_biserial = np.divide(covariance, denominator, out=np.full(q, np.nan), where=denominator > 0)
+
+        upper = self._group_correct_rate(from_top=True)
+        lower = self._group_correct_rate(from_top=False)
+
+        kr20 = None
+        if q > 1 and variance > 0:
+            kr20 = q / (q - 1) * (1 - float(item_variance.sum()) / variance)
+
+        key_answers = self.key_answers or [None] * q
+
+        questions = {}
+        for j, q_id in enumerate(self.question_ids):
+            # The key is listed even when nobody chose it
+            chosen = dict(self.options[j])
+            if key_answers[j] is not None:
+                chosen.setdefault(key_answers[j], 0)
+            options = {}
+            for option, count in sorted(chosen.items(), key=lambda item: (-item[1], item[0])):
+                options[option] = {
+                    "count": count,
+                    "rate": _ratio(count, n),
+                    "is_key": option == key_answers[j],
+                }
+
+            questions[q_id] = {
+                "difficulty": float(p[j]),
+                "discrimination": None if math.isnan(upper[j]) else float(upper[j] - lower[j]),
+                "upper_group_correct_rate": None if math.isnan(upper[j]) else float(upper[j]),
+                "lower_group_correct_rate": None if math.isnan(lower[j]) else float(lower[j]),
+                "point_biserial": None if math.isnan(point_biserial[j]) else float(point_biserial[j]),
+                "options": options,
+                "unanswered": int(self.unanswered[j]),
+                "nonfunctional_distractors": sorted(
+                    option for option, stats in options.items()
+                    if not stats["is_key"] and stats["rate"] is not None and stats["rate"] < NONFUNCTIONAL_RATE
+                ),
+            }
+
+        return {
+            "students": n,
+            "kr20": kr20,
+            "group_fraction": GROUP_FRACTION,
+            "questions": questions,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serialize the item analysis into JSON-compatible data.
+
+        Returns:
+            Dictionary that from_dict turns back into an equal item analysis
+        """
+        return {
+            "question_ids": self.question_ids,
+            "key_answers": self.key_answers,
+            "multi_select": self.multi_select,
+            "levels": self.levels.tolist(),
+            "level_correct": self.level_correct.tolist(),
+            "options": [dict(counter) for counter in self.options],
+            "unanswered": self.unanswered.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ItemAnalysis":
+        """
+        Rebuild an item analysis serialized with to_dict.
+
+        Args:
+            data: Serialized item analysis
+
+        Returns:
+            The restored ItemAnalysis
+        """
+        items = cls(data["question_ids"])
+        q = len(items.question_ids)
+        items.key_answers = data["key_answers"]
+        items.multi_select = data.get("multi_select", [False] * q)
+        items.levels = np.array(data["levels"], dtype=np.int64)
+        items.level_correct = np.array(data["level_correct"], dtype=np.int64).reshape(q + 1, q)
+        items.options = [Counter(counts) for counts in data["options"]]
+        items.unanswered = np.array(data["unanswered"], dtype=np.int64)
+        return items
@@ -0,0 +1,510 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from fileutil import remove_tree
+from main import MCQGrader
+from runcache import RunCache, DEFAULT_CACHE_BYTES
+
+# Job lifecycle states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Minimum seconds between progress writes from a running job
+PROGRESS_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    job_dir TEXT NOT NULL,
+    answer_key_path TEXT NOT NULL,
+    submissions_path TEXT NOT NULL,
+    question_text_path TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    rows_graded INTEGER NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    csv_path TEXT,
+    results_path TEXT,
+    json_path TEXT,
+    summary TEXT,
+    error TEXT,
+    owner_pid INTEGER
+)
+"""
+
+# Columns added since the table was first created, added to older databases on open
+_ADDED_COLUMNS = {"results_path": "TEXT", "owner_pid": "INTEGER"}
+
+
+class JobStore:
+    """
+    SQLite-backed record of grading jobs, shared by the web app and job workers.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open (creating if needed) the job database.
+
+        Args:
+            db_path: Path of the SQLite database file
+        """
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in _ADDED_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id: str, job_dir: str, answer_key_path: str, submissions_path: str,
+               question_text_path: str = None) -> str:
+        """
+        Register a queued job whose input files are already saved.
+
+        Args:
+            job_id: Unique job ID
+            job_dir: Directory holding the job's inputs and outputs
+            answer_key_path: Path of the saved answer key JSON
+            submissions_path: Path of the saved submissions file
+            question_text_path: Optional path of the saved question text JSON
+
+        Returns:
+            The job ID
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, job_dir, answer_key_path, submissions_path, "
+                "question_text_path, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, job_dir, answer_key_path, submissions_path, question_text_path, time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a job record.
+
+        Args:
+            job_id: Job to fetch
+
+        Returns:
+            Dictionary of the job's columns, or None if there is no such job
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest(self, status: str = DONE) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the most recently created job in a given state.
+
+        Args:
+            status: Job state to look for
+
+        Returns:
+            Dictionary of the job's columns, or None if there is no such job
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT 1",
+                               (status,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """
+        Update columns of a job record.
+
+        Args:
+            job_id: Job to update
+            **fields: Column values to set
+        """
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Atomically move a queued job to running, owned by the calling process.
+
+        Args:
+            job_id: Job to claim
+
+        Returns:
+            True if this caller claimed the job, False if it was not queued
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, owner_pid = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), os.getpid(), job_id, QUEUED),
+            )
+            return cursor.rowcount == 1
+
+    def orphaned(self) -> List[str]:
+        """
+        IDs of running jobs whose owning process has exited.
+
+        Returns:
+            List of job IDs, oldest first
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, owner_pid FROM jobs WHERE status = ? ORDER BY created_at",
+                                (RUNNING,)).fetchall()
+        return [row["id"] for row in rows if not _process_alive(row["owner_pid"])]
+
+    def ids_with_status(self, status: str) -> List[str]:
+        """
+        IDs of all jobs in a given state, oldest first.
+
+        Args:
+            status: Job state to look for
+
+        Returns:
+            List of job IDs
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (status,)).fetchall()
+        return [row["id"] for row in rows]
+
+    def prometheus(self, prefix: str = "mcq") -> str:
+        """
+        Job counts and grading totals in the Prometheus text exposition format.
+
+        Grading runs in worker processes, so their totals come from the job
+        records rather than the in-process metrics.
+
+        Args:
+            prefix: Metric name prefix
+
+        Returns:
+            Exposition text
+        """
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            seconds, rows = conn.execute(
+                "SELECT COALESCE(SUM(finished_at - started_at), 0), COALESCE(SUM(rows_graded), 0) "
+                "FROM jobs WHERE status = ?", (DONE,)).fetchone()
+
+        lines = [f"# HELP {prefix}_jobs Grading jobs by status", f"# TYPE {prefix}_jobs gauge"]
+        lines.extend(f'{prefix}_jobs{{status="{status}"}} {counts.get(status, 0)}'
+                     for status in (QUEUED, RUNNING, DONE, FAILED))
+        lines.extend([
+            f"# HELP {prefix}_job_seconds_total Wall time of finished grading jobs",
+            f"# TYPE {prefix}_job_seconds_total counter",
+            f"{prefix}_job_seconds_total {seconds}",
+            f"# HELP {prefix}_job_rows_total Submissions graded by finished jobs",
+            f"# TYPE {prefix}_job_rows_total counter",
+            f"{prefix}_job_rows_total {rows}",
+        ])
+        return "\n".join(lines) + "\n"
+
+    def finished_before(self, cutoff: float) -> List[Dict[str, Any]]:
+        """
+        Finished or failed jobs that completed before a given time.
+
+        Args:
+            cutoff: Unix time
+
+        Returns:
+            List of job records, oldest first
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status IN (?, ?) AND finished_at < ? ORDER BY finished_at",
+                                (DONE, FAILED, cutoff)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, job_id: str) -> None:
+        """
+        Remove a job record.
+
+        Args:
+            job_id: Job to remove
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class JobCache:
+    """
+    In-memory LRU cache of finished job records in front of a JobStore.
+
+    Finished and failed jobs never change, so their records (and anything
+    derived from them, such as parsed summaries) are served from memory.
+    Queued and running jobs always go to the database.
+    """
+
+    def __init__(self, store: JobStore, maxsize: int = 256):
+        """
+        Initialize the cache.
+
+        Args:
+            store: Job database
+            maxsize: Maximum number of finished jobs kept in memory
+        """
+        self.store = store
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a job record, from memory if the job has finished.
+
+        Args:
+            job_id: Job to fetch
+
+        Returns:
+            Dictionary of the job's columns, or None if there is no such job
+        """
+        with self.lock:
+            if job_id in self.entries:
+                self.entries.move_to_end(job_id)
+                return self.entries[job_id]
+
+        job = self.store.get(job_id)
+        if job and job["status"] in (DONE, FAILED):
+            if job["summary"]:
+                job["summary"] = json.loads(job["summary"])
+            with self.lock:
+                self.entries[job_id] = job
+                self.entries.move_to_end(job_id)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return job
+
+    def evict(self, job_id: str) -> None:
+        """
+        Drop a job from the cache.
+
+        Args:
+            job_id: Job to drop
+        """
+        with self.lock:
+            self.entries.pop(job_id, None)
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    """Whether a process with this ID is running on this machine."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+def job_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Public progress report for a job, including an ETA while it runs.
+
+    Args:
+        job: Job record from JobStore.get
+
+    Returns:
+        Dictionary with status, rows graded, progress, ETA and any error
+    """
+    eta = None
+    if job["status"] == RUNNING and job["started_at"] and job["progress"] > 0:
+        elapsed = time.time() - job["started_at"]
+        eta = elapsed * (1 - job["progress"]) / job["progress"]
+    elif job["status"] == DONE:
+        eta = 0.0
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "rows_graded": job["rows_graded"],
+        "progress": job["progress"],
+        "eta_seconds": eta,
+        "error": job["error"],
+    }
+
+
+def run_job(db_path: str, job_id: str, cache_dir: str = None, cache_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+    """
+    Grade one queued job, recording progress and results in the job database.
+
+    Runs in a worker process. Submissions are streamed from disk, so memory use
+    does not depend on the size of the upload. Results are kept in the compact
+    binary store, from which downloads render the CSV. With a run cache, an upload
+    identical to an earlier one reuses that run's outputs, which are linked
+    into the job directory so later cache evictions do not affect the job.
+
+    Args:
+        db_path: Path of the SQLite job database
+        job_id: Job to run
+        cache_dir: Optional directory of a shared run cache
+        cache_bytes: Size limit of the run cache
+    """
+    store = JobStore(db_path)
+    if not store.claim(job_id):
+        return
+
+    job = store.get(job_id)
+    last_report = 0.0
+
+    def report(rows, fraction):
+        nonlocal last_report
+        now = time.time()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            store.update(job_id, rows_graded=rows, progress=fraction)
+
+    try:
+        with open(job["answer_key_path"], 'r') as f:
+            answer_key = json.load(f)
+
+        grader = MCQGrader(answer_key)
+        grader.results_dir = job["job_dir"]
+
+        if cache_dir:
+            cache = RunCache(cache_dir, cache_bytes)
+            cached_results, cached_json, stats, _ = grader.grade_cached(job["submissions_path"], cache,
+                                                                        output_format="binary", on_progress=report)
+            if "error" in stats:
+                raise ValueError(stats["error"])
+            results_path, json_path = cache.link_into(cached_results, cached_json, job["job_dir"])
+        else:
+            results_path, stats = grader.grade_stream(job["submissions_path"], output_format="binary",
+                                                      on_progress=report)
+            if "error" in stats:
+                raise ValueError(stats["error"])
+            json_path = grader.export_statistics_json(stats)
+        summary = {
+            'average_score': stats['average_score'],
+            'highest_score': stats['highest_score'],
+            'lowest_score': stats['lowest_score'],
+            'total_submissions': stats['total_submissions']
+        }
+
+        store.update(job_id, status=DONE, finished_at=time.time(), progress=1.0,
+                     rows_graded=stats['total_submissions'], results_path=results_path, json_path=json_path,
+                     summary=json.dumps(summary))
+    except Exception as e:
+        store.update(job_id, status=FAILED, finished_at=time.time(), error=str(e))
+
+
+class JobQueue:
+    """
+    Runs grading jobs in a pool of background worker processes.
+
+    The job database is the queue: jobs still queued when the app restarts are
+    resubmitted, and running jobs whose worker process has exited are marked
+    as failed. Jobs run by other live app processes are left alone.
+    """
+
+    def __init__(self, store: JobStore, jobs_dir: str, workers: int = 2, cache_dir: str = None,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES):
+        """
+        Initialize the queue.
+
+        Args:
+            store: Job database
+            jobs_dir: Directory under which each job gets its own directory
+            workers: Number of jobs graded concurrently
+            cache_dir: Optional directory of a run cache shared by all jobs
+            cache_bytes: Size limit of the run cache
+        """
+        self.store = store
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.workers = workers
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir else None
+        self.cache_bytes = cache_bytes
+        self.pool = None
+
+    def _submit(self, job_id: str) -> None:
+        if self.pool is None:
+            # Spawn rather than fork so workers never inherit the web server's threads or open files
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pool.submit(run_job, self.store.db_path, job_id, self.cache_dir, self.cache_bytes)
+
+    def new_job_dir(self) -> Tuple[str, str]:
+        """
+        Allocate an ID and an empty directory for a new job.
+
+        Returns:
+            Tuple of (job ID, job directory)
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def enqueue(self, job_id: str, job_dir: str, answer_key_path: str, submissions_path: str,
+                question_text_path: str = None) -> str:
+        """
+        Record a job and hand it to the worker pool.
+
+        Args:
+            job_id: ID from new_job_dir
+            job_dir: Directory from new_job_dir
+            answer_key_path: Path of the saved answer key JSON
+            submissions_path: Path of the saved submissions file
+            question_text_path: Optional path of the saved question text JSON
+
+        Returns:
+            The job ID
+        """
+        self.store.create(job_id, job_dir, answer_key_path, submissions_path, question_text_path)
+        self._submit(job_id)
+        return job_id
+
+    def resume(self) -> None:
+        """
+        Recover jobs left behind by an app process that has exited.
+
+        Queued jobs are resubmitted; a job claimed by another live process is
+        skipped by claim.
+        """
+        for job_id in self.store.orphaned():
+            self.store.update(job_id, status=FAILED, finished_at=time.time(), error="Interrupted by a restart")
+        for job_id in self.store.ids_with_status(QUEUED):
+            self._submit(job_id)
+
+    def remove_expired(self, max_age: float, cache: JobCache = None) -> List[str]:
+        """
+        Delete finished jobs, including their directories, once they pass the retention period.
+
+        Args:
+            max_age: Retention period in seconds after a job finishes
+            cache: Optional cache to evict the deleted jobs from
+
+        Returns:
+            IDs of the deleted jobs
+        """
+        removed = []
+        for job in self.store.finished_before(time.time() - max_age):
+            # Only delete directories this queue created
+            if os.path.dirname(os.path.abspath(job["job_dir"])) == self.jobs_dir:
+                remove_tree(job["job_dir"])
+            self.store.delete(job["id"])
+            if cache is not None:
+                cache.evict(job["id"])
+            removed.append(job["id"])
+        return removed
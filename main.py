@@ -1,23 +1,35 @@
 import os
+import csv
 import json
-import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union, Callable, Iterable
+from engine import EncodedAnswerKey, GradedBatch, grade_submissions
+from stats import StatsAccumulator, accumulator_path
+from streaming import iter_submissions, chunked, report_progress
+from student_index import build_csv_index
+from fileutil import atomic_write
+from runcache import RunCache
+from instrument import instrumented, metrics
+from store import RESULT_FORMATS, CsvResultsWriter, ResultsStoreWriter, write_results_store
 
 class MCQGrader:
     """
     A class to grade multiple-choice questions, provide feedback, and generate statistics.
     """
     
-    def __init__(self, answer_key: Dict[str, str]):
+    def __init__(self, answer_key: Dict[str, str], scoring: Dict[str, Any] = None):
         """
         Initialize the MCQ grader with an answer key.
         
         Args:
             answer_key: Dictionary with question IDs as keys and correct answers as values
+            scoring: Optional scoring rules (weights, penalties, partial credit, voided questions),
+                as described in scoring.ScoringPlan
         """
         self.answer_key = answer_key
+        self.scoring = scoring
         self.results_dir = "results"
+        self._encoded_key = None
         
         # Create results directory if it doesn't exist
         if not os.path.exists(self.results_dir):
@@ -34,6 +46,16 @@ class MCQGrader:
         Returns:
             Dictionary containing grading results and feedback
         """
+        if self.scoring or self.encoded_key.multi_select:
+            # Scoring rules and multi-select questions are applied by the compiled plan
+            key = self.encoded_key
+            result = key.grade([student_id], key.encode_answers(student_answers)[None, :]).result(0).to_dict()
+            # Report answers as submitted, not as the canonical labels they were graded by
+            for question_result in result["question_details"]:
+                if question_result["student_answer"] is not None:
+                    question_result["student_answer"] = student_answers[question_result["question_id"]]
+            return result
+        
         # Initialize result structure
         result = {
             "student_id": student_id,
@@ -73,34 +95,220 @@ class MCQGrader:
         
         return result
     
-    def grade_batch(self, submissions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    @property
+    def encoded_key(self) -> EncodedAnswerKey:
+        """
+        The answer key encoded into option codes, re-encoded if the key or the scoring rules changed.
+        """
+        if (self._encoded_key is None or self._encoded_key.answer_key != self.answer_key
+                or self._encoded_key.scoring != self.scoring):
+            self._encoded_key = EncodedAnswerKey(self.answer_key, scoring=self.scoring)
+        return self._encoded_key
+    
+    @instrumented("grade_batch", rows=len)
+    def grade_batch(self, submissions: List[Dict[str, Any]], columnar: bool = False,
+                    compact: bool = False) -> Union[List[Dict[str, Any]], GradedBatch]:
         """
         Grade multiple submissions at once.
         
+        The whole cohort is encoded into an answer matrix and graded with
+        vectorized array operations.
+        
         Args:
             submissions: List of dictionaries, each containing student_id and answers
+            columnar: Return a compact GradedBatch instead of a list of result dicts
+            compact: Return read-only CompactResult records instead of plain dicts
             
         Returns:
-            List of grading results
+            List of grading results, or a GradedBatch if columnar is True
+        """
+        batch = grade_submissions(self.encoded_key, submissions)
+        
+        if columnar:
+            return batch
+        
+        if compact:
+            return batch.to_results()
+        
+        return [result.to_dict() for result in batch.to_results()]
+    
+    @instrumented("grade_stream", rows=lambda result: result[1].get("total_submissions", 0))
+    def grade_stream(self, submissions_path: str, filename: str = None, chunk_size: int = 10000,
+                     extended: bool = False, on_batch: Callable[[GradedBatch], None] = None,
+                     workers: int = 1, output_format: str = "csv",
+                     on_progress: Callable[[int, float], None] = None) -> Tuple[str, Dict[str, Any]]:
         """
-        results = []
+        Grade a submissions file too large to load into memory.
+        
+        Submissions are read incrementally from a JSON array or JSON Lines file,
+        graded in chunks, written to the results file as they go and folded into
+        running statistics, so peak memory does not grow with the cohort size.
         
-        for submission in submissions:
-            student_id = submission.get("student_id")
-            answers = submission.get("answers", {})
+        Args:
+            submissions_path: Path to the submissions file
+            filename: Optional filename for the results file
+            chunk_size: Number of submissions graded per chunk
+            extended: Also report standard deviation, percentiles, a score histogram and item analysis
+            on_batch: Optional callback invoked with each graded chunk (serial runs only)
+            workers: Number of worker processes grading chunks in parallel
+            output_format: Results format, "csv" or "binary"
+            on_progress: Optional callback receiving (submissions read, fraction of the file read)
             
-            if student_id and answers:
-                result = self.grade_submission(student_id, answers)
-                results.append(result)
+        Returns:
+            Tuple of (path to the results file, statistics dictionary)
+        """
+        with open(submissions_path, 'r') as src:
+            chunks = chunked(iter_submissions(src), chunk_size)
+            if on_progress:
+                chunks = report_progress(chunks, src, on_progress)
+            return self._grade_chunks(chunks, filename, extended, on_batch, workers, output_format)
+    
+    @instrumented("grade_parallel", rows=lambda result: result[1].get("total_submissions", 0))
+    def grade_parallel(self, submissions: Iterable[Dict[str, Any]], workers: int = None,
+                       filename: str = None, chunk_size: int = 10000, extended: bool = False,
+                       output_format: str = "csv") -> Tuple[str, Dict[str, Any]]:
+        """
+        Grade submissions in shards across a process pool.
         
-        return results
+        Workers send back rendered CSV rows and partial statistics per shard,
+        which are merged in shard order so the results file and statistics are
+        byte-identical to a serial run.
+        
+        Args:
+            submissions: Iterable of dictionaries, each containing student_id and answers
+            workers: Number of worker processes (defaults to the CPU count)
+            filename: Optional filename for the results file
+            chunk_size: Number of submissions per shard
+            extended: Also report standard deviation, percentiles, a score histogram and item analysis
+            output_format: Results format, "csv" or "binary"
+            
+        Returns:
+            Tuple of (path to the results file, statistics dictionary)
+        """
+        workers = workers or os.cpu_count() or 1
+        chunks = chunked(submissions, chunk_size)
+        return self._grade_chunks(chunks, filename, extended, None, workers, output_format)
+    
+    def _grade_chunks(self, chunks: Iterable[List[Dict[str, Any]]], filename: str, extended: bool,
+                      on_batch: Callable[[GradedBatch], None], workers: int,
+                      output_format: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Grade chunks of submissions, writing results and folding statistics as they finish.
+        """
+        if workers > 1 and on_batch:
+            raise ValueError("on_batch is only supported when grading with a single worker")
+        if output_format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown results format: {output_format}")
+        
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"mcq_results_{timestamp}{RESULT_FORMATS[output_format]}"
+        
+        filepath = os.path.join(self.results_dir, filename)
+        encoded_key = self.encoded_key
+        accumulator = StatsAccumulator(encoded_key.question_ids, item_analysis=extended)
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        if output_format == "binary":
+            writer = ResultsStoreWriter(filepath, encoded_key, timestamp)
+        else:
+            writer = CsvResultsWriter(filepath, encoded_key)
+        
+        with writer:
+            if workers > 1:
+                # The process pool is only imported by runs that use one
+                from parallel import grade_shards
+                for payload, partial in grade_shards(self.answer_key, chunks, workers, timestamp, output_format,
+                                                    extended, self.scoring):
+                    if output_format == "binary":
+                        # Only the worker-local option codes need translating; the graded columns are reused
+                        student_ids, answers, options, *graded = payload
+                        writer.add_batch(GradedBatch(encoded_key, student_ids, encoded_key.recode(answers, options),
+                                                     *graded, timestamp))
+                    else:
+                        writer.write_rows(payload)
+                    accumulator.merge(partial)
+            else:
+                # Parsing happens while the next chunk is pulled from the input
+                for chunk in metrics.timed_iter("parse_submissions", chunks):
+                    with metrics.stage("grade_chunk", len(chunk)):
+                        batch = grade_submissions(encoded_key, chunk, timestamp)
+                    with metrics.stage("write_results", len(batch)):
+                        writer.add_batch(batch)
+                    with metrics.stage("accumulate_statistics", len(batch)):
+                        accumulator.add_batch(batch)
+                    
+                    if on_batch:
+                        on_batch(batch)
+        
+        if output_format == "csv":
+            with metrics.stage("build_csv_index"):
+                build_csv_index(filepath)
+        
+        return filepath, accumulator.to_statistics(extended)
+    
+    @instrumented("grade_cached", rows=lambda result: result[2].get("total_submissions", 0))
+    def grade_cached(self, submissions_path: str, cache: RunCache, chunk_size: int = 10000,
+                     extended: bool = False, workers: int = 1, output_format: str = "csv",
+                     on_progress: Callable[[int, float], None] = None) -> Tuple[str, str, Dict[str, Any], bool]:
+        """
+        Grade a submissions file through a content-addressed run cache.
+    
+        If the same answer key, options and submissions bytes were graded
+        before, the cached results and statistics are returned without grading.
+        Otherwise the file is graded with grade_stream into the cache.
+    
+        Args:
+            submissions_path: Path to the submissions file
+            cache: Run cache to look up and store the run in
+            chunk_size: Number of submissions graded per chunk
+            extended: Also report standard deviation, percentiles, a score histogram and item analysis
+            workers: Number of worker processes grading chunks in parallel
+            output_format: Results format, "csv" or "binary"
+            on_progress: Optional callback receiving (submissions read, fraction of the file read)
+    
+        Returns:
+            Tuple of (results path, statistics JSON path, statistics dictionary, whether the cache was hit)
+        """
+        options = {"output_format": output_format, "extended": extended}
+        if self.scoring:
+            options["scoring"] = self.scoring
+        key = cache.key(self.answer_key, submissions_path, **options)
+        manifest = cache.get(key)
+        hit = manifest is not None
+    
+        if not hit:
+            staging_dir = cache.stage()
+            results_dir = self.results_dir
+            self.results_dir = staging_dir
+            try:
+                results_path, stats = self.grade_stream(submissions_path, None, chunk_size, extended,
+                                                        None, workers, output_format, on_progress)
+                stats_path = self.export_statistics_json(stats)
+            except BaseException:
+                cache.discard(staging_dir)
+                raise
+            finally:
+                self.results_dir = results_dir
+            manifest = cache.put(key, staging_dir, results_path, stats_path)
+    
+        with open(manifest["stats_path"], 'r') as f:
+            stats = json.load(f)
     
-    def generate_statistics(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return manifest["results_path"], manifest["stats_path"], stats, hit
+    
+    @instrumented("generate_statistics", rows_arg="results")
+    def generate_statistics(self, results: Union[List[Dict[str, Any]], GradedBatch],
+                            extended: bool = False) -> Dict[str, Any]:
         """
         Generate statistics from a set of graded submissions.
         
+        Per-question attempts and correct counts are gathered in a single pass
+        over the results, or straight from the columns of a GradedBatch.
+        
         Args:
-            results: List of graded submission results
+            results: List of graded submission results, or a GradedBatch
+            extended: Also report standard deviation, percentiles, a score histogram and item analysis
             
         Returns:
             Dictionary containing statistical analysis
@@ -108,44 +316,38 @@ class MCQGrader:
         if not results:
             return {"error": "No results to analyze"}
         
-        stats = {
-            "total_submissions": len(results),
-            "average_score": 0.0,
-            "highest_score": 0.0,
-            "lowest_score": 100.0,
-            "median_score": 0.0,
-            "question_analysis": {},
-        }
+        return self.accumulate(results, item_analysis=extended).to_statistics(extended)
+    
+    @instrumented("accumulate", rows_arg="results")
+    def accumulate(self, results: Union[List[Dict[str, Any]], GradedBatch],
+                   track_students: bool = False, item_analysis: bool = False) -> StatsAccumulator:
+        """
+        Fold graded submissions into a mergeable statistics accumulator.
         
-        # Calculate overall statistics
-        scores = [r["score_percentage"] for r in results]
-        stats["average_score"] = sum(scores) / len(scores)
-        stats["highest_score"] = max(scores)
-        stats["lowest_score"] = min(scores)
-        stats["median_score"] = sorted(scores)[len(scores) // 2]
-        
-        # Analyze performance by question
-        for q_id in self.answer_key.keys():
-            question_stats = {
-                "attempts": 0,
-                "correct": 0,
-                "correct_percentage": 0.0,
-            }
+        With track_students enabled, late or re-submitted papers can later be
+        added, removed or replaced in O(Q) instead of recomputing everything:
+        
+            accumulator.replace_result(grader.grade_submission(student_id, answers))
+        
+        Args:
+            results: List of graded submission results, or a GradedBatch
+            track_students: Keep per-student contributions for remove/replace
+            item_analysis: Also accumulate distractor, discrimination and reliability statistics
             
+        Returns:
+            StatsAccumulator holding the statistics of the results
+        """
+        accumulator = StatsAccumulator(self.answer_key.keys(), track_students, item_analysis)
+        
+        if isinstance(results, GradedBatch):
+            accumulator.add_batch(results)
+        else:
             for result in results:
-                for q_detail in result["question_details"]:
-                    if q_detail["question_id"] == q_id and q_detail["student_answer"] is not None:
-                        question_stats["attempts"] += 1
-                        if q_detail["is_correct"]:
-                            question_stats["correct"] += 1
-            
-            if question_stats["attempts"] > 0:
-                question_stats["correct_percentage"] = (question_stats["correct"] / question_stats["attempts"]) * 100
-            
-            stats["question_analysis"][q_id] = question_stats
+                accumulator.add_result(result)
         
-        return stats
+        return accumulator
     
+    @instrumented("export_results_csv", rows_arg="results")
     def export_results_csv(self, results: List[Dict[str, Any]], filename: str = None) -> str:
         """
         Export grading results to a CSV file.
@@ -163,8 +365,9 @@ class MCQGrader:
         
         filepath = os.path.join(self.results_dir, filename)
         
-        # Prepare data for DataFrame
-        data = []
+        # Columns are the fixed ones followed by each question's, in first-seen order
+        columns = dict.fromkeys(["Student ID", "Timestamp", "Questions Attempted", "Correct Answers", "Score (%)"])
+        rows = []
         for result in results:
             row = {
                 "Student ID": result["student_id"],
@@ -180,14 +383,43 @@ class MCQGrader:
                 row[f"Q{q_id} Answer"] = q_detail["student_answer"] if q_detail["student_answer"] else "Unanswered"
                 row[f"Q{q_id} Correct"] = "Yes" if q_detail["is_correct"] else "No"
             
-            data.append(row)
+            if row.keys() - columns.keys():
+                columns.update(dict.fromkeys(row))
+            rows.append(row)
+        
+        with atomic_write(filepath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(columns), lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
         
-        # Create and save DataFrame
-        df = pd.DataFrame(data)
-        df.to_csv(filepath, index=False)
+        # Index rows by student ID for direct lookups
+        build_csv_index(filepath)
         
         return filepath
     
+    @instrumented("export_results_binary", rows_arg="batch")
+    def export_results_binary(self, batch: GradedBatch, filename: str = None) -> str:
+        """
+        Export grading results to a columnar binary results store.
+        
+        The store keeps one answer code per question per student, a correctness
+        bitmap, the score columns and a student ID index. It can be memory-mapped
+        and read back one student at a time with store.ResultsStore.
+        
+        Args:
+            batch: Columnar grading results from grade_batch(columnar=True)
+            filename: Optional filename for the store
+            
+        Returns:
+            Path to the created store file
+        """
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"mcq_results_{timestamp}{RESULT_FORMATS['binary']}"
+        
+        return write_results_store(batch, os.path.join(self.results_dir, filename))
+    
+    @instrumented("export_statistics_json")
     def export_statistics_json(self, stats: Dict[str, Any], filename: str = None) -> str:
         """
         Export statistics to a JSON file.
@@ -205,11 +437,163 @@ class MCQGrader:
         
         filepath = os.path.join(self.results_dir, filename)
         
-        with open(filepath, 'w') as f:
+        with atomic_write(filepath) as f:
             json.dump(stats, f, indent=2)
         
         return filepath
     
+    def export_accumulator(self, accumulator: StatsAccumulator, stats_path: str) -> str:
+        """
+        Save a statistics accumulator next to its exported statistics JSON.
+        
+        Args:
+            accumulator: Accumulator to save
+            stats_path: Path returned by export_statistics_json
+            
+        Returns:
+            Path to the created accumulator file
+        """
+        filepath = accumulator_path(stats_path)
+        
+        with atomic_write(filepath) as f:
+            json.dump(accumulator.to_dict(), f)
+        
+        return filepath
+    
+    def load_accumulator(self, stats_path: str) -> StatsAccumulator:
+        """
+        Load the accumulator saved next to an exported statistics JSON.
+        
+        Args:
+            stats_path: Path returned by export_statistics_json
+            
+        Returns:
+            The restored StatsAccumulator
+        """
+        with open(accumulator_path(stats_path), 'r') as f:
+            return StatsAccumulator.from_dict(json.load(f))
+    
+    def export_feedback(self, results_path: str, question_text: Dict[str, str] = None, filename: str = None,
+                        archive: bool = False, workers: int = 1, chunk_size: int = 10000) -> Tuple[str, int]:
+        """
+        Write the feedback report of every student in a results file.
+        
+        Reports are identical to generate_feedback, but the per-question text
+        is formatted once and the results file is rendered block by block,
+        optionally in worker processes. Each student gets a text file, and a
+        manifest.csv maps student IDs to their files.
+        
+        Args:
+            results_path: Results CSV or binary results store
+            question_text: Optional dictionary mapping question IDs to question text
+            filename: Optional name of the output directory, or of the zip archive
+            archive: Write a zip archive instead of a directory
+            workers: Number of worker processes to render with
+            chunk_size: Students rendered per block
+            
+        Returns:
+            Tuple of (path to the directory or archive, number of reports)
+        """
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"mcq_feedback_{timestamp}{'.zip' if archive else ''}"
+        
+        filepath = os.path.join(self.results_dir, filename)
+        
+        from feedback import write_feedback
+        
+        with metrics.stage("export_feedback") as record:
+            count = write_feedback(self.answer_key, results_path, filepath, question_text, archive, workers,
+                                   chunk_size)
+            if record:
+                record.rows = count
+        
+        return filepath, count
+    
+    def find_result(self, results_path: str, student_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up one student's result in an exported results file by index.
+        
+        Args:
+            results_path: Results CSV or binary results store
+            student_id: Student to look up
+            
+        Returns:
+            Result dict usable with generate_feedback, or None if the student is not in the file
+        """
+        from feedback import find_result
+        
+        return find_result(self.answer_key, results_path, student_id)
+    
+    def export_collusion_report(self, results: Union[str, GradedBatch], filename: str = None, workers: int = 1,
+                                min_shared_wrong: int = None,
+                                min_similarity: float = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Scan graded answers for pairs of students sharing unusually many wrong answers.
+        
+        Args:
+            results: Results CSV, binary results store or graded batch
+            filename: Optional filename for the report JSON
+            workers: Number of worker processes to scan with
+            min_shared_wrong: Identical wrong answers a pair needs to be reported
+            min_similarity: Similarity of the wrong answers a pair needs to be reported
+            
+        Returns:
+            Tuple of (path to the report JSON, report)
+        """
+        import collusion
+        
+        thresholds = {
+            "min_shared_wrong": collusion.DEFAULT_MIN_SHARED_WRONG if min_shared_wrong is None else min_shared_wrong,
+            "min_similarity": collusion.DEFAULT_MIN_SIMILARITY if min_similarity is None else min_similarity,
+        }
+        
+        with metrics.stage("collusion_scan") as record:
+            if isinstance(results, GradedBatch):
+                report = collusion.scan_answer_matrix(results.student_ids, results.question_ids, results.answers,
+                                                      results.correct, results.scores, workers, **thresholds)
+            else:
+                report = collusion.scan_results(results, workers, **thresholds)
+            if record:
+                record.rows = report["students"]
+        
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"mcq_collusion_{timestamp}.json"
+        
+        filepath = os.path.join(self.results_dir, filename)
+        
+        with atomic_write(filepath) as f:
+            json.dump(report, f, indent=2)
+        
+        return filepath, report
+    
+    @instrumented("regrade", rows=lambda result: result[1])
+    def regrade(self, results_path: str, questions: Iterable[str] = None,
+                stats_path: str = None) -> Tuple[List[str], int, Optional[Dict[str, Any]]]:
+        """
+        Re-grade a binary results store in place after correcting the answer key.
+        
+        Only the corrected questions are graded again, from the answer codes
+        kept in the store, so the submissions are not read and a one-question
+        fix costs a pass over one answer column plus rewriting the store.
+        Scores, and the statistics JSON if given, are adjusted to match.
+        Feedback reports and CSV files exported from the old results are not
+        updated; CSV downloads rendered from the store are.
+        
+        Args:
+            results_path: Binary results store graded with the old answer key
+            questions: IDs of the corrected questions, detected from the store if not given
+            stats_path: Optional statistics JSON exported for the store, updated in place
+        
+        Returns:
+            Tuple of (re-graded question IDs, number of students whose results changed, updated statistics or None)
+        """
+        from regrade import regrade_store
+        
+        return regrade_store(results_path, self.answer_key, self.scoring, questions, stats_path)
+    
+    @instrumented("generate_feedback", rows=lambda feedback: 1)
     def generate_feedback(self, result: Dict[str, Any], question_text: Dict[str, str] = None) -> str:
         """
         Generate human-readable feedback for a student.
@@ -0,0 +1,75 @@
+import csv
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from engine import EncodedAnswerKey, grade_submissions
+from stats import StatsAccumulator
+
+# Answer key encoded once per worker process by _init_worker
+_worker_key = None
+
+
+def _init_worker(answer_key: Dict[str, str], scoring: Optional[Dict[str, Any]]) -> None:
+    global _worker_key
+    _worker_key = EncodedAnswerKey(answer_key, scoring=scoring)
+
+
+def _grade_shard(shard: List[Dict[str, Any]], timestamp: str, output_format: str,
+                 item_analysis: bool) -> Tuple[Any, StatsAccumulator]:
+    """Grade one shard in a worker, returning its rendered output and partial statistics."""
+    batch = grade_submissions(_worker_key, shard, timestamp)
+
+    if output_format == "binary":
+        # Answer codes are worker-local, so the option vocabulary travels with them
+        payload = (batch.student_ids, batch.answers, list(_worker_key.codes.options),
+                   batch.correct, batch.attempted, batch.correct_count, batch.scores)
+    else:
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerows(batch.iter_csv_rows())
+        payload = out.getvalue()
+
+    accumulator = StatsAccumulator(_worker_key.question_ids, item_analysis=item_analysis)
+    accumulator.add_batch(batch)
+
+    return payload, accumulator
+
+
+def grade_shards(answer_key: Dict[str, str], shards: Iterable[List[Dict[str, Any]]], workers: int,
+                 timestamp: str, output_format: str = "csv", item_analysis: bool = False,
+                 scoring: Dict[str, Any] = None) -> Iterator[Tuple[Any, StatsAccumulator]]:
+    """
+    Grade shards of submissions in a process pool.
+
+    Workers return a partial StatsAccumulator per shard instead of result
+    dicts, together with the rendered CSV rows or, for the binary format, the
+    student IDs, answer matrix and option vocabulary followed by the graded
+    correct, attempted, correct count and score columns. Results are yielded in
+    shard order, so concatenating the output and merging the accumulators
+    reproduces a serial run exactly. At most two shards per worker are in flight at any time, which
+    keeps memory bounded when shards come from a stream.
+
+    Args:
+        answer_key: Dictionary with question IDs as keys and correct answers as values
+        shards: Iterable of submission lists
+        workers: Number of worker processes
+        timestamp: Grading timestamp shared by every shard
+        output_format: Results format, "csv" or "binary"
+        item_analysis: Also accumulate item analysis statistics per shard
+        scoring: Optional scoring rules the workers grade with
+
+    Yields:
+        Tuple of (rendered output, partial statistics) for each shard
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(answer_key, scoring)) as pool:
+        pending = deque()
+
+        for shard in shards:
+            pending.append(pool.submit(_grade_shard, shard, timestamp, output_format, item_analysis))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,183 @@
+import json
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+from csvexport import offsets_path
+from engine import EncodedAnswerKey, OptionCodes
+from fileutil import atomic_write
+from runcache import is_cached_output
+from stats import StatsAccumulator, accumulator_path, analyze_questions, summarize_scores
+from store import ResultsStore, is_results_store, rewrite_results_store
+
+# Students re-graded per block, which bounds the memory used by the answer columns
+BLOCK_ROWS = 65536
+
+
+def changed_questions(store: ResultsStore, answer_key: Dict[str, Any], scoring: Dict[str, Any] = None) -> List[str]:
+    """
+    Questions whose grading differs between a results store and an answer key with scoring rules.
+
+    A question changes when its key entry or its own scoring rules change.
+    Any change to the top-level scoring rules changes every question.
+
+    Args:
+        store: Results store graded with the old answer key
+        answer_key: Corrected answer key
+        scoring: Scoring rules to grade with
+
+    Returns:
+        Question IDs in answer key order
+    """
+    old_rules = store.scoring or {}
+    new_rules = scoring or {}
+    old_questions = old_rules.get("questions", {})
+    new_questions = new_rules.get("questions", {})
+
+    everything = ({name: value for name, value in old_rules.items() if name != "questions"}
+                  != {name: value for name, value in new_rules.items() if name != "questions"})
+    return [
+        q_id for q_id, answer in answer_key.items()
+        if everything or answer != store.answer_key[q_id]
+        or old_questions.get(q_id, {}) != new_questions.get(q_id, {})
+    ]
+
+
+def _update_statistics(stats_path: str, store: ResultsStore, question_ids: List[str],
+                       correct: Dict[str, int]) -> Dict[str, Any]:
+    """Bring the statistics of a re-graded store up to date, rewriting the file and any saved accumulator."""
+    with open(stats_path, 'r') as f:
+        stats = json.load(f)
+    if stats.get("total_submissions") != len(store):
+        raise ValueError(f"The statistics in {stats_path} do not describe the results store {store.filepath}")
+    extended = "score_std_dev" in stats
+
+    if "item_analysis" in stats:
+        # Discrimination and reliability depend on every student's total score, so they are recomputed
+        accumulator = StatsAccumulator(store.question_ids, item_analysis=True)
+        for start in range(0, len(store), BLOCK_ROWS):
+            accumulator.add_batch(store.batch(start, min(start + BLOCK_ROWS, len(store))))
+        stats = accumulator.to_statistics(extended)
+    else:
+        values, counts = np.unique(store.scores, return_counts=True)
+        stats.update(summarize_scores(dict(zip(values.tolist(), counts.tolist())), extended))
+        analysis = stats["question_analysis"]
+        for q_id in question_ids:
+            analysis.update(analyze_questions([q_id], [analysis[q_id]["attempts"]], [correct[q_id]]))
+
+    with atomic_write(stats_path) as f:
+        json.dump(stats, f, indent=2)
+
+    saved = accumulator_path(stats_path)
+    if os.path.exists(saved):
+        with open(saved, 'r') as f:
+            track_students = json.load(f).get("students") is not None
+        accumulator = StatsAccumulator(store.question_ids, track_students=track_students)
+        for start in range(0, len(store), BLOCK_ROWS):
+            accumulator.add_batch(store.batch(start, min(start + BLOCK_ROWS, len(store))))
+        with atomic_write(saved) as f:
+            json.dump(accumulator.to_dict(), f)
+
+    return stats
+
+
+def regrade_store(results_path: str, answer_key: Dict[str, Any], scoring: Dict[str, Any] = None,
+                  questions: Iterable[str] = None,
+                  stats_path: str = None) -> Tuple[List[str], int, Optional[Dict[str, Any]]]:
+    """
+    Re-grade a binary results store after answer key corrections, without the submissions.
+
+    Only the correctness columns of the changed questions are graded again,
+    from the stored answer codes. Correct counts are adjusted by the flipped
+    answers and scores are recomputed from them (or from the scoring plan),
+    block by block. The store is then rewritten with the corrected key.
+
+    With a statistics JSON, its overall figures are recomputed from the new
+    scores and only the changed questions' analysis is updated, unless it
+    holds item analysis, which depends on every score and is recomputed. An
+    accumulator saved next to it is rebuilt from the store.
+
+    Args:
+        results_path: Binary results store graded with the old answer key
+        answer_key: Corrected answer key, with the same questions in the same order
+        scoring: Scoring rules to grade with
+        questions: IDs of the corrected questions, detected from the store if not given
+        stats_path: Optional statistics JSON exported for the store
+
+    Returns:
+        Tuple of (re-graded question IDs, number of students whose results changed, updated statistics or None)
+
+    Raises:
+        ValueError: If the results are not a binary store outside the run cache, the questions differ, or a
+            changed question is not listed
+    """
+    if not is_results_store(results_path):
+        raise ValueError("Re-grading needs a binary results store; grade with --format binary")
+    if is_cached_output(results_path):
+        raise ValueError("The results store belongs to the run cache; re-grade a copy, or grade with --no-cache")
+
+    store = ResultsStore(results_path)
+    if store.question_ids != list(answer_key):
+        raise ValueError("The answer key does not have the results store's questions; grade the submissions again")
+
+    detected = changed_questions(store, answer_key, scoring)
+    if questions is None:
+        questions = detected
+    else:
+        questions = list(dict.fromkeys(str(q_id) for q_id in questions))
+        unknown = [q_id for q_id in questions if q_id not in answer_key]
+        if unknown:
+            raise ValueError(f"Questions not in the answer key: {', '.join(unknown)}")
+        unlisted = [q_id for q_id in detected if q_id not in questions]
+        if unlisted:
+            raise ValueError(f"Questions changed but not listed for re-grading: {', '.join(unlisted)}")
+        # Keep answer key order, which is also the column order
+        questions = [q_id for q_id in answer_key if q_id in questions]
+
+    if not questions:
+        return [], 0, None
+
+    key = EncodedAnswerKey(answer_key, OptionCodes.from_options(store.options), scoring)
+    columns = [key.question_index[q_id] for q_id in questions]
+
+    n = len(store)
+    correct_bits = np.array(store.columns["correct_bits"])
+    correct_count = np.array(store.columns["correct_count"])
+    scores = np.empty(n, dtype=np.float64)
+    changed = np.zeros(n, dtype=bool)
+    correct = dict.fromkeys(questions, 0)
+
+    for start in range(0, n, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, n)
+        answers = store.answers[start:stop]
+        bits = correct_bits[start:stop]
+        counts = correct_count[start:stop]
+
+        for q_id, j, now in zip(questions, columns, key.correctness(answers, columns).T):
+            # Correctness bits are packed little-endian, eight questions per byte
+            byte, mask = j // 8, np.uint8(1 << (j % 8))
+            was = (bits[:, byte] & mask) != 0
+            bits[:, byte] = np.where(now, bits[:, byte] | mask, bits[:, byte] & ~mask)
+            counts += now.astype(np.int32) - was
+            changed[start:stop] |= now != was
+            correct[q_id] += int(now.sum())
+
+        if key.plan is not None:
+            _, scores[start:stop] = key.plan.score(answers)
+        else:
+            scores[start:stop] = key.percentages(counts)
+
+    changed |= scores != store.scores
+    students_changed = int(changed.sum())
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rewrite_results_store(store, key, {"correct_bits": correct_bits, "correct_count": correct_count,
+                                       "scores": scores}, timestamp)
+    # CSV block offsets saved for range downloads no longer match the rows
+    if os.path.exists(offsets_path(results_path)):
+        os.unlink(offsets_path(results_path))
+
+    stats = _update_statistics(stats_path, ResultsStore(results_path), questions, correct) if stats_path else None
+    return questions, students_changed, stats
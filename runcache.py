@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
+
+from fileutil import atomic_write, remove_tree
+
+# Bump when the layout of cached outputs changes so stale entries are never served
+CACHE_VERSION = 2
+
+# Default size limit of a run cache
+DEFAULT_CACHE_BYTES = 1 << 30
+
+_MANIFEST = "manifest.json"
+_READ_SIZE = 1 << 20
+
+
+def _entry_size(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def is_cached_output(path: str) -> bool:
+    """
+    Whether a file belongs to a run cache entry, whose outputs must not be changed in place.
+
+    Args:
+        path: Path of a results or statistics file
+
+    Returns:
+        True if the file sits next to a run cache manifest
+    """
+    return os.path.exists(os.path.join(os.path.dirname(os.path.abspath(path)), _MANIFEST))
+
+
+class RunCache:
+    """
+    Content-addressed, size-bounded cache of grading runs.
+
+    A run is keyed by a hash of the answer key, the grading options and the
+    raw bytes of the submissions file, so re-grading identical inputs returns
+    the earlier results and statistics files instead of grading again. Each
+    entry is a directory named after its key holding the output files and a
+    manifest; the manifest's modification time records the last use, and the
+    least recently used entries are evicted once the cache outgrows its limit.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """
+        Open (creating if needed) a run cache.
+
+        Args:
+            cache_dir: Directory holding the cache entries
+            max_bytes: Total size the cache is trimmed to after each new entry
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, answer_key: Dict[str, str], submissions_path: str, **options: Any) -> str:
+        """
+        Content hash identifying a grading run.
+
+        Args:
+            answer_key: Dictionary with question IDs as keys and correct answers as values
+            submissions_path: Path to the submissions file
+            **options: Grading options that change the outputs, such as output_format
+
+        Returns:
+            Hex digest naming the cache entry
+        """
+        digest = hashlib.sha256()
+        # Key order is kept: it decides the column order of the results
+        digest.update(json.dumps([CACHE_VERSION, answer_key, sorted(options.items())]).encode("utf-8"))
+        digest.update(b"\0")
+
+        with open(submissions_path, 'rb') as f:
+            for block in iter(lambda: f.read(_READ_SIZE), b""):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached run and mark it as recently used.
+
+        Args:
+            key: Key from key()
+
+        Returns:
+            Manifest with absolute results_path and stats_path, or None on a miss
+        """
+        entry_dir = self._entry_dir(key)
+        manifest_path = os.path.join(entry_dir, _MANIFEST)
+
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            os.utime(manifest_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        manifest["results_path"] = os.path.join(entry_dir, manifest["results"])
+        manifest["stats_path"] = os.path.join(entry_dir, manifest["statistics"])
+        if not os.path.exists(manifest["results_path"]) or not os.path.exists(manifest["stats_path"]):
+            return None
+        return manifest
+
+    def stage(self) -> str:
+        """
+        Create an empty directory in the cache to write a new run's outputs into.
+
+        Returns:
+            Path of the staging directory, to be passed to put() or discard()
+        """
+        staging_dir = os.path.join(self.cache_dir, f".staging-{uuid.uuid4().hex}")
+        os.makedirs(staging_dir)
+        return staging_dir
+
+    def discard(self, staging_dir: str) -> None:
+        """
+        Delete a staging directory whose run failed.
+
+        Args:
+            staging_dir: Directory from stage()
+        """
+        remove_tree(staging_dir)
+
+    def put(self, key: str, staging_dir: str, results_path: str, stats_path: str) -> Dict[str, Any]:
+        """
+        Publish a staged run under its key and trim the cache.
+
+        Args:
+            key: Key from key()
+            staging_dir: Directory from stage() holding the run's outputs
+            results_path: Path of the results file inside staging_dir
+            stats_path: Path of the statistics JSON inside staging_dir
+
+        Returns:
+            Manifest of the cached run, as returned by get()
+        """
+        manifest = {
+            "key": key,
+            "results": os.path.basename(results_path),
+            "statistics": os.path.basename(stats_path),
+            "created": time.time(),
+        }
+        with atomic_write(os.path.join(staging_dir, _MANIFEST)) as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(staging_dir, self._entry_dir(key))
+        except OSError:
+            # An identical run finished first; keep its entry
+            self.discard(staging_dir)
+
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        All complete cache entries, least recently used first.
+
+        Returns:
+            List of dictionaries with key, size and last_used
+        """
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            manifest_path = os.path.join(entry.path, _MANIFEST)
+            if entry.name.startswith(".") or not os.path.exists(manifest_path):
+                continue
+            try:
+                found.append({
+                    "key": entry.name,
+                    "size": _entry_size(entry.path),
+                    "last_used": os.path.getmtime(manifest_path),
+                })
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+        return sorted(found, key=lambda e: e["last_used"])
+
+    def evict(self, keep: str = None) -> List[str]:
+        """
+        Delete least recently used entries until the cache fits its size limit.
+
+        Args:
+            keep: Optional key that is never evicted, such as the entry just added
+
+        Returns:
+            Keys of the evicted entries
+        """
+        entries = self.entries()
+        total = sum(e["size"] for e in entries)
+        evicted = []
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            remove_tree(self._entry_dir(entry["key"]))
+            total -= entry["size"]
+            evicted.append(entry["key"])
+
+        return evicted
+
+    def link_into(self, results_path: str, stats_path: str, dest_dir: str) -> Tuple[str, str]:
+        """
+        Hard-link (or copy, across file systems) a cached run's files into another directory.
+
+        The linked files outlive the cache entry, so a caller that keeps the
+        paths is not affected by later evictions.
+
+        Args:
+            results_path: Cached results path from get() or MCQGrader.grade_cached
+            stats_path: Cached statistics JSON path
+            dest_dir: Directory to place the files in
+
+        Returns:
+            Tuple of (results path, statistics JSON path) inside dest_dir
+        """
+        for entry in os.scandir(os.path.dirname(results_path)):
+            if entry.name == _MANIFEST:
+                continue
+            dest = os.path.join(dest_dir, entry.name)
+            if os.path.exists(dest):
+                # Linked by an earlier run of the same inputs
+                if os.path.samefile(entry.path, dest):
+                    continue
+                os.unlink(dest)
+            try:
+                os.link(entry.path, dest)
+            except OSError:
+                shutil.copy2(entry.path, dest)
+
+        return (os.path.join(dest_dir, os.path.basename(results_path)),
+                os.path.join(dest_dir, os.path.basename(stats_path)))
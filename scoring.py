@@ -0,0 +1,245 @@
+import json
+import numbers
+import numpy as np
+from typing import List, Dict, Any, Tuple
+
+# Separator of the options in the label of a multi-select answer
+SELECTION_SEPARATOR = ","
+
+# Option codes are shifted by this much in the tables, so that both unanswered
+# sentinels (-1 and -2) land in the first two columns
+_SENTINEL_SLOTS = 2
+
+# Per-question rule names, and the top-level defaults that apply to every question
+_QUESTION_RULES = {"weight", "penalty", "void", "credit", "partial_credit"}
+_TOP_LEVEL_RULES = {"weight", "penalty", "partial_credit", "clamp_at_zero", "questions"}
+
+
+def selection_label(selected: Any) -> str:
+    """
+    Canonical answer value of a multi-select answer given as a list of options.
+
+    Args:
+        selected: List, tuple or set of selected options
+
+    Returns:
+        The options, sorted and joined with SELECTION_SEPARATOR
+    """
+    return SELECTION_SEPARATOR.join(sorted(map(str, selected)))
+
+
+def _selection(answer: Any) -> frozenset:
+    """Options of a multi-select answer, given as a list or as a separated label."""
+    if isinstance(answer, (list, tuple, set, frozenset)):
+        return frozenset(map(str, answer))
+    return frozenset(part.strip() for part in str(answer).split(SELECTION_SEPARATOR) if part.strip())
+
+
+def _number(rules: Dict[str, Any], name: str, default: float, where: str) -> float:
+    value = rules.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, numbers.Real) or value < 0:
+        raise ValueError(f"{where}: {name} must be a non-negative number")
+    return float(value)
+
+
+def load_scoring(path: str) -> Dict[str, Any]:
+    """
+    Load scoring rules from a JSON file.
+
+    Args:
+        path: Path of the scoring rules JSON
+
+    Returns:
+        Dictionary of scoring rules for MCQGrader
+    """
+    with open(path, 'r') as f:
+        rules = json.load(f)
+    if not isinstance(rules, dict):
+        raise ValueError("Scoring rules must be a JSON object")
+    return rules
+
+
+class ScoringPlan:
+    """
+    Scoring rules compiled into per-question lookup tables over option codes.
+
+    For every question and option code the plan precomputes the points the
+    answer earns, and whether that is full credit. It does this once per
+    option value the first time the value appears. Grading a batch is then
+    a table lookup per answer and a row sum, however complex the rules are.
+
+    Rules are a dictionary, usually loaded from JSON:
+
+        {
+            "weight": 1,             default points per question
+            "penalty": 0.25,         default share of the weight lost for a wrong answer
+            "clamp_at_zero": true,   scores never go below 0% (the default)
+            "questions": {
+                "3": {"weight": 2},
+                "4": {"void": true},
+                "5": {"credit": {"B": 0.5}},
+                "6": {"partial_credit": true}
+            }
+        }
+
+    Voided questions earn nothing and are left out of the maximum. "credit"
+    gives a share of the weight for specific wrong options. A question whose
+    answer key entry is a list is multi-select. Students answer it with a
+    list of options, and only the exact set earns full credit. With
+    partial_credit, a selection earns the share of right options picked minus
+    the share of wrong options picked, floored at zero. Unanswered questions
+    earn nothing. Any other answer that earns no credit loses penalty x
+    weight.
+    """
+
+    def __init__(self, key, rules: Dict[str, Any]):
+        """
+        Compile scoring rules for an encoded answer key.
+
+        Args:
+            key: EncodedAnswerKey the rules apply to
+            rules: Scoring rules
+
+        Raises:
+            ValueError: If the rules are malformed or name questions not in the answer key
+        """
+        if not isinstance(rules, dict):
+            raise ValueError("Scoring rules must be a JSON object")
+        unknown = set(rules) - _TOP_LEVEL_RULES
+        if unknown:
+            raise ValueError(f"Unknown scoring rule(s): {', '.join(sorted(unknown))}")
+        questions = rules.get("questions", {})
+        missing = [q_id for q_id in questions if q_id not in key.question_index]
+        if missing:
+            raise ValueError(f"Scoring rules name questions not in the answer key: {', '.join(missing)}")
+
+        self.key = key
+        self.rules = rules
+        self.clamp_at_zero = bool(rules.get("clamp_at_zero", True))
+
+        default_weight = _number(rules, "weight", 1.0, "Scoring rules")
+        default_penalty = _number(rules, "penalty", 0.0, "Scoring rules")
+        default_partial = bool(rules.get("partial_credit", False))
+
+        q = key.questions_total
+        self.weights = np.zeros(q, dtype=np.float64)
+        self.penalties = np.zeros(q, dtype=np.float64)
+        self.void = np.zeros(q, dtype=bool)
+        self.credit = []
+        self.partial = []
+        self.selections = []
+
+        for j, (q_id, answer) in enumerate(key.answer_key.items()):
+            question = questions.get(q_id, {})
+            where = f"Scoring rules for question {q_id}"
+            unknown = set(question) - _QUESTION_RULES
+            if unknown:
+                raise ValueError(f"{where}: unknown rule(s): {', '.join(sorted(unknown))}")
+
+            self.weights[j] = _number(question, "weight", default_weight, where)
+            self.penalties[j] = _number(question, "penalty", default_penalty, where)
+            self.void[j] = bool(question.get("void", False))
+            self.partial.append(bool(question.get("partial_credit", default_partial)))
+
+            credit = question.get("credit", {})
+            if any(isinstance(share, bool) or not isinstance(share, numbers.Real) or not 0 <= share <= 1
+                   for share in credit.values()):
+                raise ValueError(f"{where}: credit shares must be between 0 and 1")
+            self.credit.append(credit)
+
+            selection = _selection(answer) if isinstance(answer, list) else None
+            if selection is not None and not selection:
+                raise ValueError(f"{where}: a multi-select answer needs at least one option")
+            self.selections.append(selection)
+
+        self.max_points = float(self.weights[~self.void].sum())
+
+        # Tables start with the two sentinel columns, which earn nothing
+        self.points = np.zeros((q, _SENTINEL_SLOTS), dtype=np.float64)
+        self.full_credit = np.zeros((q, _SENTINEL_SLOTS), dtype=bool)
+
+    def _share(self, j: int, code: int, option: Any) -> float:
+        """Share of question j's weight earned by an option."""
+        selection = self.selections[j]
+        if selection is None:
+            if code == self.key.key_codes[j]:
+                return 1.0
+            try:
+                return float(self.credit[j].get(option, 0.0))
+            except TypeError:
+                # Unhashable answers, such as a list given to a single-select question, earn no credit
+                return 0.0
+
+        chosen = _selection(option)
+        if chosen == selection:
+            return 1.0
+        if not self.partial[j]:
+            return 0.0
+        return max(0.0, (len(chosen & selection) - len(chosen - selection)) / len(selection))
+
+    def tables(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Points and full-credit tables covering every option code seen so far.
+
+        Columns for options added to the vocabulary since the last call are
+        computed here; everything else is reused.
+
+        Returns:
+            Tuple of (points, full credit) arrays of shape (questions, options + 2)
+        """
+        options = self.key.codes.options
+        known = self.points.shape[1] - _SENTINEL_SLOTS
+        if known < len(options):
+            new = len(options) - known
+            shares = np.array([
+                [self._share(j, code, options[code]) for code in range(known, len(options))]
+                for j in range(self.key.questions_total)
+            ], dtype=np.float64).reshape(self.key.questions_total, new)
+
+            weights = self.weights[:, None]
+            points = np.where(shares > 0, shares * weights, -self.penalties[:, None] * weights)
+            points[self.void] = 0.0
+            full = (shares == 1.0) & ~self.void[:, None]
+
+            self.points = np.concatenate((self.points, points), axis=1)
+            self.full_credit = np.concatenate((self.full_credit, full), axis=1)
+        return self.points, self.full_credit
+
+    def full_credit_columns(self, answers: np.ndarray, columns: List[int]) -> np.ndarray:
+        """
+        Full-credit flags of some question columns of an answer matrix.
+
+        Args:
+            answers: Answer matrix of option codes, negative when unanswered
+            columns: Indices of the questions to look up
+
+        Returns:
+            Boolean matrix with one column per requested question
+        """
+        _, full_credit = self.tables()
+        columns = np.asarray(columns, dtype=np.intp)
+        return full_credit[columns, answers[:, columns].astype(np.intp) + _SENTINEL_SLOTS]
+
+    def score(self, answers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score an encoded answer matrix.
+
+        Args:
+            answers: Answer matrix of option codes, negative when unanswered
+
+        Returns:
+            Tuple of (full-credit matrix, score percentages)
+        """
+        points, full_credit = self.tables()
+        # One flat gather per table: row j of the matrix indexes question j's table row
+        slots = answers.astype(np.intp) + (_SENTINEL_SLOTS + np.arange(answers.shape[1]) * points.shape[1])
+        earned = points.ravel()[slots].sum(axis=1)
+        correct = full_credit.ravel()[slots]
+
+        if self.max_points > 0:
+            scores = earned / self.max_points * 100
+        else:
+            scores = np.zeros(len(answers), dtype=np.float64)
+        if self.clamp_at_zero:
+            np.maximum(scores, 0.0, out=scores)
+        return correct, scores
@@ -0,0 +1,373 @@
+import math
+import os
+from collections import Counter
+from typing import List, Dict, Any, Sequence
+
+from item_analysis import ItemAnalysis
+
+# Percentiles reported by the extended statistics
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Number of equal-width score histogram bins between 0% and 100%
+HISTOGRAM_BINS = 10
+
+
+def _select(values: List[float], counts: List[int], rank: int) -> float:
+    """Return the score at a 0-based rank in a sorted (value, count) distribution."""
+    seen = 0
+    for value, count in zip(values, counts):
+        seen += count
+        if rank < seen:
+            return value
+    return values[-1]
+
+
+def summarize_scores(distribution: Dict[float, int], extended: bool = False) -> Dict[str, Any]:
+    """
+    Compute overall score statistics from a score distribution.
+
+    The median and percentiles are exact selections by cumulative count over
+    the distinct scores, so the cost is a sort of the D distinct values,
+    O(D log D), rather than of every score. Plain right/wrong grading gives at
+    most one distinct score per possible number of correct answers, but with
+    scoring rules (penalties, partial credit) D is only bounded by the number
+    of students.
+
+    Args:
+        distribution: Mapping of score percentage to number of students
+        extended: Also report standard deviation, percentiles and a histogram
+
+    Returns:
+        Dictionary with the overall score statistics
+    """
+    values = sorted(v for v, c in distribution.items() if c > 0)
+    counts = [distribution[v] for v in values]
+    total = sum(counts)
+
+    average = math.fsum(v * c for v, c in zip(values, counts)) / total
+
+    summary = {
+        "total_submissions": total,
+        "average_score": average,
+        "highest_score": values[-1],
+        "lowest_score": values[0],
+        "median_score": _select(values, counts, total // 2),
+    }
+
+    if extended:
+        variance = math.fsum(c * (v - average) ** 2 for v, c in zip(values, counts)) / total
+        summary["score_std_dev"] = math.sqrt(variance)
+        summary["score_percentiles"] = {
+            str(p): _select(values, counts, min(total - 1, p * total // 100))
+            for p in PERCENTILES
+        }
+        summary["score_histogram"] = score_histogram(values, counts)
+
+    return summary
+
+
+def score_histogram(values: Sequence[float], counts: Sequence[int]) -> Dict[str, int]:
+    """
+    Bucket a score distribution into equal-width percentage bins.
+
+    Args:
+        values: Distinct score percentages
+        counts: Number of students for each score
+
+    Returns:
+        Dictionary mapping a "low-high" bin label to the number of students
+    """
+    width = 100 // HISTOGRAM_BINS
+    bins = [0] * HISTOGRAM_BINS
+
+    for value, count in zip(values, counts):
+        index = min(max(int(value // width), 0), HISTOGRAM_BINS - 1)
+        bins[index] += count
+
+    return {f"{i * width}-{(i + 1) * width}": n for i, n in enumerate(bins)}
+
+
+def analyze_questions(question_ids: Sequence[str], attempts: Sequence[int],
+                      correct: Sequence[int]) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the per-question analysis from attempt and correct counts.
+
+    Args:
+        question_ids: Question IDs in answer key order
+        attempts: Number of students who answered each question
+        correct: Number of students who answered each question correctly
+
+    Returns:
+        Dictionary mapping question ID to its statistics
+    """
+    analysis = {}
+
+    for q_id, q_attempts, q_correct in zip(question_ids, attempts, correct):
+        question_stats = {
+            "attempts": int(q_attempts),
+            "correct": int(q_correct),
+            "correct_percentage": 0.0,
+        }
+
+        if q_attempts > 0:
+            question_stats["correct_percentage"] = (int(q_correct) / int(q_attempts)) * 100
+
+        analysis[q_id] = question_stats
+
+    return analysis
+
+
+class StatsAccumulator:
+    """
+    Running statistics that are folded in batch by batch.
+
+    Per-question attempt and correct counters are kept together with the score
+    distribution, which doubles as an exact quantile sketch: the median and
+    percentiles are read from its distinct scores without keeping every score.
+    Its size is the number of distinct scores, which is small for right/wrong
+    grading but can approach the cohort size under scoring rules. Accumulators
+    built from different parts of a cohort can be merged.
+
+    With track_students enabled, each student's contribution is also kept as a
+    pair of per-question bitsets, so a late or re-submitted paper can be
+    removed or replaced in O(Q) without re-grading the cohort. Every result
+    that is added counts, as it does without tracking, so a student listed
+    more than once contributes once per result until replace_result or
+    remove_student supersedes them.
+
+    With item_analysis enabled, an ItemAnalysis is accumulated alongside and
+    reported under "item_analysis". It needs each student's chosen options,
+    which are not tracked, so it cannot be combined with track_students.
+    """
+
+    def __init__(self, question_ids: Sequence[str], track_students: bool = False, item_analysis: bool = False):
+        """
+        Initialize an empty accumulator.
+
+        Args:
+            question_ids: Question IDs in answer key order
+            track_students: Keep per-student contributions so they can be removed or replaced
+            item_analysis: Also accumulate distractor, discrimination and reliability statistics
+        """
+        if track_students and item_analysis:
+            raise ValueError("Item analysis cannot be combined with tracked student contributions")
+
+        self.question_ids = list(question_ids)
+        self.question_index = {q_id: i for i, q_id in enumerate(self.question_ids)}
+        self.attempts = [0] * len(self.question_ids)
+        self.correct = [0] * len(self.question_ids)
+        self.distribution = Counter()
+        self.students = {} if track_students else None
+        self.items = ItemAnalysis(question_ids) if item_analysis else None
+        self._matched_key = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.distribution.values())
+
+    def _apply(self, score: float, attempted_bits: int, correct_bits: int, sign: int) -> None:
+        """Add (sign=1) or subtract (sign=-1) one student's contribution."""
+        self.distribution[score] += sign
+        if not self.distribution[score]:
+            del self.distribution[score]
+
+        for counts, bits in ((self.attempts, attempted_bits), (self.correct, correct_bits)):
+            # bin() lists bits most significant first, so reverse it to get question order
+            for i, bit in enumerate(bin(bits)[:1:-1]):
+                if bit == "1":
+                    counts[i] += sign
+
+    def _same_questions(self, key) -> bool:
+        """Whether an encoded answer key has this accumulator's questions, remembering the last match."""
+        if key is not self._matched_key and key.question_ids == self.question_ids:
+            self._matched_key = key
+        return key is self._matched_key
+
+    def add_result(self, result: Dict[str, Any]) -> None:
+        """
+        Fold a single result dict into the statistics in O(Q).
+
+        Args:
+            result: Grading result for a single submission
+        """
+        if hasattr(result, "contribution") and self._same_questions(result.key):
+            # Compact results carry their bitsets, so the details need not be decoded
+            record = result.contribution()
+        else:
+            attempted_bits = 0
+            correct_bits = 0
+
+            for q_detail in result["question_details"]:
+                i = self.question_index.get(q_detail["question_id"])
+                if i is not None and q_detail["student_answer"] is not None:
+                    attempted_bits |= 1 << i
+                    if q_detail["is_correct"]:
+                        correct_bits |= 1 << i
+
+            record = (result["score_percentage"], attempted_bits, correct_bits)
+        if self.students is not None:
+            self.students.setdefault(result["student_id"], []).append(record)
+        self._apply(*record, 1)
+        if self.items is not None:
+            self.items.add_result(result)
+
+    def remove_student(self, student_id: str) -> None:
+        """
+        Remove every contribution of a tracked student in O(Q) per result.
+
+        Args:
+            student_id: Student to remove
+
+        Raises:
+            KeyError: If the student is not included in the statistics
+            ValueError: If the accumulator does not track students
+        """
+        if self.students is None:
+            raise ValueError("Student contributions are not tracked by this accumulator")
+        for record in self.students.pop(student_id):
+            self._apply(*record, -1)
+
+    def replace_result(self, result: Dict[str, Any]) -> None:
+        """
+        Add a result, replacing the student's previous contributions if present.
+
+        Args:
+            result: Grading result for a single submission
+        """
+        if self.students is not None and result["student_id"] in self.students:
+            self.remove_student(result["student_id"])
+        self.add_result(result)
+
+    def add_batch(self, batch) -> None:
+        """
+        Fold a GradedBatch into the statistics.
+
+        As with add_result, every row counts, including a student listed more
+        than once or already included.
+
+        Args:
+            batch: Columnar grading results
+        """
+        attempts, correct = batch.question_counts()
+        self.attempts = [a + b for a, b in zip(self.attempts, attempts.tolist())]
+        self.correct = [a + b for a, b in zip(self.correct, correct.tolist())]
+        self.distribution.update(batch.score_distribution())
+        if self.items is not None:
+            self.items.add_batch(batch)
+
+        if self.students is not None:
+            for student_id, record in zip(batch.student_ids, batch.contribution_records()):
+                self.students.setdefault(student_id, []).append(record)
+
+    def merge(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        """
+        Fold another accumulator for the same answer key into this one.
+
+        Args:
+            other: Accumulator to merge in
+
+        Returns:
+            This accumulator, for chaining
+        """
+        if other.question_ids != self.question_ids:
+            raise ValueError("Cannot merge statistics for different answer keys")
+        if (self.items is None) != (other.items is None):
+            raise ValueError("Cannot merge statistics with and without item analysis")
+
+        if self.students is not None:
+            if other.students is None:
+                raise ValueError("Cannot merge untracked statistics into a tracking accumulator")
+            for student_id, records in other.students.items():
+                self.students.setdefault(student_id, []).extend(records)
+
+        self.attempts = [a + b for a, b in zip(self.attempts, other.attempts)]
+        self.correct = [a + b for a, b in zip(self.correct, other.correct)]
+        self.distribution.update(other.distribution)
+        if self.items is not None:
+            self.items.merge(other.items)
+        return self
+
+    def to_statistics(self, extended: bool = False) -> Dict[str, Any]:
+        """
+        Produce the statistics dictionary written by export_statistics_json.
+
+        Args:
+            extended: Also report standard deviation, percentiles and a score histogram
+
+        Returns:
+            Dictionary containing statistical analysis
+        """
+        if not self.total:
+            return {"error": "No results to analyze"}
+
+        stats = summarize_scores(self.distribution, extended)
+        stats["question_analysis"] = analyze_questions(self.question_ids, self.attempts, self.correct)
+        if self.items is not None:
+            stats["item_analysis"] = self.items.report()
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serialize the accumulator into JSON-compatible data.
+
+        Returns:
+            Dictionary that from_dict turns back into an equal accumulator
+        """
+        data = {
+            "question_ids": self.question_ids,
+            "attempts": self.attempts,
+            "correct": self.correct,
+            "distribution": sorted([score, count] for score, count in self.distribution.items() if count),
+            "students": None,
+            "items": self.items.to_dict() if self.items is not None else None,
+        }
+
+        if self.students is not None:
+            data["students"] = {
+                student_id: [[score, format(attempted_bits, "x"), format(correct_bits, "x")]
+                             for score, attempted_bits, correct_bits in records]
+                for student_id, records in self.students.items()
+            }
+
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StatsAccumulator":
+        """
+        Rebuild an accumulator serialized with to_dict.
+
+        Args:
+            data: Serialized accumulator
+
+        Returns:
+            The restored StatsAccumulator
+        """
+        accumulator = cls(data["question_ids"], track_students=data.get("students") is not None)
+        accumulator.attempts = list(data["attempts"])
+        accumulator.correct = list(data["correct"])
+        accumulator.distribution = Counter({score: count for score, count in data["distribution"]})
+        if data.get("items") is not None:
+            accumulator.items = ItemAnalysis.from_dict(data["items"])
+
+        if accumulator.students is not None:
+            accumulator.students = {
+                student_id: [(score, int(attempted_bits, 16), int(correct_bits, 16))
+                             for score, attempted_bits, correct_bits in records]
+                for student_id, records in data["students"].items()
+            }
+
+        return accumulator
+
+
+def accumulator_path(stats_path: str) -> str:
+    """
+    Path of the accumulator file saved next to a statistics JSON file.
+
+    Args:
+        stats_path: Path of the exported statistics JSON
+
+    Returns:
+        Path ending in .accumulator.json alongside the statistics file
+    """
+    root, _ = os.path.splitext(stats_path)
+    return f"{root}.accumulator.json"
@@ -0,0 +1,483 @@
+import csv
+import json
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+from engine import EncodedAnswerKey, GradedBatch, OptionCodes
+from fileutil import atomic_write, temp_path
+
+# Output formats for graded results and their file extensions
+RESULT_FORMATS = {"csv": ".csv", "binary": ".mcqr"}
+
+# File layout: magic, format version, header length, JSON header, aligned sections
+MAGIC = b"MCQR"
+VERSION = 1
+_PREAMBLE = struct.Struct("<4sIQ")
+_ALIGN = 64
+
+# Sections in file order: name -> dtype (answers use the dtype recorded in the header)
+_SECTIONS = [
+    ("answers", None),
+    ("correct_bits", np.uint8),
+    ("scores", np.float64),
+    ("attempted", np.int32),
+    ("correct_count", np.int32),
+    ("id_offsets", np.int64),
+    ("id_blob", np.uint8),
+    ("id_order", np.int64),
+]
+
+
+def is_results_store(results_path: str) -> bool:
+    """Whether a results path names a binary results store rather than a CSV."""
+    return results_path.endswith(RESULT_FORMATS["binary"])
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _layout(sizes: Dict[str, int]) -> Tuple[Dict[str, List[int]], int]:
+    """Place sections of the given sizes in file order, returning their [offset, size] and the data length."""
+    sections = {}
+    offset = 0
+    for name, _ in _SECTIONS:
+        sections[name] = [offset, sizes[name]]
+        offset = _aligned(offset + sizes[name])
+    return sections, offset
+
+
+class CsvResultsWriter:
+    """
+    Writes graded batches to the wide results CSV as they are produced.
+
+    Rows go to a temporary file that replaces the target on close, so readers
+    never see a partially written CSV.
+    """
+
+    def __init__(self, filepath: str, key: EncodedAnswerKey):
+        self.filepath = filepath
+        self.tmp_path = temp_path(filepath)
+        self.f = open(self.tmp_path, 'w', newline='')
+        self.writer = csv.writer(self.f, lineterminator="\n")
+        self.writer.writerow(key.csv_header())
+
+    def add_batch(self, batch: GradedBatch) -> None:
+        self.writer.writerows(batch.iter_csv_rows())
+
+    def write_rows(self, text: str) -> None:
+        """Append CSV rows already rendered by a worker process."""
+        self.f.write(text)
+
+    def close(self) -> None:
+        self.f.close()
+        os.replace(self.tmp_path, self.filepath)
+
+    def discard(self) -> None:
+        """Abandon the output, leaving any previous file in place."""
+        self.f.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ResultsStoreWriter:
+    """
+    Writes graded batches to a columnar binary results store.
+
+    The store holds one answer code per question per student (int8 unless the
+    answers use more than 128 distinct options, then int16 or int32), a correctness bitmap, the
+    score columns and a sorted student ID index. Columns are spooled to
+    temporary files while batches arrive and assembled on close, so memory use
+    does not depend on the cohort size apart from the student IDs.
+    """
+
+    def __init__(self, filepath: str, key: EncodedAnswerKey, timestamp: str):
+        self.filepath = filepath
+        self.key = key
+        self.timestamp = timestamp
+        self.student_ids = []
+        self.answer_dtype = np.int8
+        self.spool_dir = tempfile.mkdtemp(prefix=".mcqr-", dir=os.path.dirname(filepath) or ".")
+        self.spools = {
+            name: open(os.path.join(self.spool_dir, name), 'w+b')
+            for name in ("answers", "correct_bits", "scores", "attempted", "correct_count")
+        }
+
+    def add_batch(self, batch: GradedBatch) -> None:
+        """
+        Append a graded batch to the store.
+
+        Args:
+            batch: Columnar grading results for the store's answer key
+        """
+        if batch.answers.dtype.itemsize > np.dtype(self.answer_dtype).itemsize:
+            self._widen_answers(batch.answers.dtype.type)
+
+        self.student_ids.extend(str(student_id) for student_id in batch.student_ids)
+        self.spools["answers"].write(batch.answers.astype(self.answer_dtype).tobytes())
+        self.spools["correct_bits"].write(np.packbits(batch.correct, axis=1, bitorder="little").tobytes())
+        self.spools["scores"].write(batch.scores.astype(np.float64).tobytes())
+        self.spools["attempted"].write(batch.attempted.astype(np.int32).tobytes())
+        self.spools["correct_count"].write(batch.correct_count.astype(np.int32).tobytes())
+
+    def _widen_answers(self, dtype: type) -> None:
+        """Rewrite the spooled answer codes with a wider type once the options no longer fit."""
+        spool = self.spools["answers"]
+        spool.seek(0)
+        widened = np.frombuffer(spool.read(), dtype=self.answer_dtype).astype(dtype)
+        spool.seek(0)
+        spool.truncate()
+        spool.write(widened.tobytes())
+        self.answer_dtype = dtype
+
+    def close(self) -> None:
+        """
+        Assemble the spooled columns and the student ID index into the store file.
+        """
+        encoded_ids = [student_id.encode("utf-8") for student_id in self.student_ids]
+        id_offsets = np.zeros(len(encoded_ids) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded_ids], out=id_offsets[1:])
+        id_order = np.array(sorted(range(len(encoded_ids)), key=encoded_ids.__getitem__), dtype=np.int64)
+
+        extra = {
+            "id_offsets": id_offsets.tobytes(),
+            "id_blob": b"".join(encoded_ids),
+            "id_order": id_order.tobytes(),
+        }
+
+        sizes = {}
+        for name, spool in self.spools.items():
+            sizes[name] = spool.seek(0, os.SEEK_END)
+        for name, data in extra.items():
+            sizes[name] = len(data)
+
+        sections, offset = _layout(sizes)
+
+        header = json.dumps({
+            "students": len(encoded_ids),
+            "question_ids": self.key.question_ids,
+            "correct_answers": list(self.key.answer_key.values()),
+            "options": self.key.codes.options,
+            "scoring": self.key.scoring,
+            "timestamp": self.timestamp,
+            "answer_dtype": np.dtype(self.answer_dtype).name,
+            "sections": sections,
+        }).encode("utf-8")
+        data_start = _aligned(_PREAMBLE.size + len(header))
+
+        with atomic_write(self.filepath, 'wb') as out:
+            out.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            out.write(header)
+
+            for name, _ in _SECTIONS:
+                out.seek(data_start + sections[name][0])
+                if name in self.spools:
+                    spool = self.spools[name]
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, out)
+                else:
+                    out.write(extra[name])
+
+            out.truncate(data_start + offset)
+
+        self._discard_spools()
+
+    def _discard_spools(self) -> None:
+        for spool in self.spools.values():
+            spool.close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard_spools()
+
+
+def write_results_store(batch: GradedBatch, filepath: str) -> str:
+    """
+    Write a single graded batch to a binary results store.
+
+    Args:
+        batch: Columnar grading results
+        filepath: Path of the store file to create
+
+    Returns:
+        Path to the created store file
+    """
+    with ResultsStoreWriter(filepath, batch.key, batch.timestamp) as writer:
+        writer.add_batch(batch)
+    return filepath
+
+
+def rewrite_results_store(store: "ResultsStore", key: EncodedAnswerKey, columns: Dict[str, np.ndarray],
+                          timestamp: str) -> str:
+    """
+    Write a results store again with a new answer key and some columns replaced.
+
+    Sections that are not replaced are copied from the old file as they are.
+    The new file replaces the old one atomically, so readers still mapping the
+    old store keep a consistent view of it.
+
+    Args:
+        store: Open results store to rewrite
+        key: Encoded answer key the replaced columns were graded with
+        columns: Replacement arrays by section name
+        timestamp: Grading timestamp recorded in the new store
+
+    Returns:
+        Path to the rewritten store file
+    """
+    dtypes = dict(_SECTIONS)
+    data = {name: np.ascontiguousarray(array, dtype=dtypes[name]) for name, array in columns.items()}
+    for name, _ in _SECTIONS:
+        if name not in data:
+            data[name] = np.ascontiguousarray(store.columns[name])
+
+    sections, end = _layout({name: array.nbytes for name, array in data.items()})
+    header = json.dumps(dict(store.header, correct_answers=list(key.answer_key.values()),
+                             options=key.codes.options, scoring=key.scoring, timestamp=timestamp,
+                             sections=sections)).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header))
+
+    with atomic_write(store.filepath, 'wb') as out:
+        out.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        out.write(header)
+        for name, _ in _SECTIONS:
+            out.seek(data_start + sections[name][0])
+            out.write(data[name].data)
+        out.truncate(data_start + end)
+
+    return store.filepath
+
+
+class ResultsStore:
+    """
+    Read-only, memory-mapped view of a binary results store.
+
+    Opening a store only parses its header; columns are mapped lazily and a
+    single student is found by binary search over the sorted ID index.
+    """
+
+    def __init__(self, filepath: str):
+        """
+        Open a results store.
+
+        Args:
+            filepath: Path of the store file
+        """
+        self.filepath = filepath
+
+        with open(filepath, 'rb') as f:
+            magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not a version {VERSION} results store: {filepath}")
+            self.header = json.loads(f.read(header_len))
+
+        self.data_start = _aligned(_PREAMBLE.size + header_len)
+        self.question_ids = self.header["question_ids"]
+        self.answer_key = dict(zip(self.question_ids, self.header["correct_answers"]))
+        self.options = self.header["options"]
+        self.scoring = self.header.get("scoring")
+        self.timestamp = self.header["timestamp"]
+
+        n = self.header["students"]
+        q = len(self.question_ids)
+        shapes = {
+            "answers": (n, q),
+            "correct_bits": (n, (q + 7) // 8),
+        }
+        dtypes = dict(_SECTIONS)
+        dtypes["answers"] = np.dtype(self.header["answer_dtype"])
+
+        self.columns = {}
+        for name, (offset, nbytes) in self.header["sections"].items():
+            dtype = np.dtype(dtypes[name])
+            shape = shapes.get(name, (nbytes // dtype.itemsize,))
+            if nbytes == 0:
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(filepath, dtype=dtype, mode='r',
+                                               offset=self.data_start + offset, shape=shape)
+
+    def __len__(self) -> int:
+        return self.header["students"]
+
+    @property
+    def answers(self) -> np.ndarray:
+        return self.columns["answers"]
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self.columns["scores"]
+
+    def student_id(self, index: int) -> str:
+        """
+        Student ID stored at a row.
+
+        Args:
+            index: Row index
+
+        Returns:
+            The student ID
+        """
+        offsets = self.columns["id_offsets"]
+        return bytes(self.columns["id_blob"][offsets[index]:offsets[index + 1]]).decode("utf-8")
+
+    def student_ids(self, start: int = 0, stop: int = None) -> List[str]:
+        """
+        Student IDs in row order.
+
+        Args:
+            start: First row
+            stop: Row after the last one, defaults to the end of the store
+
+        Returns:
+            List of student IDs
+        """
+        stop = len(self) if stop is None else stop
+        offsets = self.columns["id_offsets"][start:stop + 1].tolist()
+        if len(offsets) < 2:
+            return []
+        blob = bytes(self.columns["id_blob"][offsets[0]:offsets[-1]]).decode("utf-8")
+        base = offsets[0]
+        # Offsets count bytes, so decode per ID when the blob is not pure ASCII
+        if len(blob) != offsets[-1] - base:
+            return [self.student_id(i) for i in range(start, stop)]
+        return [blob[begin - base:end - base] for begin, end in zip(offsets, offsets[1:])]
+
+    def find(self, student_id: str) -> Optional[int]:
+        """
+        Find the row of a student by binary search over the ID index.
+
+        Args:
+            student_id: Student to look up
+
+        Returns:
+            Row index, or None if the student is not in the store
+        """
+        target = str(student_id).encode("utf-8")
+        order = self.columns["id_order"]
+        offsets = self.columns["id_offsets"]
+        blob = self.columns["id_blob"]
+
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = order[mid]
+            if bytes(blob[offsets[row]:offsets[row + 1]]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(order):
+            row = int(order[lo])
+            if bytes(blob[offsets[row]:offsets[row + 1]]) == target:
+                return row
+        return None
+
+    def correct_row(self, index: int) -> np.ndarray:
+        """
+        Correctness flags of one student.
+
+        Args:
+            index: Row index
+
+        Returns:
+            Boolean array in answer key order
+        """
+        bits = np.unpackbits(self.columns["correct_bits"][index], bitorder="little")
+        return bits[:len(self.question_ids)].astype(bool)
+
+    def result(self, index: int) -> Dict[str, Any]:
+        """
+        Build the grade_submission-style result dict for one row.
+
+        Args:
+            index: Row index
+
+        Returns:
+            Dictionary containing grading results and feedback
+        """
+        options = self.options
+        details = [
+            {
+                "question_id": q_id,
+                "correct_answer": correct_answer,
+                "student_answer": options[code] if code >= 0 else None,
+                "is_correct": is_correct,
+            }
+            for q_id, correct_answer, code, is_correct in zip(
+                self.question_ids,
+                self.answer_key.values(),
+                self.answers[index].tolist(),
+                self.correct_row(index).tolist(),
+            )
+        ]
+
+        return {
+            "student_id": self.student_id(index),
+            "timestamp": self.timestamp,
+            "questions_total": len(self.question_ids),
+            "questions_attempted": int(self.columns["attempted"][index]),
+            "correct_answers": int(self.columns["correct_count"][index]),
+            "score_percentage": float(self.scores[index]),
+            "question_details": details,
+        }
+
+    def get(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up one student's result by ID.
+
+        Args:
+            student_id: Student to look up
+
+        Returns:
+            Result dict, or None if the student is not in the store
+        """
+        index = self.find(student_id)
+        return None if index is None else self.result(index)
+
+    def batch(self, start: int = 0, stop: int = None) -> GradedBatch:
+        """
+        View a range of rows as a GradedBatch backed by the mapped columns.
+
+        Args:
+            start: First row
+            stop: Row after the last one, defaults to the end of the store
+
+        Returns:
+            GradedBatch for statistics or re-export
+        """
+        stop = len(self) if stop is None else stop
+        key = EncodedAnswerKey(self.answer_key, OptionCodes.from_options(self.options), self.scoring)
+        correct = np.unpackbits(self.columns["correct_bits"][start:stop], axis=1, bitorder="little",
+                                count=len(self.question_ids)).astype(bool)
+        return GradedBatch(key, self.student_ids(start, stop), self.answers[start:stop], correct,
+                           self.columns["attempted"][start:stop], self.columns["correct_count"][start:stop],
+                           self.scores[start:stop], self.timestamp)
+
+    def to_batch(self) -> GradedBatch:
+        """
+        View the whole store as a GradedBatch backed by the mapped columns.
+
+        Returns:
+            GradedBatch for statistics or re-export
+        """
+        return self.batch()
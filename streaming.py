@@ -0,0 +1,203 @@
+import json
+import os
+from itertools import islice
+from typing import List, Dict, Any, Callable, Iterable, Iterator, TextIO
+
+# Characters read from the submissions file per refill of the parse buffer
+READ_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+
+# Characters that may follow a complete array element
+_DELIMITERS = " \t\r\n,]"
+
+
+def iter_json_array(f: TextIO, read_size: int = READ_SIZE) -> Iterator[Any]:
+    """
+    Incrementally parse the elements of a top-level JSON array.
+
+    Only a bounded window of the file is held in memory, so arbitrarily large
+    arrays can be read element by element.
+
+    Args:
+        f: Text file positioned at the opening bracket of the array
+        read_size: Number of characters to read per refill
+
+    Yields:
+        Each element of the array
+
+    Raises:
+        json.JSONDecodeError: If the array is malformed, has a trailing comma,
+            or is followed by anything but whitespace
+    """
+    buf = f.read(read_size).lstrip()
+    while not buf:
+        chunk = f.read(read_size)
+        if not chunk:
+            break
+        buf = chunk.lstrip()
+    if not buf.startswith("["):
+        raise json.JSONDecodeError("Expected a JSON array", buf, 0)
+
+    pos = 1
+    eof = False
+    expect_value = True
+    empty = True
+
+    while True:
+        # Skip whitespace and separators
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            if buf[pos] == ",":
+                if expect_value:
+                    raise json.JSONDecodeError("Expecting value", buf, pos)
+                expect_value = True
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == "]":
+            if expect_value and not empty:
+                raise json.JSONDecodeError("Expecting value", buf, pos)
+            _expect_end(f, buf[pos + 1:], read_size)
+            return
+
+        if pos < len(buf):
+            try:
+                value, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A value is only complete once the character after it is seen
+                if end < len(buf) and buf[end] in _DELIMITERS:
+                    if not expect_value:
+                        raise json.JSONDecodeError("Expected ',' between array elements", buf, pos)
+                    yield value
+                    pos = end
+                    expect_value = False
+                    empty = False
+                    continue
+                if eof and end < len(buf):
+                    raise json.JSONDecodeError("Expected ',' or ']'", buf, end)
+
+        if eof:
+            raise json.JSONDecodeError("Unterminated JSON array", buf, pos)
+
+        chunk = f.read(read_size)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def _expect_end(f: TextIO, rest: str, read_size: int) -> None:
+    """Raise if anything but whitespace follows the closing bracket, as json.load does."""
+    while True:
+        stripped = rest.lstrip()
+        if stripped:
+            raise json.JSONDecodeError("Extra data", rest, len(rest) - len(stripped))
+        rest = f.read(read_size)
+        if not rest:
+            return
+
+
+def iter_json_lines(f: TextIO) -> Iterator[Any]:
+    """
+    Parse a JSON Lines file one record at a time.
+
+    Args:
+        f: Text file with one JSON value per line
+
+    Yields:
+        Each non-blank line decoded as JSON
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_submissions(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """
+    Stream submissions from a JSON array or a JSON Lines file.
+
+    The format is detected from the first non-whitespace character.
+
+    Args:
+        f: Text file containing the submissions
+
+    Yields:
+        Submission dictionaries, each containing student_id and answers
+    """
+    first = ""
+    while True:
+        ch = f.read(1)
+        if not ch or not ch.isspace():
+            first = ch
+            break
+
+    if first == "[":
+        yield from iter_json_array(_Prepend(first, f))
+    elif first:
+        yield from iter_json_lines(_Prepend(first, f))
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of at most size items.
+
+    Args:
+        iterable: Items to split
+        size: Maximum number of items per chunk
+
+    Yields:
+        Consecutive chunks of items
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Prepend:
+    """Text file wrapper that replays characters already consumed for sniffing."""
+
+    def __init__(self, prefix: str, f: TextIO):
+        self.prefix = prefix
+        self.f = f
+
+    def read(self, size: int = -1) -> str:
+        prefix, self.prefix = self.prefix, ""
+        if size is None or size < 0:
+            return prefix + self.f.read()
+        return prefix + self.f.read(max(size - len(prefix), 0))
+
+    def __iter__(self) -> Iterator[str]:
+        prefix, self.prefix = self.prefix, ""
+        first = prefix + self.f.readline()
+        if first:
+            yield first
+        yield from self.f
+
+
+def report_progress(chunks: Iterable[List[Any]], f: TextIO,
+                    callback: Callable[[int, float], None]) -> Iterator[List[Any]]:
+    """
+    Pass chunks through while reporting how far into the file they reach.
+
+    Args:
+        chunks: Chunks of records read from f
+        f: Text file the chunks are read from
+        callback: Called with (records so far, fraction of the file read) after each chunk is consumed
+
+    Yields:
+        The chunks unchanged
+    """
+    size = os.fstat(f.fileno()).st_size
+    count = 0
+
+    for chunk in chunks:
+        yield chunk
+
+        # Resumed once the consumer has finished with the chunk. The binary
+        # buffer's position includes read-ahead, so the fraction is an estimate.
+        count += len(chunk)
+        callback(count, min(f.buffer.tell() / size, 1.0) if size else 1.0)
@@ -0,0 +1,227 @@
+import csv
+import hashlib
+import io
+import os
+import struct
+import numpy as np
+from typing import List, Optional
+
+from fileutil import atomic_write
+
+# File layout: magic, format version, slot count, then the hash table slots
+MAGIC = b"MCQI"
+VERSION = 1
+_PREAMBLE = struct.Struct("<4sIQ")
+_SLOT = np.dtype([("hash", "<u8"), ("offset", "<i8")])
+
+# Offset marking an empty hash table slot
+EMPTY = -1
+
+
+def index_path(results_path: str) -> str:
+    """
+    Path of the student index written next to a results CSV.
+
+    Args:
+        results_path: Path of the results CSV
+
+    Returns:
+        Path ending in .idx alongside the results file
+    """
+    return f"{results_path}.idx"
+
+
+def _hash(student_id: str) -> int:
+    # Python's hash() is salted per process, so use a stable 64-bit digest
+    return int.from_bytes(hashlib.blake2b(str(student_id).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class StudentIndexWriter:
+    """
+    Builds an on-disk open-addressing hash table from student ID to byte offset.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.hashes = []
+        self.offsets = []
+
+    def add(self, student_id: str, offset: int) -> None:
+        """
+        Record where a student's row starts.
+
+        Args:
+            student_id: Student ID of the row
+            offset: Byte offset of the row in the results file
+        """
+        self.hashes.append(_hash(student_id))
+        self.offsets.append(offset)
+
+    def close(self) -> None:
+        """
+        Write the hash table, sized to at most half full.
+        """
+        slot_count = 1
+        while slot_count < 2 * len(self.hashes):
+            slot_count <<= 1
+
+        slots = np.zeros(slot_count, dtype=_SLOT)
+        slots["offset"] = EMPTY
+        mask = slot_count - 1
+        table_hashes = slots["hash"]
+        table_offsets = slots["offset"]
+
+        # Linear probing; duplicate student IDs keep their first row, like a CSV scan would
+        for h, offset in zip(self.hashes, self.offsets):
+            i = h & mask
+            while table_offsets[i] != EMPTY:
+                i = (i + 1) & mask
+            table_hashes[i] = h
+            table_offsets[i] = offset
+
+        with atomic_write(self.filepath, 'wb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, VERSION, slot_count))
+            f.write(slots.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+
+
+class StudentIndex:
+    """
+    Memory-mapped student index; a lookup touches O(1) slots regardless of cohort size.
+    """
+
+    def __init__(self, filepath: str):
+        with open(filepath, 'rb') as f:
+            magic, version, slot_count = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} student index: {filepath}")
+
+        self.mask = slot_count - 1
+        self.slots = np.memmap(filepath, dtype=_SLOT, mode='r', offset=_PREAMBLE.size, shape=(slot_count,))
+
+    def candidates(self, student_id: str) -> List[int]:
+        """
+        Byte offsets of rows whose student ID hashes like the given one.
+
+        Args:
+            student_id: Student to look up
+
+        Returns:
+            Candidate offsets in insertion order (almost always zero or one)
+        """
+        h = _hash(student_id)
+        i = h & self.mask
+        offsets = []
+
+        while True:
+            slot_hash, offset = self.slots[i].tolist()
+            if offset == EMPTY:
+                return offsets
+            if slot_hash == h:
+                offsets.append(offset)
+            i = (i + 1) & self.mask
+
+
+def _parse_record(record: bytes) -> List[str]:
+    return next(csv.reader(io.StringIO(record.decode("utf-8"), newline="")), [])
+
+
+def _first_field(record: bytes) -> str:
+    if record.startswith(b'"'):
+        return _parse_record(record)[0]
+    return record[:record.find(b",")].decode("utf-8")
+
+
+def _read_record(f, offset: int) -> bytes:
+    """Read one CSV record starting at offset, following quoted newlines."""
+    f.seek(offset)
+    record = f.readline()
+    while record.count(b'"') % 2:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def build_csv_index(csv_path: str) -> str:
+    """
+    Index a results CSV by student ID in one sequential pass.
+
+    Args:
+        csv_path: Path of the results CSV
+
+    Returns:
+        Path to the created index file
+    """
+    filepath = index_path(csv_path)
+
+    with open(csv_path, 'rb') as f, StudentIndexWriter(filepath) as writer:
+        offset = len(f.readline())
+        record = b""
+        start = offset
+
+        for line in f:
+            if not record:
+                start = offset
+            record += line
+            offset += len(line)
+
+            # An odd number of quotes means a quoted field continues on the next line
+            if record.count(b'"') % 2:
+                continue
+
+            if record.strip():
+                writer.add(_first_field(record), start)
+            record = b""
+
+    return filepath
+
+
+def read_csv_header(csv_path: str) -> List[str]:
+    """
+    Column names of a results CSV.
+
+    Args:
+        csv_path: Path of the results CSV
+
+    Returns:
+        List of column names
+    """
+    with open(csv_path, 'rb') as f:
+        return _parse_record(_read_record(f, 0))
+
+
+def lookup_csv_row(csv_path: str, student_id: str, index: StudentIndex = None) -> Optional[List[str]]:
+    """
+    Read one student's row from a results CSV by seeking to its indexed offset.
+
+    The index is built on first use if it is missing or older than the CSV.
+
+    Args:
+        csv_path: Path of the results CSV
+        student_id: Student to look up
+        index: Optional already opened index for the CSV
+
+    Returns:
+        List of cell values, or None if the student is not in the file
+    """
+    if index is None:
+        idx_path = index_path(csv_path)
+        if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(csv_path):
+            build_csv_index(csv_path)
+        index = StudentIndex(idx_path)
+
+    with open(csv_path, 'rb') as f:
+        for offset in index.candidates(student_id):
+            row = _parse_record(_read_record(f, offset))
+            if row and row[0] == str(student_id):
+                return row
+
+    return None